@@ -1,7 +1,10 @@
+import os
+import threading
 from flask import Flask
-from flask_mysqldb import MySQL
 from flask_cors import CORS
-mysql = MySQL()
+import db_router
+from db_router import RoutedMySQL
+mysql = RoutedMySQL()
 
 def create_app():
     app = Flask(__name__)
@@ -12,10 +15,21 @@ def create_app():
     app.config['MYSQL_PASSWORD'] = 'password'
     app.config['MYSQL_DB'] = 'eczanemtakipdb'
     app.config['MYSQL_CHARSET'] = 'utf8mb4'
+    # Optional read replica for the analysis and listing endpoints (db_router.py)
+    app.config['MYSQL_REPLICA_HOST'] = os.environ.get('MYSQL_REPLICA_HOST')
+    app.config['READ_YOUR_WRITES_SECONDS'] = 10
     app.config['UPLOAD_FOLDER'] = 'uploads/'
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+    app.config['BARCODE_CACHE_SIZE'] = 20000
+    app.config['BARCODE_CACHE_TTL'] = 300
+    app.config['CATALOG_SNAPSHOT_PATH'] = 'snapshots/catalog.snap'
+    app.config['EXPIRY_SCAN_INTERVAL'] = 600
+    app.config['ANALYSIS_CACHE_TTL'] = 60
+    app.config['ANALYSIS_CACHE_SIZE'] = 512
+    app.config['RESERVATION_RECLAIM_INTERVAL'] = 60
     CORS(app)
     mysql.init_app(app)
+    db_router.init_app(app)
 
     from medicine_app import medicine_bp
     from analysis import analysis_bp
@@ -33,4 +47,44 @@ def create_app():
     app.register_blueprint(route_bp, url_prefix='')
     app.register_blueprint(nlp_bp, url_prefix='/api/nlp')
     app.register_blueprint(supplier_bp, url_prefix='/api/supplier')
+
+    from barcode_cache import barcode_cache
+    from medicine_search import search_index
+    from catalog_snapshot import load_snapshot, register_commands
+    from expiry_scanner import expiry_scanner
+    from stock_reservations import reservation_view
+    from response_cache import response_cache
+    from top_sellers import top_sellers
+    register_commands(app, mysql)
+    barcode_cache.capacity = app.config.get('BARCODE_CACHE_SIZE', barcode_cache.capacity)
+    barcode_cache.ttl = app.config.get('BARCODE_CACHE_TTL', barcode_cache.ttl)
+    response_cache.ttl = app.config.get('ANALYSIS_CACHE_TTL', response_cache.ttl)
+    response_cache.max_size = app.config.get('ANALYSIS_CACHE_SIZE', response_cache.max_size)
+    with app.app_context():
+        try:
+            # A current catalog snapshot saves reading the whole catalog from MySQL at boot
+            snapshot = load_snapshot(mysql.connection, app.config['CATALOG_SNAPSHOT_PATH'])
+            if snapshot:
+                rows = snapshot.medicine_rows()
+                search_index.load_rows(rows)
+                barcode_cache.fill(rows)
+            else:
+                barcode_cache.warm_up(mysql.connection)
+            top_sellers.rebuild(mysql.connection)
+        except Exception as e:
+            # The database may not be up yet; the caches then fill on demand
+            app.logger.warning(f"Catalog warm-up skipped: {str(e)}")
+
+    # Background threads start with the first request, so `flask` CLI commands never run them
+    started = threading.Lock()
+
+    @app.before_request
+    def start_background_jobs():
+        if not started.acquire(blocking=False):
+            return
+        if app.config.get('EXPIRY_SCANNER_ENABLED', True):
+            expiry_scanner.start(app, mysql, app.config['EXPIRY_SCAN_INTERVAL'])
+        reservation_view.start_reclaimer(app, mysql, app.config['RESERVATION_RECLAIM_INTERVAL'])
+        search_index.start_refresher(app, mysql)
+
     return app
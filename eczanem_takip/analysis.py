@@ -1,112 +1,123 @@
 import pandas as pd
 import MySQLdb
 from flask import Blueprint, jsonify, request, render_template
-from flask_mysqldb import MySQL
+from db_router import RoutedMySQL, use_replica
 
-mysql = MySQL()
+mysql = RoutedMySQL()
 analysis_bp = Blueprint('analysis', __name__)
+# Every analysis endpoint only reads; their queries go to the replica when one is configured
+analysis_bp.before_request(use_replica)
 
 
 from flask import jsonify
+import click
+import datetime
 import MySQLdb.cursors
+from models.SalesRollup import SalesRollup
+from response_cache import response_cache, cached_response
+from models.StockSummary import StockSummary
+from models.Medicine import Medicine
+import demand_forecast
+import sales_series
+from top_sellers import top_sellers, MAX_SKETCH_X
+
+SALES_WINDOW_METRICS = ('total_sales_last_month', 'average_monthly_sales_last_year',
+                        'total_sales_last_three_months', 'average_sales_last_six_months')
+MAX_ANALYSIS_IDS = 1000
+
+
+def _sales_windows(cursor, medicine_ids=None, user_id=None):
+    # All four sales windows of each medicine in one pass over its last year of daily sales.
+    # The inner query buckets the year by calendar month and splits each bucket into the shorter windows with
+    # conditional sums; a bucket with no sales in a window sums to NULL, so AVG skips it exactly like the
+    # separate per-window queries did.
+    source, params = SalesRollup.source(user_id=user_id, months=12, medicine_ids=medicine_ids)
+
+    cursor.execute(f"""
+        SELECT
+            medicine_id,
+            SUM(last_month_sales) AS total_sales_last_month,
+            AVG(monthly_sales) AS average_monthly_sales_last_year,
+            SUM(last_three_months_sales) AS total_sales_last_three_months,
+            AVG(last_six_months_sales) AS average_sales_last_six_months
+        FROM (
+            SELECT
+                medicine_id,
+                DATE_FORMAT(sale_date, '%%Y-%%m') AS month,
+                SUM(quantity) AS monthly_sales,
+                SUM(CASE WHEN sale_date >= CURDATE() - INTERVAL 1 MONTH THEN quantity END) AS last_month_sales,
+                SUM(CASE WHEN sale_date >= CURDATE() - INTERVAL 3 MONTH THEN quantity END) AS last_three_months_sales,
+                SUM(CASE WHEN sale_date >= CURDATE() - INTERVAL 6 MONTH THEN quantity END) AS last_six_months_sales
+            FROM
+                {source} AS daily_sales
+            GROUP BY
+                medicine_id, DATE_FORMAT(sale_date, '%%Y-%%m')
+        ) AS monthly_sales_data
+        GROUP BY medicine_id
+    """, tuple(params))
+
+    # Handle Decimal type (convert to float)
+    return {row['medicine_id']: {metric: float(row[metric] or 0) for metric in SALES_WINDOW_METRICS}
+            for row in cursor.fetchall()}
+
+
+def _empty_sales_windows():
+    return {metric: 0.0 for metric in SALES_WINDOW_METRICS}
+
 
 @analysis_bp.route('/for_sale_analysis/<int:medicine_id>', methods=['POST'])
+@cached_response
 def for_sale_analysis(medicine_id):
     try:
-        # Open database connection
         cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+        windows = _sales_windows(cursor, [medicine_id])
+        cursor.close()
 
-        # Query 1: Total Sales in the Last Month
-        query_total_sales_last_month = """
-            SELECT 
-                SUM(quantity) AS total_sales_last_month
-            FROM 
-                medicine_sales
-            WHERE 
-                medicine_id = %s
-                AND sale_date >= CURDATE() - INTERVAL 1 MONTH;
-        """
-        cursor.execute(query_total_sales_last_month, (medicine_id,))
-        total_sales_last_month = cursor.fetchone()['total_sales_last_month']
-
-        # Query 2: Average Monthly Sales in the Last Year
-        query_avg_monthly_sales_last_year = """
-            SELECT 
-                AVG(monthly_sales) AS average_monthly_sales_last_year
-            FROM (
-                SELECT 
-                    DATE_FORMAT(sale_date, '%%Y-%%m') AS month,
-                    SUM(quantity) AS monthly_sales
-                FROM 
-                    medicine_sales
-                WHERE 
-                    medicine_id = %s
-                    AND sale_date >= CURDATE() - INTERVAL 1 YEAR
-                GROUP BY 
-                    DATE_FORMAT(sale_date, '%%Y-%%m')
-            ) AS monthly_sales_data;
-        """
-        cursor.execute(query_avg_monthly_sales_last_year, (medicine_id,))
-        avg_monthly_sales_last_year = cursor.fetchone()['average_monthly_sales_last_year']
-
-        # Query 3: Total Sales in the Last 3 Months
-        query_total_sales_last_three_months = """
-            SELECT 
-                SUM(quantity) AS total_sales_last_three_months
-            FROM 
-                medicine_sales
-            WHERE 
-                medicine_id = %s
-                AND sale_date >= CURDATE() - INTERVAL 3 MONTH;
-        """
-        cursor.execute(query_total_sales_last_three_months, (medicine_id,))
-        total_sales_last_three_months = cursor.fetchone()['total_sales_last_three_months']
-
-        # Query 4: Average Sales in the Last 6 Months
-        query_avg_sales_last_six_months = """
-            SELECT 
-                AVG(monthly_sales) AS average_sales_last_six_months
-            FROM (
-                SELECT 
-                    DATE_FORMAT(sale_date, '%%Y-%%m') AS month,
-                    SUM(quantity) AS monthly_sales
-                FROM 
-                    medicine_sales
-                WHERE 
-                    medicine_id = %s
-                    AND sale_date >= CURDATE() - INTERVAL 6 MONTH
-                GROUP BY 
-                    DATE_FORMAT(sale_date, '%%Y-%%m')
-            ) AS six_months_sales_data;
-        """
-        cursor.execute(query_avg_sales_last_six_months, (medicine_id,))
-        avg_sales_last_six_months = cursor.fetchone()['average_sales_last_six_months']
+        # Prepare the JSON response
+        response = {"success": True, "medicine_id": medicine_id}
+        response.update(windows.get(medicine_id, _empty_sales_windows()))
+        return jsonify(response), 200
 
-        # Close cursor
-        cursor.close()
+    except Exception as e:
+        return jsonify({"success": False, "message": "Failed to fetch sales analysis", "error": str(e)}), 500
 
-        # Handle Decimal type (if necessary, convert to float)
-        total_sales_last_month = float(total_sales_last_month or 0)
-        avg_monthly_sales_last_year = float(avg_monthly_sales_last_year or 0)
-        total_sales_last_three_months = float(total_sales_last_three_months or 0)
-        avg_sales_last_six_months = float(avg_sales_last_six_months or 0)
 
-        # Prepare the JSON response
-        response = {
-            "success": True,
-            "medicine_id": medicine_id,
-            "total_sales_last_month": total_sales_last_month,
-            "average_monthly_sales_last_year": avg_monthly_sales_last_year,
-            "total_sales_last_three_months": total_sales_last_three_months,
-            "average_sales_last_six_months": avg_sales_last_six_months
-        }
+@analysis_bp.route('/for_sale_analysis', methods=['POST'])
+@cached_response
+def for_sale_analysis_batch():
+    # The for_sale_analysis metrics for many medicines in one call: `medicine_ids`, or every medicine the user
+    # sold in the last year when only `user_id` is given (user_id also limits the sales to that user's)
+    data = request.get_json() or {}
+    medicine_ids = data.get('medicine_ids')
+    user_id = data.get('user_id')
+
+    if medicine_ids is None and not user_id:
+        return jsonify({"success": False, "message": "medicine_ids or user_id is required"}), 400
+    if medicine_ids is not None:
+        try:
+            medicine_ids = sorted({int(medicine_id) for medicine_id in medicine_ids})
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "medicine_ids must be a list of integers"}), 400
+        if not medicine_ids:
+            return jsonify({"success": True, "analysis": []}), 200
+        if len(medicine_ids) > MAX_ANALYSIS_IDS:
+            return jsonify({"success": False, "message": f"At most {MAX_ANALYSIS_IDS} medicines per request"}), 400
 
-        return jsonify(response), 200
+    try:
+        cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+        windows = _sales_windows(cursor, medicine_ids, user_id)
+        cursor.close()
+
+        ids = medicine_ids if medicine_ids is not None else sorted(windows)
+        analysis = [dict(medicine_id=medicine_id, **windows.get(medicine_id, _empty_sales_windows()))
+                    for medicine_id in ids]
+        return jsonify({"success": True, "analysis": analysis}), 200
 
     except Exception as e:
         return jsonify({"success": False, "message": "Failed to fetch sales analysis", "error": str(e)}), 500
 
 @analysis_bp.route('/total_sales_by_medicine', methods=['POST'])
+@cached_response
 def total_sales_by_medicine():
     user_id = request.json.get('user_id')
     start_date = request.json.get('start_date')
@@ -115,17 +126,14 @@ def total_sales_by_medicine():
     if not user_id:
         return jsonify({"success": False, "message": "User ID is required"}), 400
 
-    query_base = """
+    # Past days come from the daily rollup, today from the raw sales
+    source, query_params = SalesRollup.source(user_id=user_id, start_date=start_date, end_date=end_date)
+    query_base = f"""
         SELECT ms.medicine_id, SUM(ms.quantity) AS total_quantity, m.name AS medicine_name, m.barcode
-        FROM medicine_sales ms
+        FROM {source} ms
         JOIN medicine m ON ms.medicine_id = m.id
-        WHERE ms.user_id = %s
+        WHERE 1=1
     """
-    query_params = [user_id]
-
-    if start_date and end_date:
-        query_base += " AND ms.sale_date BETWEEN %s AND %s"
-        query_params.extend([start_date, end_date])
 
     query_base += " GROUP BY ms.medicine_id, m.name, m.barcode"
 
@@ -156,6 +164,7 @@ def total_sales_by_medicine():
 
 
 @analysis_bp.route('/top_medicines', methods=['POST'])
+@cached_response
 def top_medicines():
     try:
         # Get data from the request
@@ -170,22 +179,42 @@ def top_medicines():
         if months not in [1, 6, 12]:
             return jsonify({"success": False, "message": "Invalid 'months' value. Only 1, 6, and 12 are allowed."}), 400
 
+        # Answered from the in-memory top sellers sketch; exact=true (audits) or a large x runs the SQL instead
+        if not request.json.get('exact') and x <= MAX_SKETCH_X:
+            # Shared by every request, so rebuilt from the primary rather than a lagging replica
+            top_sellers.ensure_loaded(mysql.primary)
+            # A few spare entries cover medicines deleted since their sales were counted
+            entries = top_sellers.top(months, x + 10)
+            names = Medicine.get_names_by_ids(mysql.connection, [medicine_id for medicine_id, _, _ in entries])
+            top_medicines = [
+                {
+                    "medicine_name": names[medicine_id][0],
+                    "id": medicine_id,
+                    "total_sales": count,
+                    "max_error": error
+                }
+                for medicine_id, count, error in entries if medicine_id in names
+            ][:x]
+            if not top_medicines:
+                return jsonify({"success": False, "message": "No data found for the given criteria."}), 404
+            return jsonify({"success": True, "top_medicines": top_medicines, "exact": False}), 200
+
         # Get the MySQL connection
         connection = mysql.connection
         cursor = connection.cursor(MySQLdb.cursors.DictCursor)
 
         # Query to get the top X medicines based on their maximum sales within the given period
+        source, params = SalesRollup.source(months=months)
         query = f"""
             SELECT m.name AS medicine_name, m.id AS med_id, SUM(ms.quantity) AS total_sales
-            FROM medicine_sales ms
+            FROM {source} ms
             JOIN medicine m ON ms.medicine_id = m.id
-            WHERE ms.sale_date >= CURDATE() - INTERVAL %s MONTH
             GROUP BY ms.medicine_id
             ORDER BY total_sales DESC
             LIMIT %s;
         """
 
-        cursor.execute(query, (months, x))
+        cursor.execute(query, (*params, x))
         top_medicines_data = cursor.fetchall()
         cursor.close()
 
@@ -202,7 +231,7 @@ def top_medicines():
             for row in top_medicines_data
         ]
 
-        return jsonify({"success": True, "top_medicines": top_medicines}), 200
+        return jsonify({"success": True, "top_medicines": top_medicines, "exact": True}), 200
 
     except Exception as e:
         return jsonify({"success": False, "message": "Failed to retrieve top medicines", "error": str(e)}), 500
@@ -210,38 +239,26 @@ def top_medicines():
 
 
 @analysis_bp.route('/sales_summary', methods=['GET'])
+@cached_response
 def general_sales_summary():
     try:
         # Get the MySQL connection
         connection = mysql.connection
         cursor = connection.cursor(MySQLdb.cursors.DictCursor)
 
-        # Query for total sales in the last month
-        query_last_month_sales = """
-            SELECT SUM(quantity) AS total_sales_last_month
-            FROM medicine_sales
-            WHERE sale_date >= CURDATE() - INTERVAL 1 MONTH;
-        """
-        cursor.execute(query_last_month_sales)
-        last_month_sales = cursor.fetchone()['total_sales_last_month'] or 0
-
-        # Query for total sales in the last six months
-        query_last_six_months_sales = """
-            SELECT SUM(quantity) AS total_sales_last_six_months
-            FROM medicine_sales
-            WHERE sale_date >= CURDATE() - INTERVAL 6 MONTH;
-        """
-        cursor.execute(query_last_six_months_sales)
-        last_six_months_sales = cursor.fetchone()['total_sales_last_six_months'] or 0
-
-        # Query for total sales in the last year
-        query_last_year_sales = """
-            SELECT SUM(quantity) AS total_sales_last_year
-            FROM medicine_sales
-            WHERE sale_date >= CURDATE() - INTERVAL 1 YEAR;
-        """
-        cursor.execute(query_last_year_sales)
-        last_year_sales = cursor.fetchone()['total_sales_last_year'] or 0
+        # Last month, six months and year in one pass over the year's daily totals
+        source, params = SalesRollup.source(months=12)
+        cursor.execute(f"""
+            SELECT
+                SUM(CASE WHEN sale_date >= CURDATE() - INTERVAL 1 MONTH THEN quantity END) AS total_sales_last_month,
+                SUM(CASE WHEN sale_date >= CURDATE() - INTERVAL 6 MONTH THEN quantity END) AS total_sales_last_six_months,
+                SUM(quantity) AS total_sales_last_year
+            FROM {source} ms
+        """, params)
+        totals = cursor.fetchone()
+        last_month_sales = totals['total_sales_last_month'] or 0
+        last_six_months_sales = totals['total_sales_last_six_months'] or 0
+        last_year_sales = totals['total_sales_last_year'] or 0
 
         cursor.close()
 
@@ -260,6 +277,7 @@ def general_sales_summary():
 
 
 @analysis_bp.route('/filtered_sales', methods=['POST'])
+@cached_response
 def filtered_sales():
     user_id = request.json.get('user_id')
     start_date = request.json.get('start_date')
@@ -270,18 +288,14 @@ def filtered_sales():
     if not user_id:
         return jsonify({"success": False, "message": "User ID is required"}), 400
 
-    # Start with the base query for total sales by medicine
-    query_base = """
+    # Start with the base query for total sales by medicine; past days come from the daily rollup
+    source, query_params = SalesRollup.source(user_id=user_id, start_date=start_date, end_date=end_date)
+    query_base = f"""
         SELECT ms.medicine_id, SUM(ms.quantity) AS total_quantity, m.name AS medicine_name, m.barcode
-        FROM medicine_sales ms
+        FROM {source} ms
         JOIN medicine m ON ms.medicine_id = m.id
-        WHERE ms.user_id = %s
+        WHERE 1=1
     """
-    query_params = [user_id]
-
-    if start_date and end_date:
-        query_base += " AND ms.sale_date BETWEEN %s AND %s"
-        query_params.extend([start_date, end_date])
 
     if medicine_name:
         query_base += " AND m.name LIKE %s"
@@ -321,6 +335,7 @@ def filtered_sales():
 
 
 @analysis_bp.route('/most_popular_medicines', methods=['POST'])
+@cached_response
 def most_popular_medicines():
     user_id = request.json.get('user_id')
     start_date = request.json.get('start_date')
@@ -329,17 +344,12 @@ def most_popular_medicines():
     if not user_id:
         return jsonify({"success": False, "message": "User ID is required"}), 400
 
-    query_base = """
+    source, query_params = SalesRollup.source(user_id=user_id, start_date=start_date, end_date=end_date)
+    query_base = f"""
         SELECT m.name AS medicine_name, SUM(ms.quantity) AS total_quantity
-        FROM medicine_sales ms
+        FROM {source} ms
         JOIN medicine m ON ms.medicine_id = m.id
-        WHERE ms.user_id = %s
     """
-    query_params = [user_id]
-
-    if start_date and end_date:
-        query_base += " AND ms.sale_date BETWEEN %s AND %s"
-        query_params.extend([start_date, end_date])
 
     query_base += " GROUP BY m.name ORDER BY total_quantity DESC LIMIT 10"
 
@@ -365,43 +375,117 @@ def most_popular_medicines():
 
 
 @analysis_bp.route('/sales_trend', methods=['POST'])
+@cached_response
 def sales_trend():
-    user_id = request.json.get('user_id')
-    start_date = request.json.get('start_date')
-    end_date = request.json.get('end_date')
+    # Zero-filled sales per day, week, month or quarter; sales_trend maps each label to the total quantity.
+    # Optional: granularity (month by default), medicine_id or medicine_ids for per-medicine series too, and
+    # max_points, above which consecutive buckets are summed together.
+    data = request.get_json() or {}
+    user_id = data.get('user_id')
+    start_date = data.get('start_date')
+    end_date = data.get('end_date')
+    granularity = data.get('granularity', 'month')
 
     if not user_id:
         return jsonify({"success": False, "message": "User ID is required"}), 400
+    if granularity not in sales_series.GRANULARITIES:
+        return jsonify({"success": False,
+                        "message": f"granularity must be one of {', '.join(sales_series.GRANULARITIES)}"}), 400
+    medicine_ids = data.get('medicine_ids') or ([data['medicine_id']] if data.get('medicine_id') else None)
+    try:
+        medicine_ids = [int(medicine_id) for medicine_id in medicine_ids] if medicine_ids else None
+        max_points = int(data.get('max_points', sales_series.DEFAULT_MAX_POINTS))
+        if start_date and end_date:
+            start_date = datetime.date.fromisoformat(start_date)
+            end_date = datetime.date.fromisoformat(end_date)
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "Invalid medicine ids, dates or max_points"}), 400
+    if medicine_ids and len(medicine_ids) > MAX_ANALYSIS_IDS:
+        return jsonify({"success": False, "message": f"At most {MAX_ANALYSIS_IDS} medicine ids per request"}), 400
+    if not 1 <= max_points <= sales_series.MAX_POINTS_LIMIT:
+        return jsonify({"success": False,
+                        "message": f"max_points must be between 1 and {sales_series.MAX_POINTS_LIMIT}"}), 400
+    if start_date and end_date and start_date > end_date:
+        return jsonify({"success": False, "message": "start_date is after end_date"}), 400
 
-    query_base = """
-        SELECT DATE_FORMAT(ms.sale_date, '%Y-%m') AS sale_month, SUM(ms.quantity) AS total_quantity
-        FROM medicine_sales ms
-        WHERE ms.user_id = %s
-    """
-    query_params = [user_id]
-
-    if start_date and end_date:
-        query_base += " AND ms.sale_date BETWEEN %s AND %s"
-        query_params.extend([start_date, end_date])
+    try:
+        series = sales_series.sales_series(mysql.connection, user_id, granularity, start_date, end_date,
+                                           medicine_ids, max_points)
+        if series is None:
+            return jsonify({"success": False, "message": "No sales trend data found"}), 404
 
-    query_base += " GROUP BY sale_month ORDER BY sale_month"
+        return jsonify({
+            "success": True,
+            "granularity": granularity,
+            "sales_trend": dict(zip(series['labels'], series['totals'])),
+            **series
+        }), 200
 
-    try:
-        cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-        cursor.execute(query_base, query_params)
-        sales_trend_data = cursor.fetchall()
-        cursor.close()
+    except Exception as e:
+        return jsonify({"success": False, "message": "Failed to retrieve sales trend", "error": str(e)}), 500
 
-        if not sales_trend_data:
-            return jsonify({"success": False, "message": "No sales trend data found"}), 404
 
-        # Convert the result to a dictionary for JSON serialization
-        sales_trend = {
-            row['sale_month']: int(row['total_quantity'])
-            for row in sales_trend_data
-        }
+@analysis_bp.route('/reorder_suggestions', methods=['POST'])
+@cached_response
+def reorder_suggestions():
+    # Demand forecast and reorder point of every medicine the user sold or stocks, fitted in one batch.
+    # Optional: lead_time_days, review_period_days, service_level (0.5-0.999), history_days, only_needed.
+    data = request.get_json() or {}
+    user_id = data.get('user_id')
+    if not user_id:
+        return jsonify({"success": False, "message": "User ID is required"}), 400
+    try:
+        lead_time_days = int(data.get('lead_time_days', demand_forecast.DEFAULT_LEAD_TIME_DAYS))
+        review_period_days = int(data.get('review_period_days', demand_forecast.DEFAULT_REVIEW_PERIOD_DAYS))
+        service_level = float(data.get('service_level', demand_forecast.DEFAULT_SERVICE_LEVEL))
+        history_days = int(data.get('history_days', demand_forecast.HISTORY_DAYS))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "Invalid forecast parameters"}), 400
+    if not (1 <= lead_time_days <= 180 and 0 <= review_period_days <= 180 and 0.5 <= service_level <= 0.999
+            and 28 <= history_days <= 5 * 365):
+        return jsonify({"success": False, "message": "Forecast parameters out of range"}), 400
 
-        return jsonify({"success": True, "sales_trend": sales_trend}), 200
+    try:
+        on_hand = StockSummary.get_quantities(mysql.connection, user_id)
+        plan = demand_forecast.forecast_user(mysql.connection, user_id, on_hand, history_days=history_days,
+                                             lead_time_days=lead_time_days, review_period_days=review_period_days,
+                                             service_level=service_level)
+        if data.get('only_needed'):
+            plan = [item for item in plan if item['needs_reorder']]
+        # Most urgent first: least stock relative to the reorder point
+        plan.sort(key=lambda item: (not item['needs_reorder'], item['on_hand'] - item['reorder_point']))
+
+        names = Medicine.get_names_by_ids(mysql.connection, [item['medicine_id'] for item in plan])
+        for item in plan:
+            item['medicine_name'], item['barcode'] = names.get(item['medicine_id'], (None, None))
+        return jsonify({"success": True, "suggestions": plan}), 200
 
     except Exception as e:
-        return jsonify({"success": False, "message": "Failed to retrieve sales trend", "error": str(e)}), 500
+        return jsonify({"success": False, "message": "Failed to compute reorder suggestions", "error": str(e)}), 500
+
+
+@analysis_bp.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify({"success": True, "stats": response_cache.stats(), "top_sellers": top_sellers.stats()}), 200
+
+
+@analysis_bp.cli.command('backfill-rollup')
+@click.option('--start', 'start_date', type=click.DateTime(formats=['%Y-%m-%d']), default=None)
+@click.option('--end', 'end_date', type=click.DateTime(formats=['%Y-%m-%d']), default=None)
+def backfill_rollup(start_date, end_date):
+    """Rebuild the daily sales rollup from medicine_sales (the whole history by default)."""
+    written = SalesRollup.backfill(mysql.connection, start_date.date() if start_date else None,
+                                   end_date.date() if end_date else None)
+    response_cache.clear()
+    click.echo(f"Daily sales rollup backfilled ({written} rows)")
+
+
+@analysis_bp.cli.command('verify-rollup')
+def verify_rollup():
+    """Compare the daily sales rollup with medicine_sales."""
+    mismatches = SalesRollup.verify(mysql.connection)
+    for user_id, medicine_id, sale_day, stored, expected in mismatches:
+        click.echo(f"user {user_id}, medicine {medicine_id}, {sale_day}: stored {stored}, expected {expected}")
+    if mismatches:
+        raise click.ClickException(f"{len(mismatches)} rollup rows are out of date; run `flask analysis backfill-rollup`")
+    click.echo("Daily sales rollup is up to date")
@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Bounded barcode -> medicine row cache for the point-of-sale scan path.
+# Rows are kept as tuples in `SELECT *` column order; misses are not cached so new medicines show up at once.
+# Writes in this process invalidate their entries; entries also expire after `ttl` seconds so updates and
+# deletes made by other processes are picked up.
+
+DEFAULT_CAPACITY = 20000
+DEFAULT_TTL = 300
+BARCODE = 7
+
+
+class BarcodeCache:
+    def __init__(self, capacity=DEFAULT_CAPACITY, ttl=DEFAULT_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # barcode -> (expires_at, row)
+        self._rows = OrderedDict()
+        self._barcodes_by_id = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, barcode):
+        with self._lock:
+            entry = self._rows.get(barcode)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._rows[barcode]
+                    self._barcodes_by_id.pop(entry[1][0], None)
+                self.misses += 1
+                return None
+            self._rows.move_to_end(barcode)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, row):
+        barcode = row[BARCODE]
+        if not barcode or self.capacity <= 0:
+            return
+        with self._lock:
+            self._put(tuple(row))
+
+    def _put(self, row):
+        barcode = row[BARCODE]
+        old_barcode = self._barcodes_by_id.get(row[0])
+        if old_barcode is not None and old_barcode != barcode:
+            self._rows.pop(old_barcode, None)
+        self._rows[barcode] = (time.monotonic() + self.ttl, row)
+        self._rows.move_to_end(barcode)
+        self._barcodes_by_id[row[0]] = barcode
+        while len(self._rows) > self.capacity:
+            _, (_, evicted) = self._rows.popitem(last=False)
+            self._barcodes_by_id.pop(evicted[0], None)
+            self.evictions += 1
+
+    def invalidate(self, medicine_id=None, barcode=None):
+        # Drops the entry for a medicine id (covers barcode changes) and/or a barcode
+        with self._lock:
+            if medicine_id is not None:
+                old_barcode = self._barcodes_by_id.pop(medicine_id, None)
+                if old_barcode is not None:
+                    self._rows.pop(old_barcode, None)
+            if barcode is not None:
+                entry = self._rows.pop(barcode, None)
+                if entry is not None:
+                    self._barcodes_by_id.pop(entry[1][0], None)
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+            self._barcodes_by_id.clear()
+
+    def warm_up(self, connection):
+        # Fills the cache from the catalog, most recently added medicines last so they are evicted last
+        cursor = connection.cursor()
+        cursor.execute("SELECT * FROM (SELECT * FROM medicine ORDER BY id DESC LIMIT %s) recent ORDER BY id",
+                       (self.capacity,))
+        rows = cursor.fetchall()
+        cursor.close()
+        return self.fill(rows)
+
+    def fill(self, rows):
+        # rows in id order; with more rows than capacity the most recent ones are kept
+        count = 0
+        with self._lock:
+            for row in rows:
+                if row[BARCODE]:
+                    self._put(tuple(row))
+                    count += 1
+        return count
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "capacity": self.capacity,
+                "ttl": self.ttl,
+                "size": len(self._rows),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+barcode_cache = BarcodeCache()
@@ -0,0 +1,99 @@
+"""Expiry buckets over one million lots: building the horizon vs answering from it vs scanning every call.
+
+Run from the eczanem_takip directory:  python benchmarks/bench_expiry.py
+Needs NumPy; no database is used, the lots are generated.
+"""
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from expiry_scanner import BUCKETS, ExpiryLots
+
+LOTS = 1000000
+USERS = 20
+REPEAT = 5
+TODAY = datetime.date(2024, 6, 1)
+
+
+def make_lots():
+    # (user_id, stock_id, medicine_id, expiry_date, quantity) spread over two years either side of today
+    random.seed(7)
+    start = TODAY - datetime.timedelta(days=365)
+    lots = [(random.randint(1, USERS), stock_id, random.randint(1, 20000),
+             start + datetime.timedelta(days=random.randint(0, 730)), random.randint(1, 50))
+            for stock_id in range(1, LOTS + 1)]
+    lots.sort(key=lambda lot: (lot[0], lot[3], lot[1]))
+    return lots
+
+
+def build(lots):
+    # What ExpiryScanner.scan does with the rows of its single query
+    loaded_until = TODAY + datetime.timedelta(days=BUCKETS[-1][1] + 7)
+    users, start = {}, 0
+    for end in range(1, len(lots) + 1):
+        if end == len(lots) or lots[end][0] != lots[start][0]:
+            users[lots[start][0]] = ExpiryLots.from_rows(
+                loaded_until, [lot[1:] for lot in lots[start:end] if lot[3] < loaded_until])
+            start = end
+    return users
+
+
+def scan_summary(user_lots):
+    # The per-call alternative: walk every lot of the user and bucket it
+    thresholds = [(name, TODAY + datetime.timedelta(days=days)) for name, days in BUCKETS]
+    summary = {name: {"lot_count": 0, "quantity": 0} for name, _ in BUCKETS}
+    for _, _, _, expiry_date, quantity in user_lots:
+        for name, threshold in thresholds:
+            if expiry_date < threshold:
+                summary[name]["lot_count"] += 1
+                summary[name]["quantity"] += quantity
+                break
+    return summary
+
+
+def best_of(function):
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    lots = make_lots()
+    by_user = {}
+    for lot in lots:
+        by_user.setdefault(lot[0], []).append(lot)
+
+    start = time.perf_counter()
+    users = build(lots)
+    build_time = time.perf_counter() - start
+
+    assert all(users[user_id].summary(TODAY) == scan_summary(by_user[user_id]) for user_id in users)
+
+    tomorrow = TODAY + datetime.timedelta(days=1)
+    per_user = [(user_id, users[user_id], by_user[user_id]) for user_id in sorted(users)]
+    precomputed = best_of(lambda: [user_lots.summary(TODAY) for _, user_lots, _ in per_user])
+    new_day = best_of(lambda: [ExpiryLots(user_lots.loaded_until, user_lots.expiry, user_lots.stock_ids,
+                                          user_lots.medicine_ids, user_lots.quantities).summary(tomorrow)
+                               for _, user_lots, _ in per_user])
+    page = best_of(lambda: [user_lots.lots(TODAY, 'within_30_days', 0, 50) for _, user_lots, _ in per_user])
+    scanned = best_of(lambda: [scan_summary(rows) for _, _, rows in per_user])
+
+    print(f"{LOTS} lots over {USERS} users, best of {REPEAT}, times per user")
+    print(f"{'operation':<40}{'time (ms)':>12}")
+    print(f"{'build horizon (all users, once)':<40}{build_time * 1000 / len(users):>12.2f}")
+    print(f"{'bucket summary, precomputed':<40}{precomputed * 1000 / len(users):>12.3f}")
+    print(f"{'bucket summary, first call of a day':<40}{new_day * 1000 / len(users):>12.3f}")
+    print(f"{'first page of within_30_days':<40}{page * 1000 / len(users):>12.3f}")
+    print(f"{'bucket summary, scanning every lot':<40}{scanned * 1000 / len(users):>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
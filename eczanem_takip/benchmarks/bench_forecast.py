@@ -0,0 +1,85 @@
+"""Reorder plan for 10k medicines x 3 years of daily sales: rows fetched, matrix build, smoothing fit and plan.
+
+Run from the eczanem_takip directory:  python benchmarks/bench_forecast.py
+Needs NumPy; no database is used, the sales are generated. The fetched rows are built as the tuples
+MySQLdb returns, so the conversion cost on the client is measured for both the per-day rows of the whole
+history (the old query) and the weekday profile + fit window rows forecast_user now fetches; the scan MySQL
+itself does for the aggregation is not.
+"""
+import datetime
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from demand_forecast import (FIT_DAYS, HISTORY_DAYS, SEASON_DAYS, build_demand_matrix, reorder_plan,
+                             weekday_profile)
+
+MEDICINES = 10000
+TODAY = datetime.date(2024, 6, 1)
+
+
+def make_sales():
+    # Poisson daily demand with a weekly profile; like a real pharmacy most medicines sell on few days
+    rng = np.random.default_rng(7)
+    rates = rng.gamma(0.5, 2.0, MEDICINES)
+    weekly = np.array([1.1, 1.0, 1.0, 1.0, 1.2, 0.8, 0.4])
+    first_weekday = (TODAY - datetime.timedelta(days=HISTORY_DAYS)).weekday()
+    profile = weekly[(first_weekday + np.arange(HISTORY_DAYS)) % SEASON_DAYS]
+    return rng.poisson(rates[:, None] * profile[None, :]), first_weekday
+
+
+def as_rows(columns):
+    # The rows as fetchall returns them
+    return list(zip(*(column.tolist() for column in columns)))
+
+
+def to_arrays(rows):
+    count = len(rows)
+    return (np.fromiter((row[0] for row in rows), dtype=np.int64, count=count),
+            np.fromiter((row[1] for row in rows), dtype=np.int64, count=count),
+            np.fromiter((row[2] for row in rows), dtype=np.float64, count=count))
+
+
+def main():
+    dense, first_weekday = make_sales()
+    on_hand = {int(medicine_id): 20 for medicine_id in range(1000, 1000 + MEDICINES)}
+    last_day = TODAY - datetime.timedelta(days=1)
+
+    medicines, days = np.nonzero(dense)
+    history_rows = as_rows((medicines + 1000, days, dense[medicines, days]))
+    weekday_totals = np.zeros((MEDICINES, SEASON_DAYS), dtype=np.int64)
+    np.add.at(weekday_totals, (medicines, (first_weekday + days) % SEASON_DAYS), dense[medicines, days])
+    medicines, weekdays = np.nonzero(weekday_totals)
+    profile_rows = as_rows((medicines + 1000, weekdays, weekday_totals[medicines, weekdays]))
+    window = dense[:, -FIT_DAYS:]
+    medicines, days = np.nonzero(window)
+    window_rows = as_rows((medicines + 1000, days, window[medicines, days]))
+    print(f"{MEDICINES} medicines x {HISTORY_DAYS} days")
+    print(f"rows fetched: {len(history_rows)} per day over the history, now {len(profile_rows)} weekday totals "
+          f"+ {len(window_rows)} per day over the last {FIT_DAYS} days")
+
+    start = time.perf_counter()
+    to_arrays(history_rows)
+    old_fetch = time.perf_counter()
+    ids, season = weekday_profile(*to_arrays(profile_rows), first_weekday, HISTORY_DAYS)
+    medicine_ids, day_offsets, quantities = to_arrays(window_rows)
+    fetched = time.perf_counter()
+    ids, matrix = build_demand_matrix(medicine_ids, day_offsets, quantities, FIT_DAYS, ids)
+    built = time.perf_counter()
+    plan = reorder_plan(ids, matrix, on_hand, last_day, season)
+    planned = time.perf_counter()
+
+    print(f"{'step':<40}{'time (ms)':>12}")
+    print(f"{'convert rows, whole history per day':<40}{(old_fetch - start) * 1000:>12.1f}")
+    print(f"{'convert rows, profile + fit window':<40}{(fetched - old_fetch) * 1000:>12.1f}")
+    print(f"{'build demand matrix':<40}{(built - fetched) * 1000:>12.1f}")
+    print(f"{'fit + reorder plan':<40}{(planned - built) * 1000:>12.1f}")
+    print(f"{sum(item['needs_reorder'] for item in plan)} of {len(plan)} medicines need reordering")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Time and peak memory per 10k rows for list responses, dict-backed objects vs slotted rows + streaming.
+
+Run from the eczanem_takip directory:  python benchmarks/bench_serialization.py
+Needs the app requirements installed (the models import MySQLdb); no database is used.
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_stream import stream_json_rows
+from models.Medicine import Medicine, MEDICINE_COLUMNS
+
+ROWS = 10000
+REPEAT = 5
+
+
+class LegacyMedicine:
+    # The model as it was before __slots__: a __dict__ per instance, serialize() builds a dict per row
+    def __init__(self, id, public_number, atc_code, report_type, name, brand, form, barcode, equivalent_medicine_group):
+        self.id = id
+        self.public_number = public_number
+        self.atc_code = atc_code
+        self.report_type = report_type
+        self.name = name
+        self.brand = brand
+        self.form = form
+        self.barcode = barcode
+        self.equivalent_medicine_group = equivalent_medicine_group
+
+    def serialize(self):
+        return {column: getattr(self, column) for column in MEDICINE_COLUMNS}
+
+
+def make_rows():
+    return [(i, f"P{i}", "N02BE01", "NORMAL", f"MEDICINE {i} 500 MG TABLET", "BRAND", "TABLET",
+             str(8690000000000 + i), f"G{i % 100}") for i in range(ROWS)]
+
+
+def legacy(rows):
+    # DictCursor rows -> Medicine(**row) -> serialize() -> one json.dumps of the whole response
+    dict_rows = [dict(zip(MEDICINE_COLUMNS, row)) for row in rows]
+    medicines = [LegacyMedicine(**row) for row in dict_rows]
+    return json.dumps({"success": True, "medicines": [medicine.serialize() for medicine in medicines]})
+
+
+def slotted(rows):
+    medicines = [Medicine(*row) for row in rows]
+    return json.dumps({"success": True, "medicines": [medicine.serialize() for medicine in medicines]})
+
+
+def streamed(rows):
+    # Tuple rows straight into JSON chunks; the response is written chunk by chunk, only its size is kept
+    return sum(len(chunk) for chunk in stream_json_rows('medicines', MEDICINE_COLUMNS, iter(rows)))
+
+
+def measure(function, rows):
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        function(rows)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    function(rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    rows = make_rows()
+    print(f"{ROWS} medicine rows, best of {REPEAT}")
+    print(f"{'path':<28}{'time (ms)':>12}{'peak memory (KiB)':>20}")
+    for label, function in [("dict objects + jsonify", legacy),
+                            ("slotted objects + jsonify", slotted),
+                            ("tuple rows + streaming", streamed)]:
+        elapsed, peak = measure(function, rows)
+        print(f"{label:<28}{elapsed * 1000:>12.1f}{peak / 1024:>20.0f}")
+
+
+if __name__ == '__main__':
+    main()
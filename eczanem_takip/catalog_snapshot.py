@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import struct
+import time
+
+import click
+import numpy as np
+
+# Compact, memory-mappable snapshot of medicine, active_ingredient and medicine_active_ingredient.
+#
+# File layout: MAGIC, 8-byte little-endian header length, JSON header, then 64-byte aligned raw NumPy arrays.
+# Strings of every column live in one UTF-8 pool with an int64 offsets array per column, so opening a
+# snapshot maps the file read-only and processes share its pages instead of building a Python object per row.
+
+MAGIC = b'ECZSNAP1'
+ALIGNMENT = 64
+
+MEDICINE_COLUMNS = ('id', 'public_number', 'atc_code', 'report_type', 'name', 'brand', 'form', 'barcode',
+                    'equivalent_medicine_group')
+MEDICINE_STRING_COLUMNS = MEDICINE_COLUMNS[1:]
+
+
+def catalog_stamp(connection):
+    # Changes with every write to the catalog tables: the catalog_version row, which the write paths in
+    # models/Medicine.py bump in the same transaction, plus row counts and highest ids as a guard against
+    # writes made outside them. Read in the exporting transaction, so it matches the rows exported with it.
+    # None when the version row is missing; no snapshot is trusted then.
+    cursor = connection.cursor()
+    cursor.execute("SELECT version FROM catalog_version WHERE id = 1")
+    version = cursor.fetchone()
+    if version is None:
+        cursor.close()
+        return None
+    cursor.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM medicine")
+    medicine_counts = cursor.fetchone()
+    cursor.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM active_ingredient")
+    ingredient_counts = cursor.fetchone()
+    cursor.execute("SELECT COUNT(*) FROM medicine_active_ingredient")
+    link_count = cursor.fetchone()
+    cursor.close()
+    payload = json.dumps([version[0], list(medicine_counts), list(ingredient_counts), link_count[0]], default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class _StringPoolBuilder:
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def column(self, values):
+        # Returns (offsets, nulls) for one column; None is stored as an empty string plus a null flag
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        offsets[0] = self.size
+        nulls = np.zeros(len(values), dtype=np.bool_)
+        for i, value in enumerate(values):
+            if value is None:
+                nulls[i] = True
+            else:
+                encoded = str(value).encode('utf-8')
+                self.chunks.append(encoded)
+                self.size += len(encoded)
+            offsets[i + 1] = self.size
+        return offsets, nulls
+
+    def pool(self):
+        return np.frombuffer(b''.join(self.chunks), dtype=np.uint8)
+
+
+def export_snapshot(connection, path):
+    stamp = catalog_stamp(connection)
+    cursor = connection.cursor()
+    cursor.execute(f"SELECT {', '.join(MEDICINE_COLUMNS)} FROM medicine ORDER BY id")
+    medicines = cursor.fetchall()
+    cursor.execute("SELECT id, name FROM active_ingredient ORDER BY id")
+    ingredients = cursor.fetchall()
+    cursor.execute("""
+        SELECT medicine_id, active_ingredient_id FROM medicine_active_ingredient
+        ORDER BY medicine_id, active_ingredient_id
+    """)
+    links = cursor.fetchall()
+    cursor.close()
+
+    strings = _StringPoolBuilder()
+    arrays = {
+        'medicine.id': np.array([row[0] for row in medicines], dtype=np.int64),
+        'active_ingredient.id': np.array([row[0] for row in ingredients], dtype=np.int64),
+        'link.medicine_id': np.array([row[0] for row in links], dtype=np.int64),
+        'link.active_ingredient_id': np.array([row[1] for row in links], dtype=np.int64),
+    }
+    for position, column in enumerate(MEDICINE_COLUMNS[1:], start=1):
+        offsets, nulls = strings.column([row[position] for row in medicines])
+        arrays[f'medicine.{column}.offsets'] = offsets
+        arrays[f'medicine.{column}.nulls'] = nulls
+    offsets, nulls = strings.column([row[1] for row in ingredients])
+    arrays['active_ingredient.name.offsets'] = offsets
+    arrays['active_ingredient.name.nulls'] = nulls
+    arrays['strings'] = strings.pool()
+
+    header = {'stamp': stamp, 'created_at': time.time(), 'arrays': {}}
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    # Written next to the target and renamed, so readers never map a half-written file
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(MAGIC)
+        file.write(struct.pack('<Q', len(header_bytes)))
+        file.write(header_bytes)
+        for name, array in arrays.items():
+            file.seek(data_start + header['arrays'][name]['offset'])
+            file.write(array.tobytes())
+        file.truncate(data_start + offset)
+    os.replace(temp_path, path)
+    return stamp
+
+
+class CatalogSnapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a catalog snapshot")
+            header_length = struct.unpack('<Q', file.read(8))[0]
+            header = json.loads(file.read(header_length).decode('utf-8'))
+        data_start = -(-(len(MAGIC) + 8 + header_length) // ALIGNMENT) * ALIGNMENT
+        self.stamp = header['stamp']
+        self.created_at = header['created_at']
+
+        raw = np.memmap(path, dtype=np.uint8, mode='r')
+        self._arrays = {}
+        for name, spec in header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            count = int(np.prod(spec['shape'])) if spec['shape'] else 1
+            start = data_start + spec['offset']
+            self._arrays[name] = raw[start:start + count * dtype.itemsize].view(dtype).reshape(spec['shape'])
+        self._strings = self._arrays['strings']
+
+        self.medicine_ids = self._arrays['medicine.id']
+        self.ingredient_ids = self._arrays['active_ingredient.id']
+        self.link_medicine_ids = self._arrays['link.medicine_id']
+        self.link_ingredient_ids = self._arrays['link.active_ingredient_id']
+
+    def __len__(self):
+        return len(self.medicine_ids)
+
+    def is_current(self, connection):
+        return self.stamp is not None and self.stamp == catalog_stamp(connection)
+
+    def _string(self, prefix, index):
+        if self._arrays[f'{prefix}.nulls'][index]:
+            return None
+        offsets = self._arrays[f'{prefix}.offsets']
+        return self._strings[offsets[index]:offsets[index + 1]].tobytes().decode('utf-8')
+
+    def medicine_row(self, index):
+        # Tuple in `SELECT * FROM medicine` column order
+        return (int(self.medicine_ids[index]),) + tuple(self._string(f'medicine.{column}', index)
+                                                         for column in MEDICINE_STRING_COLUMNS)
+
+    def _string_column(self, prefix):
+        # Decodes a whole column at once; much cheaper than indexing the mapped arrays per value
+        pool = memoryview(self._strings)
+        offsets = self._arrays[f'{prefix}.offsets'].tolist()
+        nulls = self._arrays[f'{prefix}.nulls'].tolist()
+        return [None if nulls[i] else str(pool[offsets[i]:offsets[i + 1]], 'utf-8') for i in range(len(nulls))]
+
+    def medicine_rows(self):
+        columns = [self._string_column(f'medicine.{column}') for column in MEDICINE_STRING_COLUMNS]
+        return list(zip(self.medicine_ids.tolist(), *columns))
+
+
+def load_snapshot(connection, path):
+    # Returns the snapshot at `path` if it matches the database, otherwise None
+    if not path or not os.path.exists(path):
+        return None
+    snapshot = CatalogSnapshot(path)
+    return snapshot if snapshot.is_current(connection) else None
+
+
+def register_commands(app, mysql):
+    @app.cli.command('export-catalog-snapshot')
+    @click.argument('path', required=False)
+    def export_catalog_snapshot(path):
+        """Write the medicine catalog to a memory-mappable snapshot file."""
+        path = path or app.config['CATALOG_SNAPSHOT_PATH']
+        stamp = export_snapshot(mysql.connection, path)
+        click.echo(f"Catalog snapshot written to {path} (stamp {stamp})")
+        if stamp is None:
+            click.echo("The catalog_version row is missing (see schema.sql); the snapshot will not be used")
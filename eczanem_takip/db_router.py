@@ -0,0 +1,174 @@
+import contextlib
+import functools
+import threading
+import time
+
+import MySQLdb
+from flask import current_app, g, has_request_context, request
+from flask_mysqldb import MySQL
+
+# Primary/replica routing of the per-request MySQL connection.
+# Every blueprint reads `mysql.connection`; RoutedMySQL returns the replica connection for requests marked
+# read-only (`replica_read`, or `use_replica` as a blueprint before_request hook) when MYSQL_REPLICA_HOST is
+# set, and the primary connection everywhere else, including background jobs and CLI commands.
+# Read-your-writes: after a user's sale or stock change their reads stay on the primary for
+# READ_YOUR_WRITES_SECONDS, long enough for the replica to catch up; a client may also send
+# `X-Read-Primary: 1` to read from the primary (e.g. right after a write handled by another process).
+# Process-wide caches (search index, barcode cache, top sellers, cached counts) are filled from the primary
+# only (`mysql.primary`, or `primary_reads` around code reading `mysql.connection`): the invalidations that
+# keep them current are driven by writes on the primary, which a lagging replica may not show yet.
+
+DEFAULT_READ_YOUR_WRITES_SECONDS = 10
+# A replica that cannot be reached is not retried for this long; reads fall back to the primary
+REPLICA_RETRY_SECONDS = 30
+
+
+class ReadYourWrites:
+    def __init__(self, seconds=DEFAULT_READ_YOUR_WRITES_SECONDS):
+        self.seconds = seconds
+        self._lock = threading.Lock()
+        self._pinned_until = {}
+
+    def pin(self, user_id):
+        if user_id is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._pinned_until[str(user_id)] = now + self.seconds
+            if len(self._pinned_until) > 10000:
+                self._pinned_until = {key: until for key, until in self._pinned_until.items() if until > now}
+
+    def pinned(self, user_id):
+        if user_id is None:
+            return False
+        with self._lock:
+            until = self._pinned_until.get(str(user_id))
+        return until is not None and until > time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._pinned_until.clear()
+
+
+read_your_writes = ReadYourWrites()
+_replica_down_until = 0.0
+
+
+def pin_primary(user_id):
+    read_your_writes.pin(user_id)
+
+
+def use_replica():
+    # before_request hook: every endpoint of the blueprint is read-only
+    g.db_route = 'replica'
+
+
+def replica_read(view):
+    # Marks a read-only endpoint whose queries may be served by the replica
+    @functools.wraps(view)
+    def wrap(*args, **kwargs):
+        use_replica()
+        return view(*args, **kwargs)
+    return wrap
+
+
+@contextlib.contextmanager
+def primary_reads():
+    # `mysql.connection` is the primary inside the block, also in a read-only endpoint
+    if not has_request_context():
+        yield
+        return
+    route = g.pop('db_route', None)
+    try:
+        yield
+    finally:
+        if route is not None:
+            g.db_route = route
+
+
+def _request_owner():
+    body = request.get_json(silent=True) if request.is_json else None
+    return (body.get('user_id') if isinstance(body, dict) else None) or request.args.get('user_id')
+
+
+def _routes_to_replica():
+    if not has_request_context() or g.get('db_route') != 'replica':
+        return False
+    if 'db_replica_decision' not in g:
+        g.db_replica_decision = bool(current_app.config.get('MYSQL_REPLICA_HOST')
+                                     and request.headers.get('X-Read-Primary') != '1'
+                                     and not read_your_writes.pinned(_request_owner()))
+    return g.db_replica_decision
+
+
+def _connect_replica():
+    config = current_app.config
+    kwargs = {
+        "host": config['MYSQL_REPLICA_HOST'],
+        "port": config.get('MYSQL_REPLICA_PORT') or config.get('MYSQL_PORT', 3306),
+        "user": config.get('MYSQL_REPLICA_USER') or config['MYSQL_USER'],
+        "passwd": config.get('MYSQL_REPLICA_PASSWORD') or config['MYSQL_PASSWORD'],
+        "db": config['MYSQL_DB'],
+        "connect_timeout": config.get('MYSQL_REPLICA_CONNECT_TIMEOUT', 2)
+    }
+    if config.get('MYSQL_CHARSET'):
+        kwargs["charset"] = config['MYSQL_CHARSET']
+    return MySQLdb.connect(**kwargs)
+
+
+def routed_to_replica():
+    # Whether this request's `mysql.connection` reads go to the replica (unless it turns out unreachable)
+    return _routes_to_replica()
+
+
+def replica_used():
+    # Whether this request has read from the replica
+    return has_request_context() and 'db_replica' in g
+
+
+def replica_connection():
+    # The request's replica connection, or None when the replica is unreachable
+    global _replica_down_until
+    if 'db_replica' not in g:
+        if time.monotonic() < _replica_down_until:
+            return None
+        try:
+            g.db_replica = _connect_replica()
+        except MySQLdb.Error as e:
+            _replica_down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+            current_app.logger.warning(f"Replica unavailable, reading from the primary: {str(e)}")
+            return None
+    return g.db_replica
+
+
+def close_replica(exception=None):
+    replica = g.pop('db_replica', None)
+    if replica is not None:
+        replica.close()
+
+
+def init_app(app):
+    app.config.setdefault('MYSQL_REPLICA_HOST', None)
+    read_your_writes.seconds = app.config.get('READ_YOUR_WRITES_SECONDS', read_your_writes.seconds)
+    app.teardown_appcontext(close_replica)
+
+    @app.after_request
+    def tag_route(response):
+        # X-DB-Route tells which server answered a read-only endpoint
+        if g.get('db_route') == 'replica':
+            response.headers['X-DB-Route'] = 'replica' if 'db_replica' in g else 'primary'
+        return response
+
+
+class RoutedMySQL(MySQL):
+    @property
+    def connection(self):
+        if _routes_to_replica():
+            replica = replica_connection()
+            if replica is not None:
+                return replica
+        return self.primary
+
+    @property
+    def primary(self):
+        return MySQL.connection.fget(self)
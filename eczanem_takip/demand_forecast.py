@@ -0,0 +1,181 @@
+import datetime
+from statistics import NormalDist
+
+import numpy as np
+
+from models.SalesRollup import SalesRollup
+
+# Batch demand forecasting and reorder points for every medicine of a user at once.
+# The long history is aggregated by MySQL into one weekday profile per medicine (at most 7 rows each), which
+# seeds the seasonal component; only the last FIT_DAYS of daily sales are fetched into a (medicines x days)
+# matrix. Additive exponential smoothing with a weekly season is then run over that window for all medicines
+# together, one vectorized update per day. With ALPHA = 0.1 the level forgets 91 days old sales to under 0.01%,
+# so the short window loses nothing while the rows transferred drop from one per medicine and sale day over
+# the whole history to a few per medicine.
+
+HISTORY_DAYS = 3 * 365
+FIT_DAYS = 91
+SEASON_DAYS = 7
+MOVING_AVERAGE_DAYS = 28
+# Smoothing of the level, the weekday profile and the squared one-step errors
+ALPHA = 0.1
+GAMMA = 0.05
+ERROR_SMOOTHING = 0.05
+DEFAULT_LEAD_TIME_DAYS = 7
+DEFAULT_REVIEW_PERIOD_DAYS = 14
+DEFAULT_SERVICE_LEVEL = 0.95
+
+
+def load_daily_sales(connection, user_id, start_date, end_date):
+    # (medicine_ids, day offsets from start_date, quantities) as NumPy arrays, one entry per medicine and day
+    source, params = SalesRollup.source(user_id=user_id, start_date=start_date, end_date=end_date)
+    cursor = connection.cursor()
+    cursor.execute(f"""
+        SELECT medicine_id, DATEDIFF(sale_date, %s), SUM(quantity)
+        FROM {source} ms
+        GROUP BY medicine_id, sale_date
+    """, (start_date, *params))
+    rows = cursor.fetchall()
+    cursor.close()
+    count = len(rows)
+    return (np.fromiter((row[0] for row in rows), dtype=np.int64, count=count),
+            np.fromiter((row[1] for row in rows), dtype=np.int64, count=count),
+            np.fromiter((row[2] for row in rows), dtype=np.float64, count=count))
+
+
+def load_weekday_totals(connection, user_id, start_date, end_date):
+    # (medicine_ids, weekdays with 0 = Monday, quantities) as NumPy arrays, one entry per medicine and weekday
+    source, params = SalesRollup.source(user_id=user_id, start_date=start_date, end_date=end_date)
+    cursor = connection.cursor()
+    cursor.execute(f"""
+        SELECT medicine_id, WEEKDAY(sale_date) AS weekday, SUM(quantity)
+        FROM {source} ms
+        GROUP BY medicine_id, weekday
+    """, params)
+    rows = cursor.fetchall()
+    cursor.close()
+    count = len(rows)
+    return (np.fromiter((row[0] for row in rows), dtype=np.int64, count=count),
+            np.fromiter((row[1] for row in rows), dtype=np.int64, count=count),
+            np.fromiter((row[2] for row in rows), dtype=np.float64, count=count))
+
+
+def weekday_profile(medicine_ids, weekdays, quantities, first_weekday, days):
+    # Returns (sorted unique medicine ids, float32 season[medicine, weekday]): the mean sales of each weekday
+    # over `days` days starting on first_weekday, minus the overall daily mean
+    ids, rows = np.unique(medicine_ids, return_inverse=True)
+    totals = np.zeros((len(ids), SEASON_DAYS), dtype=np.float64)
+    totals[rows, weekdays] = quantities
+    occurrences = np.bincount((first_weekday + np.arange(days)) % SEASON_DAYS, minlength=SEASON_DAYS)
+    means = totals / np.maximum(occurrences, 1)
+    season = means - totals.sum(axis=1, keepdims=True) / days
+    return ids, season.astype(np.float32)
+
+
+def build_demand_matrix(medicine_ids, day_offsets, quantities, days, ids=None):
+    # Returns (sorted unique medicine ids, float32 matrix[medicine, day]) with zeros on days without sales.
+    # Each (medicine, day) appears once (the query groups by both), so a plain scatter is enough. `ids`, when
+    # given, fixes the rows; sales of medicines not in it are left out.
+    if ids is None:
+        ids, rows = np.unique(medicine_ids, return_inverse=True)
+    else:
+        rows = np.minimum(np.searchsorted(ids, medicine_ids), max(len(ids) - 1, 0))
+        known = ids[rows] == medicine_ids if len(ids) else np.zeros(len(medicine_ids), dtype=bool)
+        rows, day_offsets, quantities = rows[known], day_offsets[known], quantities[known]
+    matrix = np.zeros((len(ids), days), dtype=np.float32)
+    matrix[rows, day_offsets] = quantities
+    return ids, matrix
+
+
+def fit_seasonal_smoothing(matrix, first_weekday, season=None, alpha=ALPHA, gamma=GAMMA,
+                           error_smoothing=ERROR_SMOOTHING):
+    # Additive exponential smoothing with a weekly profile, fitted for all rows at once.
+    # first_weekday is the weekday (0 = Monday) of column 0; season[row, weekday] seeds the weekly profile,
+    # otherwise it is estimated from the first weeks. Returns (level, season[row, weekday], error variance).
+    medicines, days = matrix.shape
+    warm_up = min(days, 4 * SEASON_DAYS)
+    level = matrix[:, :warm_up].mean(axis=1) if warm_up else np.zeros(medicines, dtype=np.float32)
+    if season is not None:
+        season = season.copy()
+    else:
+        season = np.zeros((medicines, SEASON_DAYS), dtype=np.float32)
+        if warm_up >= SEASON_DAYS:
+            for offset in range(SEASON_DAYS):
+                season[:, (first_weekday + offset) % SEASON_DAYS] = (
+                    matrix[:, offset:warm_up:SEASON_DAYS].mean(axis=1) - level)
+    variance = np.zeros(medicines, dtype=np.float32)
+
+    for day in range(days):
+        weekday = (first_weekday + day) % SEASON_DAYS
+        actual = matrix[:, day]
+        error = actual - (level + season[:, weekday])
+        variance += error_smoothing * (error * error - variance)
+        new_level = level + alpha * (actual - season[:, weekday] - level)
+        season[:, weekday] += gamma * (actual - new_level - season[:, weekday])
+        level = new_level
+    return level, season, variance
+
+
+def reorder_plan(ids, matrix, on_hand, last_day, season=None, lead_time_days=DEFAULT_LEAD_TIME_DAYS,
+                 review_period_days=DEFAULT_REVIEW_PERIOD_DAYS, service_level=DEFAULT_SERVICE_LEVEL):
+    # Reorder point and order-up-to quantity per medicine.
+    # matrix covers the days up to and including `last_day`; season optionally seeds the weekly profile (see
+    # fit_seasonal_smoothing); on_hand maps medicine id -> quantity and may name medicines without sales.
+    # Reorder point = demand over the lead time + safety stock for the service level; the suggestion tops stock
+    # up to the demand over lead time + review period + safety stock.
+    days = matrix.shape[1]
+    first_weekday = (last_day - datetime.timedelta(days=days - 1)).weekday()
+    level, season, variance = fit_seasonal_smoothing(matrix, first_weekday, season)
+
+    horizon = lead_time_days + review_period_days
+    weekdays = [(last_day + datetime.timedelta(days=step)).weekday() for step in range(1, horizon + 1)]
+    daily = np.maximum(level[:, None] + season[:, weekdays], 0)
+    lead_demand = daily[:, :lead_time_days].sum(axis=1)
+    horizon_demand = daily.sum(axis=1)
+    z = NormalDist().inv_cdf(service_level)
+    safety_stock = z * np.sqrt(variance * lead_time_days)
+    reorder_point = np.ceil(lead_demand + safety_stock)
+    order_up_to = np.ceil(horizon_demand + safety_stock)
+    moving_average = matrix[:, -MOVING_AVERAGE_DAYS:].mean(axis=1) if days else np.zeros(len(ids))
+
+    stock = np.array([on_hand.get(int(medicine_id), 0) for medicine_id in ids], dtype=np.float64)
+    suggested = np.maximum(order_up_to - stock, 0)
+    needs_reorder = stock <= reorder_point
+
+    plan = [{
+        "medicine_id": int(ids[i]),
+        "on_hand": int(stock[i]),
+        "daily_forecast": round(float(lead_demand[i]) / lead_time_days, 3) if lead_time_days else 0.0,
+        "moving_average": round(float(moving_average[i]), 3),
+        "lead_time_demand": round(float(lead_demand[i]), 2),
+        "safety_stock": round(float(safety_stock[i]), 2),
+        "reorder_point": int(reorder_point[i]),
+        "order_up_to": int(order_up_to[i]),
+        "suggested_quantity": int(suggested[i]) if needs_reorder[i] else 0,
+        "needs_reorder": bool(needs_reorder[i] and suggested[i] > 0)
+    } for i in range(len(ids))]
+
+    # Stocked medicines without any sales in the history need nothing
+    seen = set(ids.tolist())
+    plan.extend({"medicine_id": medicine_id, "on_hand": int(quantity), "daily_forecast": 0.0, "moving_average": 0.0,
+                 "lead_time_demand": 0.0, "safety_stock": 0.0, "reorder_point": 0, "order_up_to": 0,
+                 "suggested_quantity": 0, "needs_reorder": False}
+                for medicine_id, quantity in sorted(on_hand.items()) if medicine_id not in seen)
+    return plan
+
+
+def forecast_user(connection, user_id, on_hand, today=None, history_days=HISTORY_DAYS, fit_days=FIT_DAYS,
+                  **options):
+    # Fitted on complete days only; today's partial sales would read as a demand drop
+    last_day = (today or datetime.date.today()) - datetime.timedelta(days=1)
+    history_start = last_day - datetime.timedelta(days=history_days - 1)
+    fit_days = min(fit_days, history_days)
+    fit_start = last_day - datetime.timedelta(days=fit_days - 1)
+
+    ids, season = weekday_profile(*load_weekday_totals(connection, user_id, history_start, last_day),
+                                  history_start.weekday(), history_days)
+    # The fit window lies inside the history, so every medicine it sold is already one of `ids` (barring a
+    # rollup written between the two queries)
+    medicine_ids, day_offsets, quantities = load_daily_sales(connection, user_id, fit_start, last_day)
+    ids, matrix = build_demand_matrix(medicine_ids, day_offsets, quantities, fit_days, ids)
+    return reorder_plan(ids, matrix, on_hand, last_day, season, **options)
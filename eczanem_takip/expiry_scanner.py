@@ -0,0 +1,216 @@
+import datetime
+import threading
+import time
+
+import numpy as np
+
+# Expiry horizon of every user's stock, precomputed for the "expiring soon" views.
+# Lots with stock that expire within the horizon are kept per user as NumPy arrays sorted by expiry date, so a
+# bucket is a contiguous slice found with two binary searches and its quantity comes from a prefix sum.
+# Stock writes mark the user stale in the writing process; a background thread reloads stale users, moves the
+# horizon each day and rescans everything every `max_age` seconds, and readers reload a stale or older user
+# themselves. Answers therefore follow this process's writes at once and other processes' within max_age.
+
+# (bucket, lots expiring before today + days); each bucket starts where the previous one ends
+BUCKETS = (('expired', 0), ('within_30_days', 30), ('within_90_days', 90), ('within_180_days', 180))
+HORIZON_DAYS = BUCKETS[-1][1]
+# Lots are loaded this many days beyond the horizon so the window can slide without reloading every day
+HORIZON_MARGIN_DAYS = 7
+SCAN_INTERVAL_SECONDS = 600
+
+
+class ExpiryLots:
+    __slots__ = ('loaded_until', 'loaded_at', 'expiry', 'stock_ids', 'medicine_ids', 'quantities', 'cumulative',
+                 '_bounds')
+
+    def __init__(self, loaded_until, expiry, stock_ids, medicine_ids, quantities):
+        # expiry holds date ordinals, already sorted ascending (ties in stock id order)
+        self.loaded_until = loaded_until
+        self.loaded_at = time.monotonic()
+        self.expiry = expiry
+        self.stock_ids = stock_ids
+        self.medicine_ids = medicine_ids
+        self.quantities = quantities
+        self.cumulative = np.concatenate(([0], np.cumsum(quantities, dtype=np.int64)))
+        self._bounds = None
+
+    @classmethod
+    def from_rows(cls, loaded_until, rows):
+        # rows: (stock_id, medicine_id, expiry_date, quantity) in expiry order
+        count = len(rows)
+        return cls(loaded_until,
+                   np.fromiter((row[2].toordinal() for row in rows), dtype=np.int32, count=count),
+                   np.fromiter((row[0] for row in rows), dtype=np.int64, count=count),
+                   np.fromiter((row[1] for row in rows), dtype=np.int32, count=count),
+                   np.fromiter((row[3] for row in rows), dtype=np.int64, count=count))
+
+    def bounds(self, today):
+        # Start and end positions of every bucket for `today`, computed once per day
+        ordinal = today.toordinal()
+        if self._bounds is None or self._bounds[0] != ordinal:
+            ends = np.searchsorted(self.expiry, [ordinal + days for _, days in BUCKETS], side='left').tolist()
+            self._bounds = (ordinal, dict(zip((name for name, _ in BUCKETS), zip([0] + ends[:-1], ends))))
+        return self._bounds[1]
+
+    def summary(self, today):
+        return {name: {"lot_count": end - start, "quantity": int(self.cumulative[end] - self.cumulative[start])}
+                for name, (start, end) in self.bounds(today).items()}
+
+    def lots(self, today, bucket, offset, limit):
+        start, end = self.bounds(today)[bucket]
+        start = min(start + offset, end)
+        end = min(start + limit, end)
+        return [{"stock_id": stock_id, "medicine_id": medicine_id,
+                 "expiry_date": datetime.date.fromordinal(expiry), "quantity": quantity}
+                for stock_id, medicine_id, expiry, quantity in zip(self.stock_ids[start:end].tolist(),
+                                                                    self.medicine_ids[start:end].tolist(),
+                                                                    self.expiry[start:end].tolist(),
+                                                                    self.quantities[start:end].tolist())]
+
+
+class ExpiryScanner:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = {}
+        self._stale = set()
+        self._generations = {}
+        self._wake = threading.Event()
+        self._thread = None
+        # Lots older than this are reloaded, picking up writes made by other processes
+        self.max_age = SCAN_INTERVAL_SECONDS
+        self._scanned_at = None
+        self.scans = 0
+        self.reloads = 0
+
+    def mark_stale(self, user_id):
+        with self._lock:
+            user_id = int(user_id)
+            self._stale.add(user_id)
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+        self._wake.set()
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._stale.clear()
+
+    def _needs_load(self, user_id, today):
+        lots = self._users.get(user_id)
+        return (lots is None or user_id in self._stale
+                or lots.loaded_until <= today + datetime.timedelta(days=HORIZON_DAYS)
+                or time.monotonic() - lots.loaded_at > self.max_age)
+
+    def _load_until(self, today):
+        return today + datetime.timedelta(days=HORIZON_DAYS + HORIZON_MARGIN_DAYS)
+
+    def reload_user(self, connection, user_id, today=None):
+        today = today or datetime.date.today()
+        user_id = int(user_id)
+        with self._lock:
+            generation = self._generations.get(user_id, 0)
+        loaded_until = self._load_until(today)
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT id, medicine_id, expiry_date, quantity FROM medicine_stock
+            WHERE user_id = %s AND quantity > 0 AND expiry_date IS NOT NULL AND expiry_date < %s
+            ORDER BY expiry_date, id
+        """, (user_id, loaded_until))
+        rows = cursor.fetchall()
+        cursor.close()
+        lots = ExpiryLots.from_rows(loaded_until, rows)
+        with self._lock:
+            # A write that happened while loading leaves the user stale for the next reader
+            if self._generations.get(user_id, 0) == generation:
+                self._stale.discard(user_id)
+            self._users[user_id] = lots
+            self.reloads += 1
+        return lots
+
+    def scan(self, connection, today=None):
+        # Full scan: every user's lots in one pass, used at start-up and when the horizon has to move
+        today = today or datetime.date.today()
+        with self._lock:
+            generations = dict(self._generations)
+        loaded_until = self._load_until(today)
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT user_id, id, medicine_id, expiry_date, quantity FROM medicine_stock
+            WHERE quantity > 0 AND expiry_date IS NOT NULL AND expiry_date < %s
+            ORDER BY user_id, expiry_date, id
+        """, (loaded_until,))
+        rows = cursor.fetchall()
+        cursor.close()
+
+        users = {}
+        start = 0
+        for end in range(1, len(rows) + 1):
+            if end == len(rows) or rows[end][0] != rows[start][0]:
+                users[rows[start][0]] = ExpiryLots.from_rows(loaded_until, [row[1:] for row in rows[start:end]])
+                start = end
+        with self._lock:
+            for user_id in set(self._users) | set(users):
+                if self._generations.get(user_id, 0) != generations.get(user_id, 0):
+                    continue
+                self._stale.discard(user_id)
+                self._users[user_id] = users.get(user_id) or ExpiryLots.from_rows(loaded_until, [])
+            self.scans += 1
+            self._scanned_at = time.monotonic()
+
+    def refresh(self, connection, today=None):
+        # One pass of the background scanner: rescan everything when the horizon moved or the last scan is
+        # older than max_age, else reload stale users
+        today = today or datetime.date.today()
+        with self._lock:
+            outdated = any(lots.loaded_until <= today + datetime.timedelta(days=HORIZON_DAYS)
+                           for lots in self._users.values())
+            expired = self._scanned_at is None or time.monotonic() - self._scanned_at >= self.max_age
+            stale = sorted(self._stale)
+        if outdated or expired:
+            self.scan(connection, today)
+            return
+        for user_id in stale:
+            self.reload_user(connection, user_id, today)
+
+    def get(self, connection, user_id, today=None):
+        today = today or datetime.date.today()
+        user_id = int(user_id)
+        with self._lock:
+            if not self._needs_load(user_id, today):
+                return self._users[user_id]
+        return self.reload_user(connection, user_id, today)
+
+    def summary(self, connection, user_id, today=None):
+        today = today or datetime.date.today()
+        return self.get(connection, user_id, today).summary(today)
+
+    def lots(self, connection, user_id, bucket, offset=0, limit=50, today=None):
+        today = today or datetime.date.today()
+        return self.get(connection, user_id, today).lots(today, bucket, offset, limit)
+
+    def start(self, app, mysql, interval=SCAN_INTERVAL_SECONDS):
+        # Runs `refresh` in a daemon thread, after every `interval` seconds or as soon as stock changes
+        if self._thread is not None:
+            return
+        self.max_age = interval
+
+        def run():
+            while True:
+                try:
+                    with app.app_context():
+                        self.refresh(mysql.connection)
+                except Exception as e:
+                    app.logger.warning(f"Expiry scan failed: {str(e)}")
+                self._wake.wait(interval)
+                self._wake.clear()
+
+        self._thread = threading.Thread(target=run, name='expiry-scanner', daemon=True)
+        self._thread.start()
+
+    def stats(self):
+        with self._lock:
+            return {"users": len(self._users), "stale_users": len(self._stale),
+                    "lots": sum(len(lots.expiry) for lots in self._users.values()),
+                    "scans": self.scans, "reloads": self.reloads}
+
+
+expiry_scanner = ExpiryScanner()
@@ -0,0 +1,136 @@
+import re
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from medicine_search import search_index, fold_text
+
+# Fuzzy matching of OCR'd words against catalog medicine names.
+# Candidates are blocked through a trigram index over the distinct words of the folded names, then only those
+# candidates are scored with an edit distance computed for all of them at once with NumPy.
+
+MIN_TOKEN_LENGTH = 3
+# Words sharing the most trigrams with a token that are passed on to edit-distance scoring
+MAX_CANDIDATES = 64
+DEFAULT_TOP_K = 5
+DEFAULT_MIN_SCORE = 0.7
+TOKEN_CACHE_SIZE = 4096
+
+_TOKEN_PATTERN = re.compile(r"[^\W\d_]+")
+
+
+def _padded_grams(word):
+    padded = f" {word} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def tokenize(text):
+    return [token for token in _TOKEN_PATTERN.findall(fold_text(text)) if len(token) >= MIN_TOKEN_LENGTH]
+
+
+def edit_distances(token, words):
+    # Levenshtein distance from `token` to every word, one NumPy row update per token character.
+    # The insertion term of a row is resolved with a running minimum instead of a loop over columns.
+    lengths = np.fromiter((len(word) for word in words), dtype=np.int32, count=len(words))
+    width = int(lengths.max()) if len(words) else 0
+    codes = np.zeros((len(words), width), dtype=np.int32)
+    for i, word in enumerate(words):
+        codes[i, :len(word)] = [ord(char) for char in word]
+
+    columns = np.arange(width + 1, dtype=np.int32)
+    previous = np.tile(columns, (len(words), 1))
+    for i, char in enumerate(token, start=1):
+        cost = (codes != ord(char)).astype(np.int32)
+        current = np.empty_like(previous)
+        current[:, 0] = i
+        current[:, 1:] = np.minimum(previous[:, 1:] + 1, previous[:, :-1] + cost)
+        current = np.minimum.accumulate(current - columns, axis=1) + columns
+        previous = current
+    return previous[np.arange(len(words)), lengths]
+
+
+class FuzzyMedicineMatcher:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._words = []
+        self._word_medicines = []
+        self._postings = {}
+        self._medicines = {}
+        self._token_cache = OrderedDict()
+
+    def _build(self, rows):
+        word_ids = {}
+        words, word_medicines, postings, medicines = [], [], {}, {}
+        for row in rows:
+            medicine_id, name, barcode = row[0], row[4], row[7]
+            medicines[medicine_id] = (name, barcode)
+            for word in tokenize(name):
+                index = word_ids.get(word)
+                if index is None:
+                    index = word_ids[word] = len(words)
+                    words.append(word)
+                    word_medicines.append([])
+                    for gram in set(_padded_grams(word)):
+                        postings.setdefault(gram, []).append(index)
+                word_medicines[index].append(medicine_id)
+        self._words, self._word_medicines, self._postings, self._medicines = words, word_medicines, postings, medicines
+        self._token_cache.clear()
+
+    def ensure_current(self, connection):
+        # Rebuilt from the search index rows whenever the catalog there has changed
+        search_index.ensure_loaded(connection)
+        with self._lock:
+            if self._version != search_index.version:
+                self._build(search_index.rows())
+                self._version = search_index.version
+
+    def _match_token(self, token, top_k, min_score):
+        overlaps = Counter()
+        for gram in _padded_grams(token):
+            overlaps.update(self._postings.get(gram, ()))
+        if not overlaps:
+            return []
+        candidates = [index for index, _ in overlaps.most_common(MAX_CANDIDATES)]
+        words = [self._words[index] for index in candidates]
+        distances = edit_distances(token, words)
+        longest = np.maximum(np.fromiter((len(word) for word in words), dtype=np.int32, count=len(words)),
+                             len(token))
+        scores = 1.0 - distances / longest
+
+        matches = []
+        seen = set()
+        for position in np.argsort(-scores, kind='stable'):
+            score = float(scores[position])
+            if score < min_score or len(matches) >= top_k:
+                break
+            for medicine_id in self._word_medicines[candidates[position]]:
+                if medicine_id in seen:
+                    continue
+                seen.add(medicine_id)
+                name, barcode = self._medicines[medicine_id]
+                matches.append({"medicine_id": medicine_id, "name": name, "barcode": barcode,
+                                "matched_word": words[position], "score": round(score, 3)})
+                if len(matches) >= top_k:
+                    break
+        return matches
+
+    def match(self, text, top_k=DEFAULT_TOP_K, min_score=DEFAULT_MIN_SCORE):
+        # Returns {token: [match, ...]} for every token of `text` with at least one match above min_score
+        results = {}
+        with self._lock:
+            for token in dict.fromkeys(tokenize(text)):
+                key = (token, top_k, min_score)
+                matches = self._token_cache.get(key)
+                if matches is None:
+                    matches = self._match_token(token, top_k, min_score)
+                    self._token_cache[key] = matches
+                    if len(self._token_cache) > TOKEN_CACHE_SIZE:
+                        self._token_cache.popitem(last=False)
+                if matches:
+                    results[token] = matches
+        return results
+
+
+fuzzy_matcher = FuzzyMedicineMatcher()
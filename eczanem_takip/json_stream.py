@@ -0,0 +1,61 @@
+import csv
+import io
+import json
+
+# Streams `{"success": true, "<key>": [ {...}, ... ]}` straight from cursor rows.
+# Rows are encoded as they arrive, so large listings neither build model objects nor one big dict in memory.
+
+CHUNK_ROWS = 500
+
+_encode = json.JSONEncoder(separators=(',', ':'), default=str).encode
+
+
+def stream_json_rows(key, columns, rows, extra=None, chunk_rows=CHUNK_ROWS):
+    head = {"success": True}
+    head.update(extra or {})
+    # Open the envelope by hand: drop the closing brace of the encoded head and append the list
+    yield _encode(head)[:-1] + f',{_encode(key)}:['
+
+    # Each chunk becomes one list of dicts encoded in a single call; the list brackets are stripped so
+    # chunks join into one array
+    separator = ''
+    chunk = []
+    for row in rows:
+        chunk.append(dict(zip(columns, row)))
+        if len(chunk) >= chunk_rows:
+            yield separator + _encode(chunk)[1:-1]
+            separator = ','
+            chunk = []
+    if chunk:
+        yield separator + _encode(chunk)[1:-1]
+    yield ']}'
+
+
+def stream_ndjson_rows(columns, rows, chunk_rows=CHUNK_ROWS):
+    # One JSON object per line; chunks of rows are joined into a single string before being written
+    chunk = []
+    for row in rows:
+        chunk.append(_encode(dict(zip(columns, row))))
+        if len(chunk) >= chunk_rows:
+            yield '\n'.join(chunk) + '\n'
+            chunk = []
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
+
+
+def stream_csv_rows(columns, rows, chunk_rows=CHUNK_ROWS):
+    # Header line first, then each chunk of rows written through one reused in-memory buffer
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_rows:
+            writer.writerows(chunk)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            chunk = []
+    writer.writerows(chunk)
+    yield buffer.getvalue()
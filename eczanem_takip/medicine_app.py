@@ -1,11 +1,19 @@
 import os
+import itertools
 import logging
-from flask import Blueprint, request, jsonify, render_template
-from flask_mysqldb import MySQL
-from models.Medicine import Medicine  # Import the Medicine class from your models
+from flask import Blueprint, request, jsonify, render_template, Response, stream_with_context
+from db_router import RoutedMySQL, replica_read
+from models.Medicine import Medicine, ActiveIngredient, ACTIVE_INGREDIENT_COLUMNS  # Import the Medicine class from your models
 import pandas as pd
-
-mysql = MySQL()
+from openpyxl import load_workbook
+from medicine_search import search_index
+from barcode_cache import barcode_cache
+from substitute_index import substitute_index
+from json_stream import stream_json_rows
+from pagination import (get_page_args, decode_cursor, encode_cursor, cursor_position, resolve_total,
+                        approximate_row_count, count_cache)
+
+mysql = RoutedMySQL()
 logging.basicConfig(filename='/tmp/medicine_processing.log', level=logging.DEBUG, format='%(asctime)s %(message)s')
 
 medicine_bp = Blueprint('medicine', __name__)
@@ -33,25 +41,36 @@ def medicine_details(medicine_id):
 
 # Get All Medicines (Read)
 @medicine_bp.route('/get_all_medicines', methods=['GET'])
+@replica_read
 def get_all_medicines():
     try:
-        # Get query parameters for pagination
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 10))
+        # Get query parameters for pagination; `cursor` switches to keyset pagination on id
+        page, per_page, page_cursor, total_mode = get_page_args(request.args)
+        after = decode_cursor(page_cursor, 1)
+        after_id = cursor_position(after[0]) if after else 0
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
 
-        # Calculate offset for pagination
-        offset = (page - 1) * per_page
+    try:
+        if page_cursor is not None:
+            medicines = Medicine.get_all(mysql.connection, limit=per_page, after_id=after_id)
+        else:
+            # Calculate offset for pagination
+            offset = (page - 1) * per_page
+            medicines = Medicine.get_all(mysql.connection, limit=per_page, offset=offset)
 
-        # Retrieve medicines with pagination
-        medicines = Medicine.get_all(mysql.connection, limit=per_page, offset=offset)
-        total_medicines = Medicine.count_all(mysql.connection)  # Assuming a method to count all medicines
+        total_medicines = resolve_total(total_mode, ('medicine',),
+                                        lambda: Medicine.count_all(mysql.connection),
+                                        lambda: approximate_row_count(mysql.connection, 'medicine'))
+        next_cursor = encode_cursor(medicines[-1].id) if len(medicines) == per_page else None
 
         return jsonify({
             "success": True,
             "medicines": [medicine.serialize() for medicine in medicines],
-            "page": page,
+            "page": page if page_cursor is None else None,
             "per_page": per_page,
-            "total": total_medicines
+            "total": total_medicines,
+            "next_cursor": next_cursor
         }), 200
     except Exception as e:
         return jsonify({"success": False, "message": "Failed to retrieve medicines", "error": str(e)}), 500
@@ -70,28 +89,42 @@ def search_by_barcode():
         return jsonify({"success": False, "message": "Failed to search medicines by barcode", "error": str(e)}), 500
 
 
+@medicine_bp.route('/barcode_cache_stats', methods=['GET'])
+def barcode_cache_stats():
+    return jsonify({"success": True, "barcode_cache": barcode_cache.stats()}), 200
+
+
 @medicine_bp.route('/search_medicines', methods=['GET'])
 def search_medicines():
     try:
         # Get query parameters for search and pagination
         name_query = request.args.get('name', '')
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 10))
-
+        page, per_page, page_cursor, _ = get_page_args(request.args)
+        # Results are ranked in the in-memory index, so the cursor carries the position in that ranking
+        after = decode_cursor(page_cursor, 1)
         # Calculate offset for pagination
-        offset = (page - 1) * per_page
+        if page_cursor is not None:
+            offset = cursor_position(after[0]) if after else 0
+        else:
+            offset = (page - 1) * per_page
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    try:
 
-        # Search medicines with pagination
-        medicines = Medicine.search_by_name(mysql.connection, name_query, limit=per_page, offset=offset)
-        total_medicines = Medicine.count_by_name(mysql.connection,
-                                                 name_query)  # Assuming a method to count search results
+        # Search medicines with pagination; the total comes from the same index pass. The index is shared by
+        # every request, so when it needs loading it is read from the primary.
+        medicines, total_medicines = Medicine.search(mysql.primary, name_query, limit=per_page, offset=offset)
+        next_offset = offset + len(medicines)
+        next_cursor = encode_cursor(next_offset) if next_offset < total_medicines else None
 
         return jsonify({
             "success": True,
             "medicines": [medicine.serialize() for medicine in medicines],
-            "page": page,
+            "page": page if page_cursor is None else None,
             "per_page": per_page,
-            "total": total_medicines
+            "total": total_medicines,
+            "next_cursor": next_cursor
         }), 200
     except Exception as e:
         return jsonify({"success": False, "message": "Failed to search medicines", "error": str(e)}), 500
@@ -114,6 +147,52 @@ def get_medicine(medicine_id):
         return jsonify({"success": False, "message": "Failed to retrieve medicine", "error": str(e)}), 500
 
 
+MAX_BATCH_SIZE = 500
+
+
+# Get Medicines by IDs or Barcodes (Read, batch)
+@medicine_bp.route('/get_medicines', methods=['POST'], endpoint='get_medicines')
+def get_medicines():
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "message": "A JSON object is required"}), 400
+    ids = data.get('ids') or []
+    barcodes = data.get('barcodes') or []
+    if not isinstance(ids, list) or not isinstance(barcodes, list):
+        return jsonify({"success": False, "message": "ids and barcodes must be lists"}), 400
+    barcodes = [str(barcode) for barcode in barcodes]
+
+    if not ids and not barcodes:
+        return jsonify({"success": False, "message": "ids or barcodes are required"}), 400
+    if len(ids) + len(barcodes) > MAX_BATCH_SIZE:
+        return jsonify({"success": False, "message": f"At most {MAX_BATCH_SIZE} medicines per request"}), 400
+
+    try:
+        ids = [int(medicine_id) for medicine_id in ids]
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "ids must be integers"}), 400
+
+    try:
+        by_id = {}
+        for medicine, active_ingredients in Medicine.get_many_with_active_ingredients(mysql.connection, ids, barcodes):
+            medicine_data = medicine.serialize()
+            medicine_data['active_ingredients'] = [ingredient.serialize() for ingredient in active_ingredients]
+            by_id[medicine.id] = medicine_data
+        by_barcode = {medicine_data['barcode']: medicine_data for medicine_data in by_id.values()}
+
+        # Keep the caller's order so basket and stock rows line up with the response
+        medicines, not_found = [], []
+        for key, found in [(medicine_id, by_id) for medicine_id in ids] + [(barcode, by_barcode) for barcode in barcodes]:
+            if key in found:
+                medicines.append(found[key])
+            else:
+                not_found.append(key)
+
+        return jsonify({"success": True, "medicines": medicines, "not_found": not_found}), 200
+    except Exception as e:
+        return jsonify({"success": False, "message": "Failed to retrieve medicines", "error": str(e)}), 500
+
+
 # Update Medicine (Update)
 @medicine_bp.route('/update_medicine/<int:medicine_id>', methods=['PUT'], endpoint='update_medicine')
 def update_medicine(medicine_id):
@@ -142,17 +221,13 @@ def update_medicine(medicine_id):
         medicine.barcode = barcode
         medicine.equivalent_medicine_group = equivalent_medicine_group
 
+        # Update active ingredients by diffing against the current links; Medicine.update commits both
+        # changes in the same transaction
+        Medicine.set_active_ingredients(mysql.connection, medicine_id,
+                                        [ingredient.get('name') for ingredient in active_ingredients
+                                         if ingredient.get('name')])
         Medicine.update(mysql.connection, medicine)
 
-        # Update active ingredients
-        Medicine.remove_all_active_ingredients(mysql.connection, medicine_id)
-        for ingredient in active_ingredients:
-            ingredient_name = ingredient.get('name')
-            if ingredient_name:
-                active_ingredient_id = Medicine.add_active_ingredient(mysql.connection, ingredient_name
-                                                                     )
-                Medicine.add_medicine_active_ingredient(mysql.connection, medicine_id, active_ingredient_id)
-
         return jsonify(
             {"success": True, "message": "Medicine successfully updated", "medicine": medicine.serialize()}), 200
     except Exception as e:
@@ -208,11 +283,166 @@ def register_medicine():
         return jsonify({"success": False, "message": "Failed to add medicine", "error": str(e)}), 500
 VALID_REPORT_TYPES = {'KIRMIZI', 'MOR', 'TURUNCU', 'YEŞİL', 'NORMAL'}
 
+EXCEL_IMPORT_CHUNK_SIZE = 1000
+
+
+def _cell_to_str(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        # Barcodes stored as numbers come back as floats
+        return str(int(value))
+    return str(value).strip()
+
+
+def _iter_excel_chunks(file, chunk_size):
+    # Streams (row_number, row_dict) chunks from the first sheet without loading the workbook into memory
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [_cell_to_str(cell) for cell in next(rows, ())]
+        chunk = []
+        for row_number, values in enumerate(rows, start=2):
+            if not any(value is not None for value in values):
+                continue
+            chunk.append((row_number, dict(zip(header, values))))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        workbook.close()
+
+
+EXCEL_COLUMN_LIMITS = (('public_number', 80), ('atc_code', 200), ('barcode', 200))
+
+
+def _parse_excel_row(row):
+    report_type = _cell_to_str(row.get('Reçete Türü')).upper() or 'NORMAL'
+    medicine = Medicine(None,
+                        _cell_to_str(row.get('Barkod')),
+                        _cell_to_str(row.get('ATC Kodu')),
+                        report_type if report_type in VALID_REPORT_TYPES else 'NORMAL',
+                        _cell_to_str(row.get('İlaç Adı'))[:200],
+                        _cell_to_str(row.get('Firma Adı'))[:200],
+                        _cell_to_str(row.get('Form'))[:200],
+                        _cell_to_str(row.get('Barkod')),
+                        _cell_to_str(row.get('Equivalent Medicine Group'))[:80])
+    if not all([medicine.public_number, medicine.atc_code, medicine.name, medicine.brand, medicine.barcode]):
+        raise ValueError("Barcode, ATC code, name and brand are required")
+    # Checked here so one oversized value fails its own row rather than the chunk's insert
+    for column, limit in EXCEL_COLUMN_LIMITS:
+        if len(getattr(medicine, column)) > limit:
+            raise ValueError(f"{column} is longer than {limit} characters")
+    ingredient_names = [name.strip() for name in _cell_to_str(row.get('ATC Adı')).split(',') if name.strip()]
+    for ingredient_name in ingredient_names:
+        if len(ingredient_name) > 200:
+            raise ValueError("Active ingredient names are limited to 200 characters")
+    return medicine, ingredient_names
+
+
+def _import_excel_chunk(connection, chunk, ingredient_ids, errors):
+    # Validates a chunk, then writes it with multi-row inserts in a single transaction
+    parsed = []
+    seen_barcodes = set()
+    for row_number, row in chunk:
+        try:
+            medicine, ingredient_names = _parse_excel_row(row)
+        except Exception as e:
+            errors.append({"row": row_number, "error": str(e)})
+            continue
+        if medicine.barcode in seen_barcodes:
+            errors.append({"row": row_number, "error": f"Duplicate barcode {medicine.barcode} in file"})
+            continue
+        seen_barcodes.add(medicine.barcode)
+        parsed.append((row_number, medicine, ingredient_names))
+
+    existing = Medicine.get_existing_barcodes(connection, list(seen_barcodes))
+    pending = []
+    for row_number, medicine, ingredient_names in parsed:
+        if medicine.barcode in existing:
+            errors.append({"row": row_number, "error": f"Barcode {medicine.barcode} already exists"})
+        else:
+            pending.append((row_number, medicine, ingredient_names))
+    if not pending:
+        return 0
+
+    try:
+        _write_excel_rows(connection, pending, ingredient_ids)
+        return len(pending)
+    except Exception as e:
+        connection.rollback()
+        logging.error(f"Error importing rows {pending[0][0]}-{pending[-1][0]}: {str(e)}")
+        if len(pending) == 1:
+            errors.append({"row": pending[0][0], "error": str(e)})
+            return 0
+
+    # The chunk failed as a whole: retry its rows one by one so only the bad rows are reported
+    imported = 0
+    for row in pending:
+        try:
+            _write_excel_rows(connection, [row], ingredient_ids)
+            imported += 1
+        except Exception as e:
+            connection.rollback()
+            errors.append({"row": row[0], "error": str(e)})
+    return imported
+
+
+def _write_excel_rows(connection, pending, ingredient_ids):
+    # Inserts the rows, their new ingredients and links in one transaction; commits or raises
+    medicine_ids = Medicine.add_many(connection, [medicine for _, medicine, _ in pending])
+
+    new_names = {}
+    for _, _, ingredient_names in pending:
+        for ingredient_name in ingredient_names:
+            key = ActiveIngredient.normalize_name(ingredient_name)
+            if key not in ingredient_ids:
+                new_names.setdefault(key, ingredient_name)
+    new_ids = Medicine.add_active_ingredients(connection, list(new_names.values()))
+
+    links = set()
+    for _, medicine, ingredient_names in pending:
+        for ingredient_name in ingredient_names:
+            key = ActiveIngredient.normalize_name(ingredient_name)
+            links.add((medicine_ids[medicine.barcode], ingredient_ids.get(key) or new_ids[key]))
+    Medicine.add_medicine_active_ingredients(connection, sorted(links))
+
+    connection.commit()
+    # Only remember new ingredient ids once their rows are committed
+    ingredient_ids.update(new_ids)
+
+
+def _register_medicine_from_excel_stream(file, chunk_size):
+    connection = mysql.connection
+    ingredient_ids = Medicine.get_active_ingredient_id_map(connection)
+    errors = []
+    imported = 0
+    for chunk in _iter_excel_chunks(file, chunk_size):
+        imported += _import_excel_chunk(connection, chunk, ingredient_ids, errors)
+
+    if imported:
+        # Cheaper to rebuild the search index on the next query than to patch it row by row
+        search_index.clear()
+        substitute_index.clear()
+        count_cache.invalidate('medicine')
+
+    return jsonify({"success": True, "message": f"{imported} medicines successfully added to the system.",
+                    "imported": imported, "failed": len(errors), "errors": errors}), 201
+
+
 @medicine_bp.route('/register_medicine_from_excel', methods=['POST'], endpoint='register_medicine_from_excel')
 def register_medicine_from_excel():
     try:
         # Load the Excel file
         file = request.files['file']
+
+        # mode=stream reads the sheet in chunks and reports bad rows instead of stopping at the first one
+        if request.values.get('mode') == 'stream':
+            chunk_size = int(request.values.get('chunk_size', EXCEL_IMPORT_CHUNK_SIZE))
+            return _register_medicine_from_excel_stream(file, max(chunk_size, 1))
+
         excel_data = pd.read_excel(file)
 
         # Replace NaN values with defaults
@@ -296,9 +526,13 @@ def get_active_ingredient_by_name(name):
 @medicine_bp.route('/get_all_active_ingredients', methods=['GET'], endpoint='get_all_active_ingredients')
 def get_all_active_ingredients():
     try:
-        active_ingredients = Medicine.get_all_active_ingredients(mysql.connection)
-        return jsonify(
-            {"success": True, "active_ingredients": [ingredient.serialize() for ingredient in active_ingredients]}), 200
+        # Streamed straight from an unbuffered cursor; memory stays flat however many ingredients there are.
+        # The first row is fetched here so query errors still produce the JSON error response below.
+        rows = Medicine.iter_active_ingredient_rows(mysql.connection)
+        first = next(rows, None)
+        body = stream_json_rows('active_ingredients', ACTIVE_INGREDIENT_COLUMNS,
+                                itertools.chain([first] if first else [], rows))
+        return Response(stream_with_context(body), mimetype='application/json'), 200
     except Exception as e:
         return jsonify({"success": False, "message": "Failed to retrieve active ingredients", "error": str(e)}), 500
 
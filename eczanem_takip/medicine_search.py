@@ -0,0 +1,257 @@
+import threading
+import time
+from collections import OrderedDict
+
+# In-process trigram index over medicine name, brand and barcode, plus 1 and 2 character grams for short
+# queries. Rows are kept as tuples in `SELECT *` column order so the model can rebuild Medicine objects
+# without going back to MySQL. Reloads build a new index next to the live one and swap it in, so searches
+# are not blocked while the catalog is read.
+
+MEDICINE_COLUMNS = ('id', 'public_number', 'atc_code', 'report_type', 'name', 'brand', 'form', 'barcode',
+                    'equivalent_medicine_group')
+NAME, BRAND, BARCODE = 4, 5, 7
+GRAM_SIZE = 3
+# Other workers write to the same catalog, so the index is rebuilt from MySQL after this many seconds,
+# by the refresher thread when one runs
+REFRESH_SECONDS = 300
+# Sorted matches of recent queries, so paging and repeated keystrokes skip the scan
+RESULT_CACHE_SIZE = 64
+
+_TURKISH_CASE = str.maketrans({'İ': 'i', 'I': 'ı'})
+_TURKISH_ASCII = str.maketrans('çğıöşüâîû', 'cgiosuaiu')
+
+
+def fold_text(text):
+    # Turkish-aware lower casing, then diacritics are dropped so "sise", "ŞİŞE" and "şişe" all match
+    if not text:
+        return ''
+    return ' '.join(str(text).translate(_TURKISH_CASE).lower().translate(_TURKISH_ASCII).split())
+
+
+def _grams(text):
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+def _short_grams(text):
+    return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class MedicineSearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._rows = {}
+        self._folded = {}
+        self._postings = {}
+        self._short_postings = {}
+        self._results = OrderedDict()
+        self._ordered_ids = None
+        self._position = {}
+        self._loaded_at = None
+        # Writes made while a reload reads the catalog, replayed on the new index
+        self._pending = None
+        self._thread = None
+        # Bumped on every change so derived indexes know when to rebuild
+        self.version = 0
+
+    @property
+    def loaded(self):
+        return self._loaded_at is not None
+
+    def load(self, connection):
+        with self._lock:
+            self._pending = []
+        try:
+            cursor = connection.cursor()
+            cursor.execute(f"SELECT {', '.join(MEDICINE_COLUMNS)} FROM medicine")
+            rows = cursor.fetchall()
+            cursor.close()
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        self.load_rows(rows)
+
+    def load_rows(self, rows):
+        # rows: medicine tuples in MEDICINE_COLUMNS order, e.g. from a catalog snapshot.
+        # The new index is built without the lock, then swapped in with the writes made meanwhile.
+        fresh = MedicineSearchIndex()
+        for row in rows:
+            fresh._add(tuple(row))
+        fresh._name_order()
+        with self._lock:
+            self._rows, self._folded = fresh._rows, fresh._folded
+            self._postings, self._short_postings = fresh._postings, fresh._short_postings
+            self._invalidate()
+            self._ordered_ids, self._position = fresh._ordered_ids, fresh._position
+            for operation, value in self._pending or ():
+                self._remove(value[0] if operation == 'upsert' else value)
+                if operation == 'upsert':
+                    self._add(value)
+            if self._pending:
+                self._ordered_ids = None
+            self._pending = None
+            self._loaded_at = time.monotonic()
+
+    def ensure_loaded(self, connection):
+        # Stale indexes are reloaded here only when no refresher thread does it in the background
+        if not self.loaded or (self._thread is None and time.monotonic() - self._loaded_at > REFRESH_SECONDS):
+            self.load(connection)
+
+    def start_refresher(self, app, mysql, interval=REFRESH_SECONDS):
+        if self._thread is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    with app.app_context():
+                        self.load(mysql.connection)
+                except Exception as e:
+                    app.logger.warning(f"Search index refresh failed: {str(e)}")
+
+        self._thread = threading.Thread(target=run, name='search-index-refresher', daemon=True)
+        self._thread.start()
+
+    def clear(self):
+        with self._lock:
+            self._rows = {}
+            self._folded = {}
+            self._postings = {}
+            self._short_postings = {}
+            self._invalidate()
+            self._loaded_at = None
+
+    def rows(self):
+        with self._lock:
+            return list(self._rows.values())
+
+    def upsert(self, row):
+        # No-op until the index has been loaded; the first search loads a fresh copy anyway
+        if not self.loaded:
+            return
+        with self._lock:
+            self._remove(row[0])
+            self._add(tuple(row))
+            self._invalidate()
+            if self._pending is not None:
+                self._pending.append(('upsert', tuple(row)))
+
+    def remove(self, medicine_id):
+        if not self.loaded:
+            return
+        with self._lock:
+            self._remove(medicine_id)
+            self._invalidate()
+            if self._pending is not None:
+                self._pending.append(('remove', medicine_id))
+
+    def _invalidate(self):
+        self.version += 1
+        self._results.clear()
+        self._ordered_ids = None
+
+    def _name_order(self):
+        # Ids sorted by folded name, rebuilt lazily after writes so ranking never sorts strings
+        if self._ordered_ids is None:
+            folded = self._folded
+            self._ordered_ids = sorted(folded, key=lambda medicine_id: (folded[medicine_id][0], medicine_id))
+            self._position = {medicine_id: i for i, medicine_id in enumerate(self._ordered_ids)}
+        return self._ordered_ids
+
+    def _add(self, row):
+        medicine_id = row[0]
+        folded = (fold_text(row[NAME]), fold_text(row[BRAND]), fold_text(row[BARCODE]))
+        self._rows[medicine_id] = row
+        self._folded[medicine_id] = folded
+        for gram in _grams(folded[0]) | _grams(folded[1]) | _grams(folded[2]):
+            self._postings.setdefault(gram, set()).add(medicine_id)
+        for gram in _short_grams(folded[0]) | _short_grams(folded[1]) | _short_grams(folded[2]):
+            self._short_postings.setdefault(gram, set()).add(medicine_id)
+
+    def _remove(self, medicine_id):
+        folded = self._folded.pop(medicine_id, None)
+        self._rows.pop(medicine_id, None)
+        if folded is None:
+            return
+        for postings, grams in ((self._postings, _grams), (self._short_postings, _short_grams)):
+            for gram in grams(folded[0]) | grams(folded[1]) | grams(folded[2]):
+                ids = postings.get(gram)
+                if ids is not None:
+                    ids.discard(medicine_id)
+                    if not ids:
+                        del postings[gram]
+
+    def _candidates(self, query):
+        # Candidate ids in name order
+        ordered_ids = self._name_order()
+        if not query:
+            return ordered_ids
+        if len(query) < GRAM_SIZE:
+            candidates = self._short_postings.get(query, ())
+            if len(candidates) * 8 > len(ordered_ids):
+                return [medicine_id for medicine_id in ordered_ids if medicine_id in candidates]
+            return sorted(candidates, key=self._position.__getitem__)
+        posting_lists = []
+        for gram in _grams(query):
+            ids = self._postings.get(gram)
+            if not ids:
+                return []
+            posting_lists.append(ids)
+        posting_lists.sort(key=len)
+        candidates = set.intersection(*posting_lists)
+        if len(candidates) * 8 > len(ordered_ids):
+            # Filtering the presorted ids is cheaper than sorting a large candidate set
+            return [medicine_id for medicine_id in ordered_ids if medicine_id in candidates]
+        return sorted(candidates, key=self._position.__getitem__)
+
+    def _matches(self, query):
+        # Matching ids ordered by relevance, then by name
+        folded = self._folded
+        word_query = ' ' + query
+        exact, prefix, word, name_hits, brand_hits, barcode_hits = [], [], [], [], [], []
+        for medicine_id in self._candidates(query):
+            name, brand, barcode = folded[medicine_id]
+            if barcode == query:
+                exact.append(medicine_id)
+            elif query in name:
+                if name.startswith(query):
+                    prefix.append(medicine_id)
+                elif word_query in name:
+                    word.append(medicine_id)
+                else:
+                    name_hits.append(medicine_id)
+            elif query in brand:
+                brand_hits.append(medicine_id)
+            elif query in barcode:
+                barcode_hits.append(medicine_id)
+        return exact + prefix + word + name_hits + brand_hits + barcode_hits
+
+    def name_ids(self, text):
+        # Ids of medicines whose folded name contains the folded text, in name order
+        query = fold_text(text)
+        with self._lock:
+            folded = self._folded
+            return [medicine_id for medicine_id in self._candidates(query) if query in folded[medicine_id][0]]
+
+    def _sorted_matches(self, query):
+        matches = self._results.get(query)
+        if matches is None:
+            matches = self._matches(query) if query else sorted(self._rows)
+            self._results[query] = matches
+            if len(self._results) > RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+        else:
+            self._results.move_to_end(query)
+        return matches
+
+    def search(self, text, limit=10, offset=0):
+        # Returns (rows, total) for one page, ranked by relevance and then by name.
+        # An empty query lists the whole catalog in id order, like the old LIKE '%%'.
+        query = fold_text(text)
+        with self._lock:
+            matches = self._sorted_matches(query)
+            return [self._rows[medicine_id] for medicine_id in matches[offset:offset + limit]], len(matches)
+
+
+search_index = MedicineSearchIndex()
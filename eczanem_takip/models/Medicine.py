@@ -1,10 +1,35 @@
 import MySQLdb
+from medicine_search import search_index
+from barcode_cache import barcode_cache
+from substitute_index import substitute_index
+from expiry_scanner import expiry_scanner
+from response_cache import response_cache
+from pagination import count_cache
+from models.Sale import Sale
+
+ACTIVE_INGREDIENT_COLUMNS = ('id', 'name')
+MEDICINE_COLUMNS = ('id', 'public_number', 'atc_code', 'report_type', 'name', 'brand', 'form', 'barcode',
+                    'equivalent_medicine_group')
+
+
+def bump_catalog_version(cursor):
+    # Runs in the transaction of every catalog write, so a snapshot stamped with an older version is not trusted
+    cursor.execute("UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+
 
 class ActiveIngredient:
+    # Slots keep per-row objects small in large listings
+    __slots__ = ACTIVE_INGREDIENT_COLUMNS
+
     def __init__(self, id, name):
         self.id = id
         self.name = name
 
+    @staticmethod
+    def normalize_name(name):
+        # Key used to match ingredient names regardless of case and spacing
+        return ' '.join(str(name).split()).casefold()
+
     def serialize(self):
         return {
             'id': self.id,
@@ -12,6 +37,8 @@ class ActiveIngredient:
         }
 
 class Medicine:
+    __slots__ = MEDICINE_COLUMNS
+
     def __init__(self, id, public_number, atc_code, report_type, name, brand, form, barcode, equivalent_medicine_group):
         self.id = id
         self.public_number = public_number
@@ -36,11 +63,19 @@ class Medicine:
             'equivalent_medicine_group': self.equivalent_medicine_group
         }
 
+    def to_row(self):
+        # Column order of `SELECT * FROM medicine`
+        return (self.id, self.public_number, self.atc_code, self.report_type, self.name, self.brand, self.form,
+                self.barcode, self.equivalent_medicine_group)
+
     @staticmethod
-    def get_all(connection, limit=10, offset=0):
+    def get_all(connection, limit=10, offset=0, after_id=None):
+        # after_id seeks past the last id of the previous page instead of skipping `offset` rows
         cursor = connection.cursor()
-        query = "SELECT * FROM medicine LIMIT %s OFFSET %s"
-        cursor.execute(query, (limit, offset))
+        if after_id is not None:
+            cursor.execute("SELECT * FROM medicine WHERE id > %s ORDER BY id LIMIT %s", (after_id, limit))
+        else:
+            cursor.execute("SELECT * FROM medicine ORDER BY id LIMIT %s OFFSET %s", (limit, offset))
         result = cursor.fetchall()
         cursor.close()
         return [Medicine(*row) for row in result]
@@ -56,32 +91,45 @@ class Medicine:
 
     @staticmethod
     def get_by_id(connection, medicine_id):
-        cursor = connection.cursor(MySQLdb.cursors.DictCursor)
+        cursor = connection.cursor()
         cursor.execute("SELECT * FROM medicine WHERE id = %s", (medicine_id,))
         row = cursor.fetchone()
         cursor.close()
         if row:
-            return Medicine(**row)
+            return Medicine(*row)
         return None
 
+    @staticmethod
+    def get_by_barcode(connection, barcode):
+        row = barcode_cache.get(barcode)
+        if row is None:
+            cursor = connection.cursor()
+            cursor.execute("SELECT * FROM medicine WHERE barcode = %s", (barcode,))
+            row = cursor.fetchone()
+            cursor.close()
+            if row is None:
+                return None
+            barcode_cache.put(row)
+        return Medicine(*row)
+
     @staticmethod
     def get_by_name_or_barcode(connection, identifier):
-        cursor = connection.cursor(MySQLdb.cursors.DictCursor)
-        cursor.execute("SELECT * FROM medicine WHERE name = %s OR barcode = %s", (identifier, identifier))
+        # Barcode first (cached, unique index), then the indexed name lookup
+        medicine = Medicine.get_by_barcode(connection, identifier)
+        if medicine:
+            return medicine
+        cursor = connection.cursor()
+        cursor.execute("SELECT * FROM medicine WHERE name = %s LIMIT 1", (identifier,))
         row = cursor.fetchone()
         cursor.close()
         if row:
-            return Medicine(**row)
+            return Medicine(*row)
         return None
 
     @staticmethod
     def search_by_barcode(connection, barcode):
-        cursor = connection.cursor()
-        query = "SELECT * FROM medicine WHERE barcode = %s"
-        cursor.execute(query, (barcode,))
-        result = cursor.fetchall()
-        cursor.close()
-        return [Medicine(*row) for row in result]
+        medicine = Medicine.get_by_barcode(connection, barcode)
+        return [medicine] if medicine else []
 
     @staticmethod
     def add(connection, medicine):
@@ -91,28 +139,107 @@ class Medicine:
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
         """, (medicine.public_number, medicine.atc_code, medicine.report_type, medicine.name, medicine.brand,
               medicine.form, medicine.barcode, medicine.equivalent_medicine_group))
-        connection.commit()
         medicine_id = cursor.lastrowid
+        bump_catalog_version(cursor)
+        connection.commit()
         cursor.close()
+        medicine.id = medicine_id
+        search_index.upsert(medicine.to_row())
+        barcode_cache.invalidate(barcode=medicine.barcode)
+        substitute_index.mark_stale(medicine_id)
+        count_cache.invalidate('medicine')
         return medicine_id
 
     @staticmethod
-    def search_by_name(connection, name, limit=10, offset=0):
+    def get_existing_barcodes(connection, barcodes):
+        if not barcodes:
+            return set()
         cursor = connection.cursor()
-        query = "SELECT * FROM medicine WHERE name LIKE %s LIMIT %s OFFSET %s"
-        cursor.execute(query, (f"%{name}%", limit, offset))
-        result = cursor.fetchall()
+        placeholders = ', '.join(['%s'] * len(barcodes))
+        cursor.execute(f"SELECT barcode FROM medicine WHERE barcode IN ({placeholders})", tuple(barcodes))
+        rows = cursor.fetchall()
         cursor.close()
-        return [Medicine(*row) for row in result]
+        return {row[0] for row in rows}
 
     @staticmethod
-    def count_by_name(connection, name):
+    def get_ids_by_barcodes(connection, barcodes):
+        # barcode -> id for the barcodes that exist
+        if not barcodes:
+            return {}
         cursor = connection.cursor()
-        query = "SELECT COUNT(*) FROM medicine WHERE name LIKE %s"
-        cursor.execute(query, (f"%{name}%",))
-        result = cursor.fetchone()
+        placeholders = ', '.join(['%s'] * len(barcodes))
+        cursor.execute(f"SELECT barcode, id FROM medicine WHERE barcode IN ({placeholders})", tuple(barcodes))
+        rows = cursor.fetchall()
         cursor.close()
-        return result[0]
+        return dict(rows)
+
+    @staticmethod
+    def get_names_by_ids(connection, medicine_ids):
+        # id -> (name, barcode)
+        if not medicine_ids:
+            return {}
+        cursor = connection.cursor()
+        placeholders = ', '.join(['%s'] * len(medicine_ids))
+        cursor.execute(f"SELECT id, name, barcode FROM medicine WHERE id IN ({placeholders})", tuple(medicine_ids))
+        rows = cursor.fetchall()
+        cursor.close()
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    @staticmethod
+    def get_existing_ids(connection, medicine_ids):
+        if not medicine_ids:
+            return set()
+        cursor = connection.cursor()
+        placeholders = ', '.join(['%s'] * len(medicine_ids))
+        cursor.execute(f"SELECT id FROM medicine WHERE id IN ({placeholders})", tuple(medicine_ids))
+        rows = cursor.fetchall()
+        cursor.close()
+        return {row[0] for row in rows}
+
+    @staticmethod
+    def add_many(connection, medicines):
+        # Multi-row insert without commit; the caller owns the transaction.
+        # Returns a barcode -> id map for the inserted medicines.
+        if not medicines:
+            return {}
+        cursor = connection.cursor()
+        cursor.executemany("""
+            INSERT INTO medicine (public_number, atc_code, report_type, name, brand, form, barcode, equivalent_medicine_group)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, [(medicine.public_number, medicine.atc_code, medicine.report_type, medicine.name, medicine.brand,
+               medicine.form, medicine.barcode, medicine.equivalent_medicine_group) for medicine in medicines])
+        bump_catalog_version(cursor)
+        barcodes = [medicine.barcode for medicine in medicines]
+        placeholders = ', '.join(['%s'] * len(barcodes))
+        cursor.execute(f"SELECT id, barcode FROM medicine WHERE barcode IN ({placeholders})", tuple(barcodes))
+        rows = cursor.fetchall()
+        cursor.close()
+        ids = {row[1]: row[0] for row in rows}
+        for medicine in medicines:
+            medicine.id = ids.get(medicine.barcode)
+        return ids
+
+    @staticmethod
+    def search(connection, name, limit=10, offset=0):
+        # Served from the in-process trigram index; the page and the total come from the same pass
+        search_index.ensure_loaded(connection)
+        rows, total = search_index.search(name, limit=limit, offset=offset)
+        return [Medicine(*row) for row in rows], total
+
+    @staticmethod
+    def ids_by_name(connection, name):
+        # Ids of medicines whose name contains `name`, from the search index instead of a LIKE scan
+        search_index.ensure_loaded(connection)
+        return search_index.name_ids(name)
+
+    @staticmethod
+    def search_by_name(connection, name, limit=10, offset=0):
+        return Medicine.search(connection, name, limit=limit, offset=offset)[0]
+
+    @staticmethod
+    def count_by_name(connection, name):
+        return Medicine.search(connection, name, limit=0)[1]
+
     @staticmethod
     def update(connection, medicine):
         cursor = connection.cursor()
@@ -121,75 +248,158 @@ class Medicine:
             barcode = %s, equivalent_medicine_group = %s WHERE id = %s
         """, (medicine.public_number, medicine.atc_code, medicine.report_type, medicine.name, medicine.brand,
               medicine.form, medicine.barcode, medicine.equivalent_medicine_group, medicine.id))
+        bump_catalog_version(cursor)
         connection.commit()
         cursor.close()
+        search_index.upsert(medicine.to_row())
+        barcode_cache.invalidate(medicine_id=medicine.id, barcode=medicine.barcode)
+        substitute_index.mark_stale(medicine.id)
+        # Sales counts filtered by medicine name may change with the name
+        count_cache.invalidate('medicine_sales')
 
     @staticmethod
     def delete(connection, medicine_id):
         cursor = connection.cursor()
+        # The partitioned sales tables cannot carry foreign keys, so their rows are removed here
+        cursor.execute("DELETE FROM medicine_sales WHERE medicine_id = %s", (medicine_id,))
+        cursor.execute("DELETE FROM medicine_sales_archive WHERE medicine_id = %s", (medicine_id,))
         cursor.execute("DELETE FROM medicine WHERE id = %s", (medicine_id,))
+        bump_catalog_version(cursor)
         connection.commit()
         cursor.close()
+        search_index.remove(medicine_id)
+        barcode_cache.invalidate(medicine_id=medicine_id)
+        substitute_index.mark_stale(medicine_id)
+        count_cache.invalidate('medicine')
+        count_cache.invalidate('medicine_sales')
+        # The medicine's lots and rollup rows went with it (ON DELETE CASCADE)
+        count_cache.invalidate('medicine_stock')
+        expiry_scanner.clear()
+        response_cache.clear()
 
     @staticmethod
     def record_sale_by_name_or_barcode(connection, user_id, identifier, customer_name, sale_date, quantity):
-        cursor = connection.cursor()
-        try:
-            medicine = Medicine.get_by_name_or_barcode(connection, identifier)
-            if not medicine:
-                raise Exception("Medicine not found")
-
-            cursor.execute("""
-                INSERT INTO medicine_sales (user_id, medicine_id, customer_name, sale_date, quantity)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (user_id, medicine.id, customer_name, sale_date, quantity))
-
-            # Decrement the stock
-            cursor.execute("""
-                UPDATE medicine_stock
-                SET quantity = quantity - %s
-                WHERE medicine_id = %s AND user_id = %s AND quantity >= %s
-                ORDER BY expiry_date ASC
-                LIMIT 1
-            """, (quantity, medicine.id, user_id, quantity))
-
-            if cursor.rowcount == 0:
-                raise Exception("Not enough stock to complete the sale")
-
-            connection.commit()
-        except Exception as e:
-            connection.rollback()
-            raise e
-        finally:
-            cursor.close()
-
+        medicine = Medicine.get_by_name_or_barcode(connection, identifier)
+        if not medicine:
+            raise Exception("Medicine not found")
 
+        # Stock is decremented first-expiry-first-out by the basket sale engine
+        Sale.record_basket(connection, user_id, [{"medicine_id": medicine.id, "quantity": quantity}],
+                           customer_name, sale_date)
 
     @staticmethod
     def get_active_ingredient_by_name(connection, name):
-        cursor = connection.cursor(MySQLdb.cursors.DictCursor)
-        cursor.execute("SELECT * FROM active_ingredient WHERE name = %s", (name,))
+        cursor = connection.cursor()
+        cursor.execute("SELECT id, name FROM active_ingredient WHERE name = %s", (name,))
         row = cursor.fetchone()
         cursor.close()
         if row:
-            return ActiveIngredient(**row)
+            return ActiveIngredient(*row)
         return None
 
     @staticmethod
     def add_active_ingredient(connection, name):
         cursor = connection.cursor()
         cursor.execute("INSERT INTO active_ingredient (name) VALUES (%s)", (name,))
+        ingredient_id = cursor.lastrowid
+        bump_catalog_version(cursor)
         connection.commit()
-        return cursor.lastrowid
+        return ingredient_id
 
     @staticmethod
     def add_medicine_active_ingredient(connection, medicine_id, active_ingredient_id):
         cursor = connection.cursor()
         cursor.execute("INSERT INTO medicine_active_ingredient (medicine_id, active_ingredient_id) VALUES (%s, %s)",
                        (medicine_id, active_ingredient_id))
+        bump_catalog_version(cursor)
         connection.commit()
 
 
+    @staticmethod
+    def get_active_ingredient_id_map(connection):
+        # Normalized name -> id; the oldest row wins when a name was stored more than once
+        cursor = connection.cursor()
+        cursor.execute("SELECT id, name FROM active_ingredient ORDER BY id")
+        rows = cursor.fetchall()
+        cursor.close()
+        id_map = {}
+        for ingredient_id, name in rows:
+            id_map.setdefault(ActiveIngredient.normalize_name(name), ingredient_id)
+        return id_map
+
+    @staticmethod
+    def add_active_ingredients(connection, names):
+        # Multi-row insert without commit; returns a normalized name -> id map for the new rows
+        if not names:
+            return {}
+        cursor = connection.cursor()
+        cursor.executemany("INSERT INTO active_ingredient (name) VALUES (%s)", [(name,) for name in names])
+        bump_catalog_version(cursor)
+        placeholders = ', '.join(['%s'] * len(names))
+        cursor.execute(f"SELECT id, name FROM active_ingredient WHERE name IN ({placeholders}) ORDER BY id DESC",
+                       tuple(names))
+        rows = cursor.fetchall()
+        cursor.close()
+        return {ActiveIngredient.normalize_name(name): ingredient_id for ingredient_id, name in rows}
+
+    @staticmethod
+    def add_medicine_active_ingredients(connection, links):
+        # links: iterable of (medicine_id, active_ingredient_id); no commit
+        links = list(links)
+        if not links:
+            return
+        cursor = connection.cursor()
+        cursor.executemany("INSERT INTO medicine_active_ingredient (medicine_id, active_ingredient_id) VALUES (%s, %s)",
+                           links)
+        bump_catalog_version(cursor)
+        cursor.close()
+
+    @staticmethod
+    def set_active_ingredients(connection, medicine_id, names):
+        # Applies only the link inserts/deletes needed to match `names`, reusing existing ingredient rows by
+        # normalized name. Does not commit; the caller commits together with the rest of its transaction.
+        wanted = {}
+        for name in names:
+            name = ' '.join(str(name).split())
+            if name:
+                wanted.setdefault(ActiveIngredient.normalize_name(name), name)
+
+        # Every linked id per normalized name: duplicates beyond the first are unlinked below
+        current = {}
+        for ingredient in Medicine.get_active_ingredients_for_medicine(connection, medicine_id):
+            current.setdefault(ActiveIngredient.normalize_name(ingredient.name), []).append(ingredient.id)
+
+        ingredient_ids = {key: current[key][0] for key in wanted if key in current}
+        missing = [name for key, name in wanted.items() if key not in ingredient_ids]
+        if missing:
+            cursor = connection.cursor()
+            placeholders = ', '.join(['%s'] * len(missing))
+            cursor.execute(f"SELECT id, name FROM active_ingredient WHERE name IN ({placeholders}) ORDER BY id",
+                           tuple(missing))
+            for ingredient_id, name in cursor.fetchall():
+                key = ActiveIngredient.normalize_name(name)
+                if key in wanted:
+                    ingredient_ids.setdefault(key, ingredient_id)
+            cursor.close()
+            new_names = [name for key, name in wanted.items() if key not in ingredient_ids]
+            ingredient_ids.update(Medicine.add_active_ingredients(connection, new_names))
+
+        wanted_ids = set(ingredient_ids.values())
+        current_ids = {ingredient_id for ids in current.values() for ingredient_id in ids}
+        stale_ids = sorted(current_ids - wanted_ids)
+        if stale_ids:
+            cursor = connection.cursor()
+            placeholders = ', '.join(['%s'] * len(stale_ids))
+            cursor.execute(f"""
+                DELETE FROM medicine_active_ingredient
+                WHERE medicine_id = %s AND active_ingredient_id IN ({placeholders})
+            """, (medicine_id, *stale_ids))
+            bump_catalog_version(cursor)
+            cursor.close()
+        Medicine.add_medicine_active_ingredients(
+            connection, [(medicine_id, ingredient_id) for ingredient_id in sorted(wanted_ids - current_ids)])
+        substitute_index.mark_stale(medicine_id)
+
     @staticmethod
     def get_active_ingredients_for_medicine(connection, medicine_id):
         cursor = connection.cursor()
@@ -203,12 +413,47 @@ class Medicine:
         cursor.close()
         return [ActiveIngredient(id=row[0], name=row[1]) for row in rows]
 
+    @staticmethod
+    def get_many_with_active_ingredients(connection, ids=(), barcodes=()):
+        # One LEFT JOIN for the whole batch; returns [(Medicine, [ActiveIngredient, ...]), ...] ordered by id
+        ids, barcodes = list(ids), list(barcodes)
+        conditions, params = [], []
+        if ids:
+            conditions.append(f"m.id IN ({', '.join(['%s'] * len(ids))})")
+            params.extend(ids)
+        if barcodes:
+            conditions.append(f"m.barcode IN ({', '.join(['%s'] * len(barcodes))})")
+            params.extend(barcodes)
+        if not conditions:
+            return []
+        cursor = connection.cursor()
+        cursor.execute(f"""
+            SELECT m.id, m.public_number, m.atc_code, m.report_type, m.name, m.brand, m.form, m.barcode,
+                   m.equivalent_medicine_group, ai.id, ai.name
+            FROM medicine m
+            LEFT JOIN medicine_active_ingredient mai ON mai.medicine_id = m.id
+            LEFT JOIN active_ingredient ai ON ai.id = mai.active_ingredient_id
+            WHERE {' OR '.join(conditions)}
+            ORDER BY m.id, ai.id
+        """, tuple(params))
+        rows = cursor.fetchall()
+        cursor.close()
+
+        results = []
+        for row in rows:
+            if not results or results[-1][0].id != row[0]:
+                results.append((Medicine(*row[:9]), []))
+            if row[9] is not None:
+                results[-1][1].append(ActiveIngredient(id=row[9], name=row[10]))
+        return results
+
     @staticmethod
     def update_active_ingredient(connection, ingredient):
         cursor = connection.cursor()
         cursor.execute("""
             UPDATE active_ingredient SET name = %s WHERE id = %s
         """, (ingredient.name, ingredient.id))
+        bump_catalog_version(cursor)
         connection.commit()
         cursor.close()
 
@@ -216,30 +461,46 @@ class Medicine:
     def delete_active_ingredient(connection, ingredient_id):
         cursor = connection.cursor()
         cursor.execute("DELETE FROM active_ingredient WHERE id = %s", (ingredient_id,))
+        bump_catalog_version(cursor)
         connection.commit()
         cursor.close()
 
     @staticmethod
     def get_active_ingredient_by_id(connection, ingredient_id):
-        cursor = connection.cursor(MySQLdb.cursors.DictCursor)
-        cursor.execute("SELECT * FROM active_ingredient WHERE id = %s", (ingredient_id,))
+        cursor = connection.cursor()
+        cursor.execute("SELECT id, name FROM active_ingredient WHERE id = %s", (ingredient_id,))
         row = cursor.fetchone()
         cursor.close()
         if row:
-            return ActiveIngredient(**row)
+            return ActiveIngredient(*row)
         return None
 
     @staticmethod
-    def get_all_active_ingredients( connection):
-        cursor = connection.cursor(MySQLdb.cursors.DictCursor)
-        cursor.execute("SELECT * FROM active_ingredient")
+    def get_all_active_ingredients(connection):
+        cursor = connection.cursor()
+        cursor.execute("SELECT id, name FROM active_ingredient")
         rows = cursor.fetchall()
         cursor.close()
-        return [ActiveIngredient(id=row['id'], name=row['name']) for row in rows]
+        return [ActiveIngredient(*row) for row in rows]
+
+    @staticmethod
+    def iter_active_ingredient_rows(connection, batch_size=1000):
+        # Plain (id, name) tuples from an unbuffered cursor, for streaming large listings without objects
+        cursor = connection.cursor(MySQLdb.cursors.SSCursor)
+        try:
+            cursor.execute("SELECT id, name FROM active_ingredient ORDER BY id")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
 
     @classmethod
     def remove_all_active_ingredients(cls, connection, medicine_id):
         cursor = connection.cursor()
         cursor.execute("DELETE FROM medicine_active_ingredient WHERE medicine_id = %s", (medicine_id,))
+        bump_catalog_version(cursor)
         connection.commit()
         cursor.close()
\ No newline at end of file
@@ -0,0 +1,138 @@
+# Short-lived holds of stock quantities by a checkout cart (token), per user and medicine.
+# Holds are only row-locked through the summary and reservation indexes; a hold past expires_at no longer counts
+# anywhere and is deleted later by the reclaimer in stock_reservations.py.
+
+RESERVATION_COLUMNS = ('medicine_id', 'token', 'quantity', 'expires_at')
+
+
+class Reservation:
+    @staticmethod
+    def held(cursor, user_id, medicine_ids, now, exclude_token=None):
+        # {medicine_id: quantity held by live reservations}, read with a shared lock so a concurrent hold
+        # cannot be missed by the caller's transaction
+        if not medicine_ids:
+            return {}
+        placeholders = ', '.join(['%s'] * len(medicine_ids))
+        query = f"""
+            SELECT medicine_id, SUM(quantity) FROM stock_reservation
+            WHERE user_id = %s AND medicine_id IN ({placeholders}) AND expires_at > %s
+        """
+        params = [user_id, *medicine_ids, now]
+        if exclude_token:
+            query += " AND token <> %s"
+            params.append(exclude_token)
+        cursor.execute(query + " GROUP BY medicine_id LOCK IN SHARE MODE", params)
+        return {row[0]: int(row[1]) for row in cursor.fetchall()}
+
+    @staticmethod
+    def reserve(connection, user_id, token, holds, expires_at, now):
+        # holds: {medicine_id: quantity}, the quantity the cart should hold from now on (0 drops the hold).
+        # All holds are granted or none: returns ({medicine_id: availability}, shortages).
+        medicine_ids = sorted(holds)
+        placeholders = ', '.join(['%s'] * len(medicine_ids))
+        cursor = connection.cursor()
+        try:
+            # Summary rows are locked first, in medicine order, like the sale engine does
+            cursor.execute(f"""
+                SELECT medicine_id, total_quantity FROM medicine_stock_summary
+                WHERE user_id = %s AND medicine_id IN ({placeholders})
+                ORDER BY medicine_id
+                FOR UPDATE
+            """, (user_id, *medicine_ids))
+            on_hand = {row[0]: row[1] for row in cursor.fetchall()}
+            held = Reservation.held(cursor, user_id, medicine_ids, now, exclude_token=token)
+
+            availability, shortages = {}, []
+            for medicine_id in medicine_ids:
+                available = on_hand.get(medicine_id, 0) - held.get(medicine_id, 0)
+                availability[medicine_id] = {"medicine_id": medicine_id, "on_hand": on_hand.get(medicine_id, 0),
+                                             "reserved_by_others": held.get(medicine_id, 0),
+                                             "held": holds[medicine_id]}
+                if holds[medicine_id] > available:
+                    shortages.append({"medicine_id": medicine_id, "requested": holds[medicine_id],
+                                      "missing": holds[medicine_id] - max(available, 0)})
+            if shortages:
+                connection.rollback()
+                return availability, shortages
+
+            kept = [(user_id, medicine_id, token, holds[medicine_id], expires_at)
+                    for medicine_id in medicine_ids if holds[medicine_id] > 0]
+            dropped = [medicine_id for medicine_id in medicine_ids if holds[medicine_id] <= 0]
+            if kept:
+                # Keyed by (user_id, token, medicine_id): another user's cart with the same token is a different row
+                cursor.executemany("""
+                    INSERT INTO stock_reservation (user_id, medicine_id, token, quantity, expires_at)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE quantity = VALUES(quantity), expires_at = VALUES(expires_at)
+                """, kept)
+            if dropped:
+                cursor.execute(f"""
+                    DELETE FROM stock_reservation
+                    WHERE user_id = %s AND token = %s AND medicine_id IN ({', '.join(['%s'] * len(dropped))})
+                """, (user_id, token, *dropped))
+            # Touching the cart keeps all of its holds alive
+            cursor.execute("UPDATE stock_reservation SET expires_at = %s WHERE user_id = %s AND token = %s",
+                           (expires_at, user_id, token))
+            connection.commit()
+            return availability, []
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def get_for_token(connection, user_id, token, now):
+        cursor = connection.cursor()
+        cursor.execute(f"""
+            SELECT {', '.join(RESERVATION_COLUMNS)} FROM stock_reservation
+            WHERE user_id = %s AND token = %s AND expires_at > %s
+            ORDER BY medicine_id
+        """, (user_id, token, now))
+        rows = cursor.fetchall()
+        cursor.close()
+        return [dict(zip(RESERVATION_COLUMNS, row)) for row in rows]
+
+    @staticmethod
+    def get_live(connection, user_id, now):
+        cursor = connection.cursor()
+        cursor.execute(f"""
+            SELECT {', '.join(RESERVATION_COLUMNS)} FROM stock_reservation
+            WHERE user_id = %s AND expires_at > %s
+        """, (user_id, now))
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+
+    @staticmethod
+    def release(connection, user_id, token):
+        cursor = connection.cursor()
+        try:
+            cursor.execute("DELETE FROM stock_reservation WHERE user_id = %s AND token = %s", (user_id, token))
+            released = cursor.rowcount
+            connection.commit()
+            return released
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def purge_expired(connection, now, batch_size=1000):
+        # Deletes expired holds in small batches through the expires_at index; returns how many went
+        cursor = connection.cursor()
+        purged = 0
+        try:
+            while True:
+                cursor.execute("DELETE FROM stock_reservation WHERE expires_at <= %s ORDER BY expires_at LIMIT %s",
+                               (now, batch_size))
+                connection.commit()
+                purged += cursor.rowcount
+                if cursor.rowcount < batch_size:
+                    return purged
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
@@ -0,0 +1,150 @@
+import MySQLdb
+
+from db_router import pin_primary
+from expiry_scanner import expiry_scanner
+from pagination import count_cache
+from response_cache import response_cache
+from top_sellers import top_sellers
+from models.Reservation import Reservation
+from models.SalesPartitions import SalesPartitions
+from models.SalesRollup import SalesRollup
+from models.StockSummary import StockSummary
+from stock_reservations import reservation_view, utc_now
+
+
+class InsufficientStockError(Exception):
+    def __init__(self, shortages):
+        super().__init__("Not enough stock to complete the sale")
+        self.shortages = shortages
+
+
+class Sale:
+    @staticmethod
+    def allocate_fefo(lots, lines, held=None):
+        # lots: [(stock_id, medicine_id, quantity, expiry_date)] already in first-expiry-first-out order.
+        # lines: [{'medicine_id', 'quantity'}]. held: {medicine_id: quantity reserved by other carts}, which
+        # stays untouched. Returns (per-line allocations, {stock_id: taken}, shortages).
+        positions = {}
+        queues = {}
+        sellable = {}
+        for stock_id, medicine_id, quantity, expiry_date in lots:
+            queues.setdefault(medicine_id, []).append([stock_id, quantity, expiry_date])
+            sellable[medicine_id] = sellable.get(medicine_id, 0) + quantity
+        for medicine_id, quantity in (held or {}).items():
+            if medicine_id in sellable:
+                sellable[medicine_id] -= quantity
+
+        allocations, taken, shortages = [], {}, []
+        for line in lines:
+            allowed = max(0, min(line['quantity'], sellable.get(line['medicine_id'], 0)))
+            sellable[line['medicine_id']] = sellable.get(line['medicine_id'], 0) - allowed
+            needed = allowed
+            consumed = []
+            queue = queues.get(line['medicine_id'], [])
+            position = positions.get(line['medicine_id'], 0)
+            while needed > 0 and position < len(queue):
+                stock_id, available, expiry_date = queue[position]
+                used = min(available, needed)
+                consumed.append({"stock_id": stock_id, "quantity": used, "expiry_date": expiry_date})
+                taken[stock_id] = taken.get(stock_id, 0) + used
+                queue[position][1] -= used
+                needed -= used
+                if queue[position][1] == 0:
+                    position += 1
+            positions[line['medicine_id']] = position
+            missing = line['quantity'] - allowed + needed
+            if missing > 0:
+                shortages.append({"medicine_id": line['medicine_id'], "requested": line['quantity'],
+                                  "missing": missing})
+            allocations.append(consumed)
+        return allocations, taken, shortages
+
+    @staticmethod
+    def record_basket(connection, user_id, lines, customer_name, sale_date, reservation_token=None):
+        # Sells every line of a basket in one transaction. Only the stock lots of the basket's medicines are
+        # locked (SELECT ... FOR UPDATE), allocated first-expiry-first-out in Python, then decremented with a
+        # single UPDATE. Quantities held by other carts' reservations are not sold; the holds of
+        # `reservation_token` are consumed. Returns the lots consumed per line; raises InsufficientStockError
+        # and rolls back if any line cannot be covered.
+        medicine_ids = sorted({line['medicine_id'] for line in lines})
+        cursor = connection.cursor()
+        try:
+            placeholders = ', '.join(['%s'] * len(medicine_ids))
+            # Summary rows are locked first, in medicine order, so sales and reservations serialize per medicine
+            cursor.execute(f"""
+                SELECT medicine_id FROM medicine_stock_summary
+                WHERE user_id = %s AND medicine_id IN ({placeholders})
+                ORDER BY medicine_id
+                FOR UPDATE
+            """, (user_id, *medicine_ids))
+            cursor.execute(f"""
+                SELECT id, medicine_id, quantity, expiry_date
+                FROM medicine_stock
+                WHERE user_id = %s AND medicine_id IN ({placeholders}) AND quantity > 0
+                ORDER BY medicine_id, expiry_date IS NULL, expiry_date, id
+                FOR UPDATE
+            """, (user_id, *medicine_ids))
+            lots = cursor.fetchall()
+            held = Reservation.held(cursor, user_id, medicine_ids, utc_now(), exclude_token=reservation_token)
+
+            allocations, taken, shortages = Sale.allocate_fefo(lots, lines, held)
+            if shortages:
+                raise InsufficientStockError(shortages)
+
+            stock_ids = sorted(taken)
+            cases = ' '.join(['WHEN %s THEN %s'] * len(stock_ids))
+            id_placeholders = ', '.join(['%s'] * len(stock_ids))
+            params = [value for stock_id in stock_ids for value in (stock_id, taken[stock_id])]
+            cursor.execute(f"""
+                UPDATE medicine_stock
+                SET quantity = quantity - CASE id {cases} END
+                WHERE id IN ({id_placeholders})
+            """, (*params, *stock_ids))
+
+            # Shared lock on the archive boundary: a backdated sale must not race an archive run
+            boundary = SalesPartitions.boundary(cursor, lock=True)
+            cursor.executemany("""
+                INSERT INTO medicine_sales (user_id, medicine_id, customer_name, sale_date, quantity)
+                VALUES (%s, %s, %s, %s, %s)
+            """, [(user_id, line['medicine_id'], customer_name, sale_date, line['quantity']) for line in lines])
+            if SalesPartitions.before_boundary(sale_date, boundary):
+                SalesPartitions.move_backdated(cursor, cursor.lastrowid, len(lines), boundary)
+            SalesRollup.add(cursor, user_id, [(line['medicine_id'], sale_date, line['quantity']) for line in lines])
+
+            StockSummary.refresh(connection, [(user_id, medicine_id) for medicine_id in medicine_ids])
+            if reservation_token:
+                cursor.execute("DELETE FROM stock_reservation WHERE user_id = %s AND token = %s",
+                               (user_id, reservation_token))
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+        expiry_scanner.mark_stale(user_id)
+        response_cache.invalidate(user_id)
+        # Sales listing keys are not per user: a filter may span every user's sales
+        count_cache.invalidate('medicine_sales')
+        # The seller's next reads (receipts, listings, reports) must see this sale
+        pin_primary(user_id)
+        top_sellers.record(sale_date, [(line['medicine_id'], line['quantity']) for line in lines])
+        if reservation_token:
+            reservation_view.release(user_id, reservation_token)
+
+        return [{"medicine_id": line['medicine_id'], "quantity": line['quantity'], "lots": consumed}
+                for line, consumed in zip(lines, allocations)]
+
+    @staticmethod
+    def iter_rows(connection, query, params=(), batch_size=1000):
+        # Tuples from an unbuffered cursor, for exports too large to hold in memory. The connection cannot run
+        # other queries until the generator is exhausted or closed.
+        cursor = connection.cursor(MySQLdb.cursors.SSCursor)
+        try:
+            cursor.execute(query, tuple(params))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
@@ -0,0 +1,206 @@
+import datetime
+
+# Hot/archive tiers of the individual sales rows.
+# medicine_sales is RANGE partitioned by month of sale_date (pYYYYMM holds that month, pmax anything later) and
+# only holds sales on or after the archive boundary; medicine_sales_archive is a compressed table holding every
+# sale before it. Readers use `source`, which pushes the date range into each tier (MySQL then prunes the
+# monthly partitions) and leaves out a tier the range cannot reach; each tier is read on its side of the
+# boundary only. `flask stock archive-sales` relies on that to move a cold month without a long lock: its rows
+# are copied to the archive in id batches, hidden there until the boundary passes them; the boundary is then
+# advanced in a short transaction, which hides the hot copies, and the emptied partition is dropped.
+
+SALE_COLUMNS = ('id', 'user_id', 'medicine_id', 'customer_name', 'sale_date', 'quantity')
+ARCHIVE_AFTER_MONTHS = 24
+PARTITION_MONTHS_AHEAD = 3
+ARCHIVE_BATCH_ROWS = 10000
+
+
+def _as_date(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    try:
+        return datetime.date.fromisoformat(str(value)[:10])
+    except ValueError:
+        # Left for MySQL to interpret; the range is then not used for routing
+        return None
+
+
+def _month_start(day, months=0):
+    year, month = divmod(day.year * 12 + day.month - 1 + months, 12)
+    return datetime.date(year, month + 1, 1)
+
+
+class SalesPartitions:
+    @staticmethod
+    def boundary(cursor, lock=False):
+        # First day kept in medicine_sales; lock=True holds it against a concurrent archive run
+        cursor.execute("SELECT archived_before FROM medicine_sales_archive_state WHERE id = 1"
+                       + (" LOCK IN SHARE MODE" if lock else ""))
+        row = cursor.fetchone()
+        return row[0] if row else datetime.date.min
+
+    @staticmethod
+    def source(connection, user_id=None, start_date=None, end_date=None):
+        # Table or derived table `(id, user_id, medicine_id, customer_name, sale_date, quantity)` of the sales
+        # in [start_date, end_date] (either may be None); the caller still applies its own filters.
+        # Returns (sql, params).
+        cursor = connection.cursor()
+        boundary = SalesPartitions.boundary(cursor)
+        cursor.close()
+        start, end = _as_date(start_date), _as_date(end_date)
+
+        def branch(table, tier_condition, tier_params):
+            conditions, params = [tier_condition], list(tier_params)
+            if user_id:
+                conditions.append("user_id = %s")
+                params.append(user_id)
+            if start_date:
+                conditions.append("sale_date >= %s")
+                params.append(start_date)
+            if end_date:
+                conditions.append("sale_date <= %s")
+                params.append(end_date)
+            return f"SELECT {', '.join(SALE_COLUMNS)} FROM {table} WHERE {' AND '.join(conditions)}", params
+
+        needs_hot = end is None or end >= boundary
+        needs_archive = start is None or start < boundary
+        if boundary == datetime.date.min or not needs_archive:
+            # Nothing archived yet, or the range starts after the boundary: the partitioned table alone,
+            # un-wrapped so its indexes serve the caller's ORDER BY and LIMIT
+            return "medicine_sales", []
+        archive_sql, archive_params = branch("medicine_sales_archive", "sale_date < %s", [boundary])
+        if not needs_hot:
+            return f"({archive_sql})", archive_params
+        hot_sql, hot_params = branch("medicine_sales", "sale_date >= %s", [boundary])
+        return f"({hot_sql} UNION ALL {archive_sql})", hot_params + archive_params
+
+    @staticmethod
+    def before_boundary(sale_date, boundary):
+        # Whether a sale dated sale_date belongs to the archive; a date MySQL has to interpret counts as one,
+        # move_backdated then compares it in SQL
+        day = _as_date(sale_date)
+        return day is None or day < boundary
+
+    @staticmethod
+    def move_backdated(cursor, first_id, count, boundary):
+        # Sales just inserted with a sale_date before the boundary belong to the archive; runs inside the
+        # caller's transaction, which must hold `boundary(cursor, lock=True)`
+        cursor.execute(f"""
+            INSERT INTO medicine_sales_archive ({', '.join(SALE_COLUMNS)})
+            SELECT {', '.join(SALE_COLUMNS)} FROM medicine_sales
+            WHERE id BETWEEN %s AND %s AND sale_date < %s
+        """, (first_id, first_id + count - 1, boundary))
+        if cursor.rowcount:
+            cursor.execute("DELETE FROM medicine_sales WHERE id BETWEEN %s AND %s AND sale_date < %s",
+                           (first_id, first_id + count - 1, boundary))
+
+    @staticmethod
+    def partitions(cursor):
+        # [(name, first day after the partition or None for pmax)] in range order
+        cursor.execute("""
+            SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'medicine_sales'
+            ORDER BY PARTITION_ORDINAL_POSITION
+        """)
+        rows = cursor.fetchall()
+        return [(name, None if description == 'MAXVALUE' else datetime.date.fromordinal(int(description) - 365))
+                for name, description in rows]
+
+    @staticmethod
+    def ensure_partitions(connection, today=None, months_ahead=PARTITION_MONTHS_AHEAD):
+        # Splits pmax into monthly partitions up to `months_ahead` months after today. The first split starts at
+        # the oldest sale, so it also spreads an existing unpartitioned history over months. Returns the names
+        # of the partitions created.
+        today = today or datetime.date.today()
+        last_month = _month_start(today, months_ahead)
+        cursor = connection.cursor()
+        try:
+            bounds = [bound for _, bound in SalesPartitions.partitions(cursor) if bound is not None]
+            if bounds:
+                month = bounds[-1]
+            else:
+                cursor.execute("SELECT MIN(sale_date) FROM medicine_sales")
+                oldest = cursor.fetchone()[0]
+                month = _month_start(min(oldest, today) if oldest else today)
+            created = []
+            while month <= last_month:
+                created.append((f"p{month:%Y%m}", _month_start(month, 1)))
+                month = _month_start(month, 1)
+            if created:
+                definitions = ', '.join(f"PARTITION {name} VALUES LESS THAN (TO_DAYS('{bound.isoformat()}'))"
+                                        for name, bound in created)
+                cursor.execute(f"""
+                    ALTER TABLE medicine_sales REORGANIZE PARTITION pmax INTO (
+                        {definitions}, PARTITION pmax VALUES LESS THAN MAXVALUE
+                    )
+                """)
+            return [name for name, _ in created]
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _copy_to_archive(cursor, name, after_id, upto_id=None):
+        # Copies the rows of partition `name` with after_id < id <= upto_id (no upper limit when None)
+        condition, params = "id > %s", [after_id]
+        if upto_id is not None:
+            condition += " AND id <= %s"
+            params.append(upto_id)
+        cursor.execute(f"""
+            INSERT INTO medicine_sales_archive ({', '.join(SALE_COLUMNS)})
+            SELECT {', '.join(SALE_COLUMNS)} FROM medicine_sales PARTITION ({name}) WHERE {condition}
+        """, params)
+        return cursor.rowcount
+
+    @staticmethod
+    def archive(connection, today=None, archive_after_months=ARCHIVE_AFTER_MONTHS, batch_size=ARCHIVE_BATCH_ROWS):
+        # Moves every whole month older than `archive_after_months` to medicine_sales_archive, oldest first, then
+        # drops the emptied partitions. A month is copied in id order, `batch_size` rows per transaction, while
+        # the boundary still hides the copies; only the sales added meanwhile are copied in the short
+        # transaction that locks and advances the boundary. Returns [(partition, rows moved)].
+        today = today or datetime.date.today()
+        cutoff = _month_start(today, -archive_after_months)
+        moved = []
+        cursor = connection.cursor()
+        try:
+            for name, bound in SalesPartitions.partitions(cursor):
+                if bound is None or bound > cutoff:
+                    break
+                boundary = SalesPartitions.boundary(cursor)
+                rows = 0
+                if bound > boundary:
+                    # Resumes after the copies an interrupted run left above the boundary
+                    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM medicine_sales_archive WHERE sale_date >= %s",
+                                   (boundary,))
+                    last_id = cursor.fetchone()[0]
+                    connection.commit()
+                    while True:
+                        cursor.execute(f"""
+                            SELECT MAX(id) FROM (
+                                SELECT id FROM medicine_sales PARTITION ({name}) WHERE id > %s ORDER BY id LIMIT %s
+                            ) batch
+                        """, (last_id, batch_size))
+                        upto_id = cursor.fetchone()[0]
+                        if upto_id is None:
+                            break
+                        rows += SalesPartitions._copy_to_archive(cursor, name, last_id, upto_id)
+                        connection.commit()
+                        last_id = upto_id
+
+                    cursor.execute("SELECT archived_before FROM medicine_sales_archive_state WHERE id = 1 FOR UPDATE")
+                    rows += SalesPartitions._copy_to_archive(cursor, name, last_id)
+                    cursor.execute("UPDATE medicine_sales_archive_state "
+                                   "SET archived_before = GREATEST(archived_before, %s) WHERE id = 1", (bound,))
+                    connection.commit()
+                # Every row is behind the boundary now; dropping the partition is a metadata change
+                cursor.execute(f"ALTER TABLE medicine_sales DROP PARTITION {name}")
+                moved.append((name, rows))
+            return moved
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
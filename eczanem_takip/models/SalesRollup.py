@@ -0,0 +1,110 @@
+import datetime
+
+from models.SalesPartitions import SalesPartitions
+
+# Daily sales rollup: one medicine_sales_daily row per (user_id, medicine_id, sale_day) with the day's quantity
+# and number of sales. The sale engine adds to it in the sale's own transaction; `flask analysis backfill-rollup`
+# rebuilds it from the sales rows of both tiers (models/SalesPartitions.py). Analysis queries read past days
+# from the rollup and only today's partial day from the raw rows (see `source`).
+
+BACKFILL_BATCH_DAYS = 31
+
+
+class SalesRollup:
+    @staticmethod
+    def add(cursor, user_id, sales):
+        # sales: [(medicine_id, sale_date, quantity)]; runs inside the caller's transaction
+        days = {}
+        for medicine_id, sale_date, quantity in sales:
+            key = (medicine_id, sale_date)
+            total, count = days.get(key, (0, 0))
+            days[key] = (total + quantity, count + 1)
+        cursor.executemany("""
+            INSERT INTO medicine_sales_daily (user_id, medicine_id, sale_day, total_quantity, sale_count)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE total_quantity = total_quantity + VALUES(total_quantity),
+                                    sale_count = sale_count + VALUES(sale_count)
+        """, [(user_id, medicine_id, sale_day, total, count)
+              for (medicine_id, sale_day), (total, count) in sorted(days.items(), key=lambda item: str(item[0]))])
+
+    @staticmethod
+    def backfill(connection, start_date=None, end_date=None, batch_days=BACKFILL_BATCH_DAYS):
+        # Recomputes the rollup for [start_date, end_date] (default: the whole sales history), one transaction
+        # per batch of days so the rows locked at a time stay few. Returns the number of rollup rows written.
+        cursor = connection.cursor()
+        try:
+            if start_date is None or end_date is None:
+                sales, params = SalesPartitions.source(connection)
+                cursor.execute(f"SELECT MIN(sale_date), MAX(sale_date) FROM {sales} ms", params)
+                first, last = cursor.fetchone()
+                if first is None:
+                    return 0
+                start_date = start_date or first
+                end_date = end_date or last
+            written = 0
+            batch_start = start_date
+            while batch_start <= end_date:
+                batch_end = min(batch_start + datetime.timedelta(days=batch_days - 1), end_date)
+                cursor.execute("DELETE FROM medicine_sales_daily WHERE sale_day BETWEEN %s AND %s",
+                               (batch_start, batch_end))
+                sales, params = SalesPartitions.source(connection, start_date=batch_start, end_date=batch_end)
+                cursor.execute(f"""
+                    INSERT INTO medicine_sales_daily (user_id, medicine_id, sale_day, total_quantity, sale_count)
+                    SELECT user_id, medicine_id, sale_date, SUM(quantity), COUNT(*)
+                    FROM {sales} ms
+                    WHERE sale_date BETWEEN %s AND %s
+                    GROUP BY user_id, medicine_id, sale_date
+                """, (*params, batch_start, batch_end))
+                written += cursor.rowcount
+                connection.commit()
+                batch_start = batch_end + datetime.timedelta(days=1)
+            return written
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def source(user_id=None, start_date=None, end_date=None, months=None, medicine_ids=None):
+        # Derived table `(user_id, medicine_id, sale_date, quantity)` to aggregate instead of medicine_sales.
+        # Days before today come from the rollup, today from the raw rows; every filter is applied in both
+        # branches so each side uses its own indexes. Returns (sql, params).
+        def branch(select, table, date_column, today_condition):
+            conditions, params = [f"{date_column} {today_condition}"], []
+            if user_id is not None:
+                conditions.append("user_id = %s")
+                params.append(user_id)
+            if medicine_ids is not None:
+                conditions.append(f"medicine_id IN ({', '.join(['%s'] * len(medicine_ids))})")
+                params.extend(medicine_ids)
+            if start_date and end_date:
+                conditions.append(f"{date_column} BETWEEN %s AND %s")
+                params.extend([start_date, end_date])
+            if months is not None:
+                conditions.append(f"{date_column} >= CURDATE() - INTERVAL %s MONTH")
+                params.append(months)
+            return f"SELECT {select} FROM {table} WHERE {' AND '.join(conditions)}", params
+
+        rollup_sql, rollup_params = branch("user_id, medicine_id, sale_day AS sale_date, total_quantity AS quantity",
+                                           "medicine_sales_daily", "sale_day", "< CURDATE()")
+        raw_sql, raw_params = branch("user_id, medicine_id, sale_date, quantity",
+                                     "medicine_sales", "sale_date", ">= CURDATE()")
+        return f"({rollup_sql} UNION ALL {raw_sql})", rollup_params + raw_params
+
+    @staticmethod
+    def verify(connection):
+        # [(user_id, medicine_id, sale_day, stored, expected)] for days whose rollup row is wrong or missing
+        sales, params = SalesPartitions.source(connection)
+        cursor = connection.cursor()
+        cursor.execute(f"""
+            SELECT user_id, medicine_id, sale_date, SUM(quantity), COUNT(*)
+            FROM {sales} ms
+            GROUP BY user_id, medicine_id, sale_date
+        """, params)
+        expected = {row[:3]: (int(row[3]), row[4]) for row in cursor.fetchall()}
+        cursor.execute("SELECT user_id, medicine_id, sale_day, total_quantity, sale_count FROM medicine_sales_daily")
+        stored = {row[:3]: (row[3], row[4]) for row in cursor.fetchall()}
+        cursor.close()
+        return [(*key, stored.get(key), expected.get(key)) for key in sorted(set(expected) | set(stored))
+                if stored.get(key) != expected.get(key)]
@@ -0,0 +1,49 @@
+from db_router import pin_primary
+from expiry_scanner import expiry_scanner
+from response_cache import response_cache
+from models.StockSummary import StockSummary
+
+
+class Stock:
+    @staticmethod
+    def add_many(connection, lots):
+        # lots: [(medicine_id, supplier_id, user_id, expiry_date, quantity)], written with one multi-row insert
+        cursor = connection.cursor()
+        try:
+            StockSummary.lock(connection, [(lot[2], lot[0]) for lot in lots])
+            cursor.executemany("""
+                INSERT INTO medicine_stock (medicine_id, supplier_id, user_id, expiry_date, quantity)
+                VALUES (%s, %s, %s, %s, %s)
+            """, lots)
+            StockSummary.refresh(connection, [(lot[2], lot[0]) for lot in lots])
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+        for user_id in {lot[2] for lot in lots}:
+            expiry_scanner.mark_stale(user_id)
+            response_cache.invalidate(user_id)
+            pin_primary(user_id)
+
+    @staticmethod
+    def get_existing_supplier_ids(connection, supplier_ids):
+        if not supplier_ids:
+            return set()
+        cursor = connection.cursor()
+        placeholders = ', '.join(['%s'] * len(supplier_ids))
+        cursor.execute(f"SELECT id FROM supplier WHERE id IN ({placeholders})", tuple(supplier_ids))
+        rows = cursor.fetchall()
+        cursor.close()
+        return {row[0] for row in rows}
+
+    @staticmethod
+    def get_supplier_ids_by_name(connection, name):
+        # The supplier table is small, so the substring match there is cheap; stock rows are then
+        # filtered on the indexed supplier_id instead of a LIKE over the join
+        cursor = connection.cursor()
+        cursor.execute("SELECT id FROM supplier WHERE name LIKE %s", (f"%{name}%",))
+        rows = cursor.fetchall()
+        cursor.close()
+        return [row[0] for row in rows]
@@ -0,0 +1,149 @@
+import MySQLdb
+
+# On-hand summary per (user_id, medicine_id): total quantity, number of lots and earliest expiry of the lots
+# still holding stock. Every write to medicine_stock recomputes the rows of the pairs it touched inside the
+# same transaction, so readers get the answer with one primary-key lookup instead of summing lots.
+
+SUMMARY_COLUMNS = ('user_id', 'medicine_id', 'total_quantity', 'lot_count', 'earliest_expiry')
+
+
+def _pair_condition(pairs):
+    placeholders = ', '.join(['(%s, %s)'] * len(pairs))
+    return f"(user_id, medicine_id) IN ({placeholders})", [value for pair in pairs for value in pair]
+
+
+class StockSummary:
+    @staticmethod
+    def lock(connection, pairs):
+        # Locks the summary rows of `pairs`, then every lot of those pairs, in the order Sale.record_basket takes
+        # them, so a stock write and a sale of the same pair queue up instead of deadlocking. Call it before the
+        # first write to medicine_stock; does not commit. A missing summary row is inserted empty (refresh sets
+        # or deletes it before the commit): a locking read of a row that does not exist only takes a gap lock.
+        pairs = sorted({(int(user_id), int(medicine_id)) for user_id, medicine_id in pairs})
+        if not pairs:
+            return
+        condition, params = _pair_condition(pairs)
+        cursor = connection.cursor()
+        try:
+            cursor.executemany("""
+                INSERT INTO medicine_stock_summary (user_id, medicine_id, total_quantity, lot_count, earliest_expiry)
+                VALUES (%s, %s, 0, 0, NULL)
+                ON DUPLICATE KEY UPDATE user_id = user_id
+            """, pairs)
+            cursor.execute(f"""
+                SELECT id FROM medicine_stock
+                WHERE {condition}
+                ORDER BY user_id, medicine_id, expiry_date IS NULL, expiry_date, id
+                FOR UPDATE
+            """, params)
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def refresh(connection, pairs):
+        # pairs: iterable of (user_id, medicine_id). Does not commit; call it before the caller's commit.
+        # Rows are upserted rather than deleted and re-inserted: two transactions creating the first row of a
+        # pair would otherwise both take gap locks and one would fail with a deadlock. Only pairs left without
+        # stock are deleted, by primary key.
+        pairs = sorted({(int(user_id), int(medicine_id)) for user_id, medicine_id in pairs})
+        if not pairs:
+            return
+        condition, params = _pair_condition(pairs)
+        cursor = connection.cursor()
+        try:
+            cursor.execute(f"""
+                INSERT INTO medicine_stock_summary (user_id, medicine_id, total_quantity, lot_count, earliest_expiry)
+                SELECT user_id, medicine_id, SUM(quantity), COUNT(*), MIN(expiry_date)
+                FROM medicine_stock
+                WHERE quantity > 0 AND {condition}
+                GROUP BY user_id, medicine_id
+                ON DUPLICATE KEY UPDATE total_quantity = VALUES(total_quantity), lot_count = VALUES(lot_count),
+                                        earliest_expiry = VALUES(earliest_expiry)
+            """, params)
+            cursor.execute(f"""
+                SELECT DISTINCT user_id, medicine_id FROM medicine_stock
+                WHERE quantity > 0 AND {condition}
+                LOCK IN SHARE MODE
+            """, params)
+            stocked = set(cursor.fetchall())
+            empty = [pair for pair in pairs if pair not in stocked]
+            if empty:
+                condition, params = _pair_condition(empty)
+                cursor.execute(f"DELETE FROM medicine_stock_summary WHERE {condition}", params)
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def get(connection, user_id, medicine_id):
+        summaries = StockSummary.get_many(connection, user_id, [medicine_id])
+        return summaries.get(int(medicine_id), StockSummary.empty(user_id, medicine_id))
+
+    @staticmethod
+    def get_many(connection, user_id, medicine_ids):
+        # {medicine_id: summary dict} for the medicines with stock on hand
+        if not medicine_ids:
+            return {}
+        placeholders = ', '.join(['%s'] * len(medicine_ids))
+        cursor = connection.cursor(MySQLdb.cursors.DictCursor)
+        cursor.execute(f"""
+            SELECT {', '.join(SUMMARY_COLUMNS)} FROM medicine_stock_summary
+            WHERE user_id = %s AND medicine_id IN ({placeholders})
+        """, (user_id, *medicine_ids))
+        rows = cursor.fetchall()
+        cursor.close()
+        return {row['medicine_id']: row for row in rows}
+
+    @staticmethod
+    def get_quantities(connection, user_id):
+        # {medicine_id: total_quantity} of everything the user has on hand
+        cursor = connection.cursor()
+        cursor.execute("SELECT medicine_id, total_quantity FROM medicine_stock_summary WHERE user_id = %s", (user_id,))
+        rows = cursor.fetchall()
+        cursor.close()
+        return dict(rows)
+
+    @staticmethod
+    def empty(user_id, medicine_id):
+        return {"user_id": int(user_id), "medicine_id": int(medicine_id), "total_quantity": 0, "lot_count": 0,
+                "earliest_expiry": None}
+
+    @staticmethod
+    def rebuild(connection):
+        # Recomputes the whole table from medicine_stock in one transaction; returns the number of rows written
+        cursor = connection.cursor()
+        try:
+            cursor.execute("DELETE FROM medicine_stock_summary")
+            cursor.execute("""
+                INSERT INTO medicine_stock_summary (user_id, medicine_id, total_quantity, lot_count, earliest_expiry)
+                SELECT user_id, medicine_id, SUM(quantity), COUNT(*), MIN(expiry_date)
+                FROM medicine_stock
+                WHERE quantity > 0
+                GROUP BY user_id, medicine_id
+            """)
+            written = cursor.rowcount
+            connection.commit()
+            return written
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def verify(connection):
+        # Returns [(user_id, medicine_id, stored, expected)] for every pair whose summary row is wrong or missing
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT user_id, medicine_id, SUM(quantity), COUNT(*), MIN(expiry_date)
+            FROM medicine_stock
+            WHERE quantity > 0
+            GROUP BY user_id, medicine_id
+        """)
+        expected = {(row[0], row[1]): (int(row[2]), row[3], row[4]) for row in cursor.fetchall()}
+        cursor.execute("""
+            SELECT user_id, medicine_id, total_quantity, lot_count, earliest_expiry FROM medicine_stock_summary
+        """)
+        stored = {(row[0], row[1]): (row[2], row[3], row[4]) for row in cursor.fetchall()}
+        cursor.close()
+        return [(pair[0], pair[1], stored.get(pair), expected.get(pair))
+                for pair in sorted(set(expected) | set(stored)) if stored.get(pair) != expected.get(pair)]
@@ -1,6 +1,11 @@
-import MySQLdb
+# Explicit column list: the table's column order differs from the constructor's
+USER_COLUMNS = ('id', 'name', 'surname', 'username', 'email', 'password')
+USER_SELECT = f"SELECT {', '.join(USER_COLUMNS)} FROM user"
+
 
 class User:
+    __slots__ = USER_COLUMNS
+
     def __init__(self, id, name, surname, username, email, password):
         self.id = id
         self.name = name
@@ -20,51 +25,51 @@ class User:
 
     @staticmethod
     def login(connection, usernameoremail, password):
-        cursor = connection.cursor(MySQLdb.cursors.DictCursor)
-        cursor.execute('SELECT * FROM user WHERE (username = %s OR email = %s) AND password = %s',
+        cursor = connection.cursor()
+        cursor.execute(USER_SELECT + ' WHERE (username = %s OR email = %s) AND password = %s',
                        (usernameoremail, usernameoremail, password))
         row = cursor.fetchone()
         cursor.close()
         if row:
-            return User(**row)
+            return User(*row)
         return None
 
     @staticmethod
     def get_all(connection):
-        cursor = connection.cursor(MySQLdb.cursors.DictCursor)
-        cursor.execute("SELECT * FROM user")
+        cursor = connection.cursor()
+        cursor.execute(USER_SELECT)
         rows = cursor.fetchall()
         cursor.close()
-        return [User(**row) for row in rows]
+        return [User(*row) for row in rows]
 
     @staticmethod
     def get_by_id(connection, user_id):
-        cursor = connection.cursor(MySQLdb.cursors.DictCursor)
-        cursor.execute("SELECT * FROM user WHERE id = %s", (user_id,))
+        cursor = connection.cursor()
+        cursor.execute(USER_SELECT + " WHERE id = %s", (user_id,))
         row = cursor.fetchone()
         cursor.close()
         if row:
-            return User(**row)
+            return User(*row)
         return None
 
     @staticmethod
     def get_by_username(connection, username):
-        cursor = connection.cursor(MySQLdb.cursors.DictCursor)
-        cursor.execute("SELECT * FROM user WHERE username = %s", (username,))
+        cursor = connection.cursor()
+        cursor.execute(USER_SELECT + " WHERE username = %s", (username,))
         row = cursor.fetchone()
         cursor.close()
         if row:
-            return User(**row)
+            return User(*row)
         return None
 
     @staticmethod
     def get_by_email(connection, email):
-        cursor = connection.cursor(MySQLdb.cursors.DictCursor)
-        cursor.execute("SELECT * FROM user WHERE email = %s", (email,))
+        cursor = connection.cursor()
+        cursor.execute(USER_SELECT + " WHERE email = %s", (email,))
         row = cursor.fetchone()
         cursor.close()
         if row:
-            return User(**row)
+            return User(*row)
         return None
 
     @staticmethod
@@ -0,0 +1,122 @@
+import base64
+import datetime
+import json
+import threading
+import time
+
+from db_router import primary_reads
+
+# Keyset (cursor) pagination helpers shared by the listing endpoints.
+# A cursor is the (sort key, id) of the last row on a page, base64-encoded so clients treat it as opaque.
+
+COUNT_CACHE_TTL = 60
+COUNT_CACHE_SIZE = 1024
+TOTAL_MODES = ('exact', 'cached', 'approx', 'none')
+MAX_PER_PAGE = 1000
+
+
+def encode_cursor(*values):
+    values = [value.isoformat() if isinstance(value, (datetime.date, datetime.datetime)) else value
+              for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token, size):
+    # Returns the decoded values, or None for an empty cursor (first page)
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def cursor_position(value):
+    # A non-negative integer carried by a cursor (an id or an offset); anything else means a forged cursor
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError("Invalid cursor")
+    return value
+
+
+def get_page_args(args, default_total='exact', cursor_total='cached'):
+    # Parses page/per_page/cursor/total query parameters.
+    # `cursor` switches the endpoint to keyset pagination; page/per_page keep working as before.
+    per_page = int(args.get('per_page', 10))
+    page = int(args.get('page', 1))
+    if not 1 <= per_page <= MAX_PER_PAGE:
+        raise ValueError(f"per_page must be between 1 and {MAX_PER_PAGE}")
+    if page < 1:
+        raise ValueError("page must be 1 or more")
+    cursor = args.get('cursor')
+    total_mode = args.get('total', default_total if cursor is None else cursor_total)
+    if total_mode not in TOTAL_MODES:
+        raise ValueError(f"Invalid total mode, expected one of {', '.join(TOTAL_MODES)}")
+    return page, per_page, cursor, total_mode
+
+
+class CountCache:
+    def __init__(self, ttl=COUNT_CACHE_TTL, max_size=COUNT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get_or_compute(self, key, compute):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                return entry[1]
+        value = compute()
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                # Drop expired entries first, then the oldest ones
+                self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+                while len(self._entries) >= self.max_size:
+                    self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (now + self.ttl, value)
+        return value
+
+    def invalidate(self, scope=None, owner=None):
+        # Keys are tuples whose first item is the scope (e.g. the table or endpoint name) and, for per-user
+        # counts, whose second item is the owning user id
+        with self._lock:
+            if scope is None:
+                self._entries.clear()
+            elif owner is None:
+                self._entries = {k: v for k, v in self._entries.items() if k[0] != scope}
+            else:
+                owner = str(owner)
+                self._entries = {k: v for k, v in self._entries.items()
+                                 if k[0] != scope or len(k) < 2 or str(k[1]) != owner}
+
+
+count_cache = CountCache()
+
+
+def approximate_row_count(connection, table):
+    # InnoDB's estimate from table statistics; no scan
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT TABLE_ROWS FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (table,))
+    row = cursor.fetchone()
+    cursor.close()
+    return int(row[0] or 0) if row else 0
+
+
+def resolve_total(mode, key, compute, approximate=None):
+    # approximate: optional callable used for total=approx; falls back to the cached count
+    if mode == 'none':
+        return None
+    if mode == 'exact':
+        return compute()
+    if mode == 'approx' and approximate is not None:
+        return approximate()
+    # Shared across requests, so a count that is missing is read from the primary, not a lagging replica
+    with primary_reads():
+        return count_cache.get_or_compute(key, compute)
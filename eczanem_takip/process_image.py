@@ -1,4 +1,5 @@
 from flask import Blueprint, request, jsonify, session
+from db_router import RoutedMySQL
 from PIL import Image
 import pytesseract
 import cv2
@@ -6,7 +7,9 @@ import numpy as np
 import json
 import re
 import openai
+from fuzzy_matcher import fuzzy_matcher, DEFAULT_TOP_K, DEFAULT_MIN_SCORE
 
+mysql = RoutedMySQL()
 image_bp = Blueprint('image', __name__)
 
 def load_hepatit_guide():
@@ -114,6 +117,30 @@ def process_image():
         print(error_message)
         return jsonify({"error": "An error occurred during processing", "details": str(e)}), 500
 
+@image_bp.route('/match_medicines', methods=['POST'])
+def match_medicines():
+    try:
+        data = request.get_json(silent=True) or {}
+        # Match the given text, or the text extracted by the last process_image call
+        text = data.get('text') or session.get('extracted_text', '')
+        top_k = int(data.get('top_k', DEFAULT_TOP_K))
+        min_score = float(data.get('min_score', DEFAULT_MIN_SCORE))
+
+        if not text:
+            return jsonify({"error": "No text provided. Please process the image first."}), 400
+
+        # Shared by every request, so kept current from the primary rather than a lagging replica
+        fuzzy_matcher.ensure_current(mysql.primary)
+        matches = fuzzy_matcher.match(text, top_k=top_k, min_score=min_score)
+
+        return jsonify({"matches": matches})
+
+    except Exception as e:
+        import traceback
+        error_message = traceback.format_exc()
+        print(error_message)
+        return jsonify({"error": "An error occurred while matching medicines", "details": str(e)}), 500
+
 @image_bp.route('/validate_report', methods=['POST'])
 def validate_report():
     try:
@@ -0,0 +1,8 @@
+-- Runs once when the replica's data directory is created; the I/O thread retries until the primary is up
+CHANGE MASTER TO
+    MASTER_HOST = 'db',
+    MASTER_USER = 'root',
+    MASTER_PASSWORD = 'password',
+    MASTER_AUTO_POSITION = 1,
+    MASTER_CONNECT_RETRY = 10;
+START SLAVE;
@@ -0,0 +1,154 @@
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request, make_response
+
+from db_router import replica_used, routed_to_replica
+
+# TTL + LRU cache of JSON responses for the analysis endpoints.
+# Keys are (endpoint, owner, normalized parameters, route) where owner is the request's user_id, or None for
+# responses computed over every user's sales, and route tells whether the response was read from the primary
+# or the replica. Writes that change a user's sales or stock invalidate that user's entries and every
+# ownerless entry. A replica can lag behind those invalidations, so its responses are kept apart and for
+# REPLICA_TTL at most: requests that must read the primary never get one, replica-routed requests take either.
+
+DEFAULT_TTL = 60
+DEFAULT_MAX_SIZE = 512
+REPLICA_TTL = 10
+
+
+class ResponseCache:
+    def __init__(self, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys_by_owner = {}
+        # Invalidation counters per owner (None counts every invalidation, as ownerless entries are dropped by
+        # each); _cleared is bumped by clear(), which resets the counters
+        self._generations = {}
+        self._cleared = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, *keys):
+        # The value of the first of `keys` with a live entry
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] <= now:
+                    self._discard(key)
+                elif entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+            self.misses += 1
+            return None
+
+    def generation(self, owner=None):
+        with self._lock:
+            return self._generation_of(owner)
+
+    def _generation_of(self, owner):
+        return self._cleared, self._generations.get(owner, 0)
+
+    def put(self, key, value, generation, ttl=None):
+        # Skipped when the key's owner was invalidated since `generation` was read, so a response computed before
+        # a sale committed is never stored after that sale's invalidation
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if generation != self._generation_of(key[1]):
+                return
+            self._discard(key)
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._keys_by_owner.setdefault(key[1], set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _discard(self, key):
+        if self._entries.pop(key, None) is not None:
+            keys = self._keys_by_owner.get(key[1])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_owner[key[1]]
+
+    def invalidate(self, owner=None):
+        # Drops the entries of `owner` and the ownerless ones; owner=None drops those only
+        owner = str(owner) if owner is not None else None
+        with self._lock:
+            if owner is not None:
+                self._generations[owner] = self._generations.get(owner, 0) + 1
+            self._generations[None] = self._generations.get(None, 0) + 1
+            self.invalidations += 1
+            for key in list(self._keys_by_owner.get(owner, ())) + list(self._keys_by_owner.get(None, ())):
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._cleared += 1
+            self._generations.clear()
+            self._entries.clear()
+            self._keys_by_owner.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "ttl": self.ttl,
+                "max_size": self.max_size,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+response_cache = ResponseCache()
+
+
+def _request_key():
+    body = request.get_json(silent=True) if request.is_json else None
+    owner = (body.get('user_id') if isinstance(body, dict) else None) or request.args.get('user_id')
+    params = json.dumps([body, sorted(request.args.items(multi=True)), sorted((request.view_args or {}).items())],
+                        sort_keys=True, default=str)
+    return (request.endpoint, str(owner) if owner else None, params)
+
+
+def cached_response(view):
+    # Serves successful JSON responses of `view` from response_cache; X-Cache tells whether it was a hit
+    @functools.wraps(view)
+    def wrap(*args, **kwargs):
+        key = _request_key()
+        if routed_to_replica():
+            cached = response_cache.get(key + ('primary',), key + ('replica',))
+        else:
+            cached = response_cache.get(key + ('primary',))
+        if cached is not None:
+            body, status, mimetype = cached
+            response = make_response(body, status)
+            response.mimetype = mimetype
+            response.headers['X-Cache'] = 'HIT'
+            return response
+
+        generation = response_cache.generation(key[1])
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200 and response.is_json:
+            value = (response.get_data(), response.status_code, response.mimetype)
+            if replica_used():
+                response_cache.put(key + ('replica',), value, generation, min(response_cache.ttl, REPLICA_TTL))
+            else:
+                response_cache.put(key + ('primary',), value, generation)
+        response.headers['X-Cache'] = 'MISS'
+        return response
+    return wrap
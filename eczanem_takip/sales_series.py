@@ -0,0 +1,104 @@
+import datetime
+
+import numpy as np
+
+from models.SalesRollup import SalesRollup
+
+# Dense sales time series for the sales_trend endpoint.
+# Daily totals come from the rollup in one query; the buckets of the requested granularity are generated as a
+# NumPy datetime64 range, every sale day is placed with searchsorted and the (series x point) sums are built
+# with one bincount, so buckets without sales are zeros instead of missing keys.
+# Series longer than max_points are downsampled by summing runs of consecutive buckets; the run length is
+# fixed from the bucket count first and sales are binned straight into the runs, so the matrix never has
+# more than max_points columns.
+
+GRANULARITIES = ('day', 'week', 'month', 'quarter')
+DEFAULT_MAX_POINTS = 500
+MAX_POINTS_LIMIT = 5000
+
+
+def bucket_starts(start, end, granularity):
+    # datetime64[D] start of every bucket overlapping [start, end]; weeks start on Monday
+    start, end = np.datetime64(start, 'D'), np.datetime64(end, 'D')
+    if granularity == 'day':
+        return np.arange(start, end + 1, dtype='datetime64[D]')
+    if granularity == 'week':
+        # 1970-01-01 was a Thursday, so Monday-based week numbers are (days + 3) // 7
+        first = ((start.astype(np.int64) + 3) // 7) * 7 - 3
+        return np.arange(first, end.astype(np.int64) + 1, 7).astype('datetime64[D]')
+    first_month, last_month = start.astype('datetime64[M]'), end.astype('datetime64[M]')
+    if granularity == 'quarter':
+        first_month = (first_month.astype(np.int64) // 3 * 3).astype('datetime64[M]')
+        return np.arange(first_month, last_month + 1, 3, dtype='datetime64[M]').astype('datetime64[D]')
+    return np.arange(first_month, last_month + 1, dtype='datetime64[M]').astype('datetime64[D]')
+
+
+def bucket_labels(starts, granularity):
+    if granularity == 'month':
+        return np.datetime_as_string(starts, unit='M').tolist()
+    if granularity == 'quarter':
+        months = starts.astype('datetime64[M]').astype(np.int64)
+        return [f"{1970 + month // 12}-Q{month % 12 // 3 + 1}" for month in months.tolist()]
+    return np.datetime_as_string(starts, unit='D').tolist()
+
+
+def downsample_step(buckets, max_points):
+    # Consecutive buckets summed into each point so at most max_points remain
+    return 1 if buckets <= max_points else -(-buckets // max_points)
+
+
+def dense_series(rows, series_count, starts, step=1):
+    # rows: (series index array, sale day datetime64[D] array, quantity array) -> int64 matrix[series, point],
+    # each point summing `step` consecutive buckets and labelled by starts[::step]
+    series_index, days, quantities = rows
+    points = -(-len(starts) // step)
+    if not len(days):
+        return np.zeros((series_count, points), dtype=np.int64)
+    columns = (np.searchsorted(starts, days, side='right') - 1) // step
+    flat = np.bincount(series_index * points + columns, weights=quantities, minlength=series_count * points)
+    return np.rint(flat).astype(np.int64).reshape(series_count, points)
+
+
+def load_daily_totals(connection, user_id, start_date, end_date, medicine_ids=None):
+    # (medicine ids or zeros, sale days as datetime64[D], quantities); per medicine only when ids are given
+    source, params = SalesRollup.source(user_id=user_id, start_date=start_date, end_date=end_date,
+                                        medicine_ids=medicine_ids)
+    key = "medicine_id" if medicine_ids else "0"
+    cursor = connection.cursor()
+    cursor.execute(f"""
+        SELECT {key} AS series, sale_date, SUM(quantity)
+        FROM {source} ms
+        GROUP BY series, sale_date
+    """, params)
+    rows = cursor.fetchall()
+    cursor.close()
+    count = len(rows)
+    return (np.fromiter((row[0] for row in rows), dtype=np.int64, count=count),
+            np.array([row[1] for row in rows], dtype='datetime64[D]'),
+            np.fromiter((row[2] for row in rows), dtype=np.float64, count=count))
+
+
+def sales_series(connection, user_id, granularity='month', start_date=None, end_date=None, medicine_ids=None,
+                 max_points=DEFAULT_MAX_POINTS):
+    # Without a range the series runs from the first sale to today.
+    # Returns None when there are no sales at all, else a dict with labels, totals and, per medicine, series.
+    series_ids, days, quantities = load_daily_totals(connection, user_id, start_date, end_date, medicine_ids)
+    if not len(days) and not (start_date and end_date):
+        return None
+    first = np.datetime64(start_date, 'D') if start_date and end_date else days.min()
+    last = np.datetime64(end_date, 'D') if start_date and end_date else max(days.max(),
+                                                                            np.datetime64(datetime.date.today()))
+
+    ids = sorted(set(medicine_ids)) if medicine_ids else [0]
+    series_index = np.searchsorted(np.array(ids, dtype=np.int64), series_ids)
+    starts = bucket_starts(first, last, granularity)
+    step = downsample_step(len(starts), max_points)
+    matrix = dense_series((series_index, days, quantities), len(ids), starts, step)
+    starts = starts[::step]
+
+    labels = bucket_labels(starts, granularity)
+    result = {"labels": labels, "totals": matrix.sum(axis=0).tolist(), "buckets_per_point": step}
+    if medicine_ids:
+        result["series"] = {str(medicine_id): values
+                            for medicine_id, values in zip(ids, matrix.tolist())}
+    return result
@@ -10,12 +10,18 @@ CREATE TABLE IF NOT EXISTS user (
     email VARCHAR(120) UNIQUE NOT NULL
 );
 
+DROP TABLE IF EXISTS stock_reservation;
+DROP TABLE IF EXISTS medicine_stock_summary;
 DROP TABLE IF EXISTS medicine_stock;
 DROP TABLE IF EXISTS active_ingredient;
 DROP TABLE IF EXISTS user_medicine;
 DROP TABLE IF EXISTS medicine;
 DROP TABLE IF EXISTS supplier;
+DROP TABLE IF EXISTS medicine_sales_daily;
+DROP TABLE IF EXISTS medicine_sales_archive_state;
+DROP TABLE IF EXISTS medicine_sales_archive;
 DROP TABLE IF EXISTS medicine_sales;
+DROP TABLE IF EXISTS catalog_version;
 
 CREATE TABLE supplier (
     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -32,7 +38,8 @@ CREATE TABLE medicine (
     brand VARCHAR(200) NOT NULL,
     form VARCHAR(200),
     barcode VARCHAR(200) NOT NULL UNIQUE,
-    equivalent_medicine_group VARCHAR(80)
+    equivalent_medicine_group VARCHAR(80),
+    INDEX idx_medicine_name (name)
 );
 
 CREATE TABLE report (
@@ -55,6 +62,14 @@ CREATE TABLE medicine_active_ingredient (
     FOREIGN KEY (active_ingredient_id) REFERENCES active_ingredient(id)
 );
 
+-- Bumped in the same transaction as every write to medicine, active_ingredient or medicine_active_ingredient;
+-- catalog snapshots are stamped with it (catalog_snapshot.py)
+CREATE TABLE catalog_version (
+    id TINYINT PRIMARY KEY,
+    version BIGINT NOT NULL
+);
+INSERT INTO catalog_version (id, version) VALUES (1, 0);
+
 CREATE TABLE medicine_stock (
     id INT AUTO_INCREMENT PRIMARY KEY,
     medicine_id INT NOT NULL,
@@ -62,70 +77,98 @@ CREATE TABLE medicine_stock (
     user_id INT NOT NULL,
     expiry_date DATE,
     quantity INT NOT NULL,
+    INDEX idx_medicine_stock_user_medicine (user_id, medicine_id, expiry_date),
     FOREIGN KEY (medicine_id) REFERENCES medicine(id) ON DELETE CASCADE,
     FOREIGN KEY (supplier_id) REFERENCES supplier(id),
     FOREIGN KEY (user_id) REFERENCES user(id)
 );
 
-CREATE TABLE medicine_sales (
+-- On-hand stock per user and medicine, kept in step with medicine_stock by the application
+-- (models/StockSummary.py); `flask stock rebuild-summary` recomputes it from the lots
+CREATE TABLE medicine_stock_summary (
+    user_id INT NOT NULL,
+    medicine_id INT NOT NULL,
+    total_quantity INT NOT NULL,
+    lot_count INT NOT NULL,
+    earliest_expiry DATE,
+    PRIMARY KEY (user_id, medicine_id),
+    FOREIGN KEY (medicine_id) REFERENCES medicine(id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES user(id)
+);
+
+-- Quantities held by checkout carts (token) until expires_at (UTC); see models/Reservation.py
+CREATE TABLE stock_reservation (
     id INT AUTO_INCREMENT PRIMARY KEY,
     user_id INT NOT NULL,
     medicine_id INT NOT NULL,
+    token VARCHAR(64) NOT NULL,
+    quantity INT NOT NULL,
+    expires_at DATETIME NOT NULL,
+    UNIQUE KEY uq_stock_reservation_user_token_medicine (user_id, token, medicine_id),
+    INDEX idx_stock_reservation_user_medicine (user_id, medicine_id, expires_at),
+    INDEX idx_stock_reservation_expires_at (expires_at),
+    FOREIGN KEY (medicine_id) REFERENCES medicine(id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES user(id)
+);
+
+-- Sales on or after the archive boundary, partitioned by month of sale_date. `flask stock partition-sales`
+-- splits pmax into monthly partitions (pYYYYMM) and `flask stock archive-sales` moves cold months to
+-- medicine_sales_archive (models/SalesPartitions.py). Partitioned tables cannot have foreign keys, and every
+-- unique key must contain sale_date; Medicine.delete removes a medicine's sales itself.
+CREATE TABLE medicine_sales (
+    id INT AUTO_INCREMENT,
+    user_id INT NOT NULL,
+    medicine_id INT NOT NULL,
     customer_name VARCHAR(80),
     sale_date DATE NOT NULL,
     quantity INT NOT NULL,
-    FOREIGN KEY (user_id) REFERENCES user(id),
-    FOREIGN KEY (medicine_id) REFERENCES medicine(id) ON DELETE CASCADE
+    PRIMARY KEY (id, sale_date),
+    INDEX idx_medicine_sales_sale_date (sale_date, id),
+    INDEX idx_medicine_sales_user_date (user_id, sale_date),
+    INDEX idx_medicine_sales_medicine_date (medicine_id, sale_date, quantity)
+)
+PARTITION BY RANGE (TO_DAYS(sale_date)) (
+    PARTITION pmax VALUES LESS THAN MAXVALUE
+);
+
+-- Sales before the archive boundary, moved out of medicine_sales a month at a time with their original ids
+CREATE TABLE medicine_sales_archive (
+    id INT PRIMARY KEY,
+    user_id INT NOT NULL,
+    medicine_id INT NOT NULL,
+    customer_name VARCHAR(80),
+    sale_date DATE NOT NULL,
+    quantity INT NOT NULL,
+    INDEX idx_medicine_sales_archive_date (sale_date, id),
+    INDEX idx_medicine_sales_archive_user_date (user_id, sale_date),
+    INDEX idx_medicine_sales_archive_medicine_date (medicine_id, sale_date)
+) ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8;
+
+-- archived_before: first sale_date kept in medicine_sales
+CREATE TABLE medicine_sales_archive_state (
+    id TINYINT PRIMARY KEY,
+    archived_before DATE NOT NULL
+);
+INSERT INTO medicine_sales_archive_state (id, archived_before) VALUES (1, '0001-01-01');
+
+-- Sales per user, medicine and day, added to by the sale engine and rebuilt by `flask analysis backfill-rollup`;
+-- the analysis endpoints read it for every day before today (models/SalesRollup.py)
+CREATE TABLE medicine_sales_daily (
+    user_id INT NOT NULL,
+    medicine_id INT NOT NULL,
+    sale_day DATE NOT NULL,
+    total_quantity INT NOT NULL,
+    sale_count INT NOT NULL,
+    PRIMARY KEY (user_id, medicine_id, sale_day),
+    INDEX idx_medicine_sales_daily_day (sale_day),
+    INDEX idx_medicine_sales_daily_medicine_day (medicine_id, sale_day),
+    FOREIGN KEY (medicine_id) REFERENCES medicine(id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES user(id)
 );
 
-DELIMITER //
-
-CREATE TRIGGER after_medicine_sale_insert
-AFTER INSERT ON medicine_sales
-FOR EACH ROW
-BEGIN
-    DECLARE remaining_quantity INT;
-    DECLARE required_quantity INT DEFAULT NEW.quantity;
-    DECLARE current_stock_id INT;
-
-    DECLARE done INT DEFAULT 0;
-    DECLARE stock_cursor CURSOR FOR
-        SELECT id, quantity FROM medicine_stock
-        WHERE medicine_id = NEW.medicine_id AND user_id = NEW.user_id AND quantity > 0
-        ORDER BY expiry_date ASC;
-
-    DECLARE CONTINUE HANDLER FOR NOT FOUND SET done = 1;
-
-    OPEN stock_cursor;
-
-    read_loop: LOOP
-        FETCH stock_cursor INTO current_stock_id, remaining_quantity;
-        IF done THEN
-            LEAVE read_loop;
-        END IF;
-
-        IF remaining_quantity >= required_quantity THEN
-            UPDATE medicine_stock SET quantity = quantity - required_quantity WHERE id = current_stock_id;
-            SET required_quantity = 0;
-        ELSE
-            UPDATE medicine_stock SET quantity = 0 WHERE id = current_stock_id;
-            SET required_quantity = required_quantity - remaining_quantity;
-        END IF;
-
-        IF required_quantity = 0 THEN
-            LEAVE read_loop;
-        END IF;
-    END LOOP;
-
-    CLOSE stock_cursor;
-
-    IF required_quantity > 0 THEN
-        SIGNAL SQLSTATE '45000'
-        SET MESSAGE_TEXT = 'Not enough stock to complete the sale';
-    END IF;
-END //
-
-DELIMITER ;
+-- Stock is decremented first-expiry-first-out by the application (models/Sale.py) in the same transaction as
+-- the sale insert; the old per-row trigger would decrement it a second time.
+DROP TRIGGER IF EXISTS after_medicine_sale_insert;
 ALTER DATABASE eczanemtakipdb CHARACTER SET = utf8mb4 COLLATE = utf8mb4_unicode_ci;
 ALTER TABLE medicine CONVERT TO CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
 ALTER TABLE active_ingredient CONVERT TO CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci;
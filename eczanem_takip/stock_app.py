@@ -1,9 +1,24 @@
+import datetime
+import itertools
+import uuid
+import click
 import MySQLdb
-from flask import Blueprint, request, jsonify, render_template
-from flask_mysqldb import MySQL
+from flask import Blueprint, request, jsonify, render_template, Response, stream_with_context
+from db_router import RoutedMySQL, replica_read, pin_primary
 from models.Medicine import Medicine
-
-mysql = MySQL()
+from models.Sale import Sale, InsufficientStockError
+from models.Stock import Stock
+from models.StockSummary import StockSummary
+from models.SalesPartitions import SalesPartitions, ARCHIVE_AFTER_MONTHS, PARTITION_MONTHS_AHEAD
+from models.Reservation import Reservation
+from stock_reservations import reservation_view, utc_now, DEFAULT_TTL_SECONDS, MAX_TTL_SECONDS
+from response_cache import response_cache
+from expiry_scanner import expiry_scanner, BUCKETS as EXPIRY_BUCKETS
+from substitute_index import substitute_index, DEFAULT_ATC_LEVEL, DEFAULT_LIMIT, ATC_LEVELS
+from json_stream import stream_csv_rows, stream_ndjson_rows
+from pagination import get_page_args, decode_cursor, encode_cursor, cursor_position, resolve_total, count_cache
+
+mysql = RoutedMySQL()
 stock_bp = Blueprint('stock', __name__)
 @stock_bp.route('/add_stock', methods=['POST'])
 def add_stock():
@@ -19,11 +34,17 @@ def add_stock():
 
     try:
         cursor = mysql.connection.cursor()
+        StockSummary.lock(mysql.connection, [(user_id, medicine_id)])
         cursor.execute("""
             INSERT INTO medicine_stock (medicine_id, supplier_id, user_id, expiry_date, quantity)
             VALUES (%s, %s, %s, %s, %s)
         """, (medicine_id, supplier_id, user_id, expiry_date, quantity))
+        StockSummary.refresh(mysql.connection, [(user_id, medicine_id)])
         mysql.connection.commit()
+        count_cache.invalidate('medicine_stock', owner=user_id)
+        expiry_scanner.mark_stale(user_id)
+        response_cache.invalidate(user_id)
+        pin_primary(user_id)
         return jsonify({"success": True, "message": "Stock successfully added"}), 201
     except Exception as e:
         mysql.connection.rollback()
@@ -31,12 +52,107 @@ def add_stock():
     finally:
         cursor.close()
 
+MAX_RECEIPT_LINES = 1000
+
+
+@stock_bp.route('/add_stock_bulk', methods=['POST'])
+def add_stock_bulk():
+    # Goods receipt for a whole delivery: lines name a medicine by medicine_id or barcode, with quantity,
+    # expiry_date and an optional supplier_id overriding the delivery's. Valid lines are written in one
+    # multi-row insert; rejected lines are reported (all_or_nothing=true writes nothing if any line is rejected).
+    data = request.get_json()
+    user_id = data.get('user_id')
+    default_supplier_id = data.get('supplier_id')
+    all_or_nothing = data.get('all_or_nothing', False)
+    items = data.get('lines') or []
+
+    if not all([user_id, items]):
+        return jsonify({"success": False, "message": "User ID and lines are required"}), 400
+    if not isinstance(all_or_nothing, bool):
+        return jsonify({"success": False, "message": "all_or_nothing must be true or false"}), 400
+    if not isinstance(items, list):
+        return jsonify({"success": False, "message": "lines must be a list"}), 400
+    if len(items) > MAX_RECEIPT_LINES:
+        return jsonify({"success": False, "message": f"At most {MAX_RECEIPT_LINES} lines per receipt"}), 400
+
+    try:
+        barcodes = [str(item['barcode']) for item in items
+                    if isinstance(item, dict) and not item.get('medicine_id') and item.get('barcode')]
+        barcode_ids = Medicine.get_ids_by_barcodes(mysql.connection, barcodes)
+
+        parsed, rejected = [], []
+        for index, item in enumerate(items):
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("Each line must be an object")
+                medicine_id = item.get('medicine_id') or barcode_ids.get(str(item.get('barcode')))
+                if not medicine_id:
+                    raise ValueError("Unknown medicine")
+                supplier_id = item.get('supplier_id') or default_supplier_id
+                if not supplier_id:
+                    raise ValueError("Supplier ID is required")
+                quantity = int(item.get('quantity'))
+                if quantity <= 0:
+                    raise ValueError("Quantity must be positive")
+                expiry_date = datetime.datetime.strptime(str(item.get('expiry_date')), '%Y-%m-%d').date()
+                parsed.append((index, (int(medicine_id), int(supplier_id), user_id, expiry_date, quantity)))
+            except (TypeError, ValueError) as e:
+                rejected.append({"line": index, "message": str(e)})
+
+        # Existence of the referenced medicines and suppliers is checked per line instead of failing the insert
+        medicine_ids = Medicine.get_existing_ids(mysql.connection, sorted({lot[0] for _, lot in parsed}))
+        supplier_ids = Stock.get_existing_supplier_ids(mysql.connection, sorted({lot[1] for _, lot in parsed}))
+        lots = []
+        for index, lot in parsed:
+            if lot[0] not in medicine_ids:
+                rejected.append({"line": index, "message": "Unknown medicine"})
+            elif lot[1] not in supplier_ids:
+                rejected.append({"line": index, "message": "Unknown supplier"})
+            else:
+                lots.append(lot)
+        rejected.sort(key=lambda line: line["line"])
+
+        if lots and not (all_or_nothing and rejected):
+            Stock.add_many(mysql.connection, lots)
+            count_cache.invalidate('medicine_stock', owner=user_id)
+            added = len(lots)
+        else:
+            added = 0
+
+        return jsonify({"success": added > 0, "message": f"{added} stock lines successfully added",
+                        "added": added, "rejected": rejected}), 201 if added else 400
+    except Exception as e:
+        return jsonify({"success": False, "message": "Failed to add stock", "error": str(e)}), 500
+
+
+def _lock_stock_owner(cursor, stock_id):
+    # (user_id, medicine_id) of a lot. The pair's summary row and lots are locked until commit in the order
+    # Sale.record_basket takes them, so the owner is read first without a lock and the lot is looked up again
+    # once the pair is locked; None if the lot is gone.
+    cursor.execute("SELECT user_id, medicine_id FROM medicine_stock WHERE id = %s", (stock_id,))
+    owner = cursor.fetchone()
+    if owner is None:
+        return None
+    StockSummary.lock(mysql.connection, [owner])
+    cursor.execute("SELECT user_id, medicine_id FROM medicine_stock WHERE id = %s FOR UPDATE", (stock_id,))
+    return cursor.fetchone()
+
+
 @stock_bp.route('/delete_stock/<int:stock_id>', methods=['DELETE'])
 def delete_stock(stock_id):
     try:
         cursor = mysql.connection.cursor()
+        owner = _lock_stock_owner(cursor, stock_id)
+        if owner is None:
+            mysql.connection.rollback()
+            return jsonify({"success": False, "message": "Stock not found"}), 404
         cursor.execute("DELETE FROM medicine_stock WHERE id = %s", (stock_id,))
+        StockSummary.refresh(mysql.connection, [owner])
         mysql.connection.commit()
+        count_cache.invalidate('medicine_stock', owner=owner[0])
+        expiry_scanner.mark_stale(owner[0])
+        response_cache.invalidate(owner[0])
+        pin_primary(owner[0])
         return jsonify({"success": True, "message": "Stock successfully deleted"}), 200
     except Exception as e:
         mysql.connection.rollback()
@@ -56,12 +172,21 @@ def update_stock(stock_id):
 
     try:
         cursor = mysql.connection.cursor()
+        owner = _lock_stock_owner(cursor, stock_id)
+        if owner is None:
+            mysql.connection.rollback()
+            return jsonify({"success": False, "message": "Stock not found"}), 404
         cursor.execute("""
             UPDATE medicine_stock
             SET quantity = %s, expiry_date = %s
             WHERE id = %s
         """, (quantity, expiry_date, stock_id))
+        StockSummary.refresh(mysql.connection, [owner])
         mysql.connection.commit()
+        count_cache.invalidate('medicine_stock', owner=owner[0])
+        expiry_scanner.mark_stale(owner[0])
+        response_cache.invalidate(owner[0])
+        pin_primary(owner[0])
         return jsonify({"success": True, "message": "Stock successfully updated"}), 200
     except Exception as e:
         mysql.connection.rollback()
@@ -71,72 +196,225 @@ def update_stock(stock_id):
 
 # Get Stock by Medicine ID (Read)
 @stock_bp.route('/get_stock_by_medicine/<int:medicine_id>', methods=['GET'])
+@replica_read
 def get_stock_by_medicine(medicine_id):
     try:
         cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
         cursor.execute("SELECT * FROM medicine_stock WHERE medicine_id = %s", (medicine_id,))
         stock_records = cursor.fetchall()
         cursor.close()
-        return jsonify({"success": True, "stock": stock_records}), 200
+        response = {"success": True, "stock": stock_records}
+        user_id = request.args.get('user_id')
+        if user_id:
+            response["on_hand"] = StockSummary.get(mysql.connection, user_id, medicine_id)
+        return jsonify(response), 200
     except Exception as e:
         return jsonify({"success": False, "message": "Failed to retrieve stock", "error": str(e)}), 500
 
 
-@stock_bp.route('/view_sales', methods=['GET'])
-def view_sales():
+MAX_ON_HAND_IDS = 500
+
+
+@stock_bp.route('/on_hand', methods=['GET'])
+def get_on_hand():
+    # On-hand quantity, lot count and earliest expiry of one or more medicines (?medicine_id=1&medicine_id=2
+    # or ?barcode=...), read from the summary table
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({"success": False, "message": "User ID is required"}), 400
     try:
-        # Get query parameters
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 10))
-        offset = (page - 1) * per_page
+        medicine_ids = [int(value) for value in request.args.getlist('medicine_id')]
+    except ValueError:
+        return jsonify({"success": False, "message": "medicine_id must be an integer"}), 400
+    barcodes = request.args.getlist('barcode')
+    if not medicine_ids and not barcodes:
+        return jsonify({"success": False, "message": "medicine_id or barcode is required"}), 400
+    if len(medicine_ids) + len(barcodes) > MAX_ON_HAND_IDS:
+        return jsonify({"success": False, "message": f"At most {MAX_ON_HAND_IDS} medicines per request"}), 400
 
-        medicine_name = request.args.get('medicine_name', '').strip()
-        customer_name = request.args.get('customer_name', '').strip()
-        start_date = request.args.get('start_date', '').strip()
-        end_date = request.args.get('end_date', '').strip()
-        min_quantity = request.args.get('min_quantity', '').strip()
-        max_quantity = request.args.get('max_quantity', '').strip()
-
-        # Base query
-        query = """
-            SELECT ms.id, m.name AS medicine_name, ms.customer_name, ms.sale_date, ms.quantity
-            FROM medicine_sales ms
-            JOIN medicine m ON ms.medicine_id = m.id
-            WHERE 1=1
-        """
-        params = []
+    try:
+        if barcodes:
+            medicine_ids += Medicine.get_ids_by_barcodes(mysql.connection, barcodes).values()
+        medicine_ids = sorted(set(medicine_ids))
+        summaries = StockSummary.get_many(mysql.connection, user_id, medicine_ids)
+        on_hand = [summaries.get(medicine_id, StockSummary.empty(user_id, medicine_id)) for medicine_id in medicine_ids]
+        return jsonify({"success": True, "on_hand": on_hand}), 200
+    except Exception as e:
+        return jsonify({"success": False, "message": "Failed to retrieve on-hand stock", "error": str(e)}), 500
 
-        # Add filters to the query
-        if medicine_name:
-            query += " AND m.name LIKE %s"
-            params.append(f"%{medicine_name}%")
 
-        if customer_name:
-            query += " AND ms.customer_name LIKE %s"
-            params.append(f"%{customer_name}%")
+@stock_bp.route('/expiry_summary', methods=['GET'])
+def get_expiry_summary():
+    # Lot count and quantity per expiry bucket (expired, within 30/90/180 days), from the precomputed horizon
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({"success": False, "message": "User ID is required"}), 400
+    try:
+        summary = expiry_scanner.summary(mysql.connection, user_id)
+        return jsonify({"success": True, "buckets": [dict(bucket=name, **summary[name]) for name, _ in EXPIRY_BUCKETS]}), 200
+    except Exception as e:
+        return jsonify({"success": False, "message": "Failed to retrieve expiry summary", "error": str(e)}), 500
 
-        if start_date:
-            query += " AND ms.sale_date >= %s"
-            params.append(start_date)
 
-        if end_date:
-            query += " AND ms.sale_date <= %s"
-            params.append(end_date)
+@stock_bp.route('/expiring', methods=['GET'])
+def get_expiring_stock():
+    # Lots of one expiry bucket, soonest first, with their medicine names
+    user_id = request.args.get('user_id')
+    bucket = request.args.get('bucket', EXPIRY_BUCKETS[1][0])
+    if not user_id:
+        return jsonify({"success": False, "message": "User ID is required"}), 400
+    if bucket not in dict(EXPIRY_BUCKETS):
+        return jsonify({"success": False, "message": f"bucket must be one of {', '.join(name for name, _ in EXPIRY_BUCKETS)}"}), 400
+    try:
+        page, per_page, _, _ = get_page_args(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
 
-        if min_quantity:
-            query += " AND ms.quantity >= %s"
-            params.append(min_quantity)
+    try:
+        summary = expiry_scanner.summary(mysql.connection, user_id)
+        lots = expiry_scanner.lots(mysql.connection, user_id, bucket, (page - 1) * per_page, per_page)
+        names = Medicine.get_names_by_ids(mysql.connection, sorted({lot['medicine_id'] for lot in lots}))
+        for lot in lots:
+            lot['medicine_name'], lot['medicine_barcode'] = names.get(lot['medicine_id'], (None, None))
+        total_items = summary[bucket]['lot_count']
+        return jsonify({
+            "success": True,
+            "bucket": bucket,
+            "lots": lots,
+            "quantity": summary[bucket]['quantity'],
+            "pagination": {
+                "current_page": page,
+                "per_page": per_page,
+                "total_items": total_items,
+                "total_pages": (total_items + per_page - 1) // per_page
+            }
+        }), 200
+    except Exception as e:
+        return jsonify({"success": False, "message": "Failed to retrieve expiring stock", "error": str(e)}), 500
+
+
+@stock_bp.route('/substitutes/<string:barcode>', methods=['GET'])
+def get_substitutes(barcode):
+    user_id = request.args.get('user_id')
+    in_stock_only = request.args.get('in_stock_only', 'false').lower() == 'true'
+    try:
+        atc_level = int(request.args.get('atc_level', DEFAULT_ATC_LEVEL))
+        limit = int(request.args.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({"success": False, "message": "atc_level and limit must be integers"}), 400
+
+    if not user_id:
+        return jsonify({"success": False, "message": "User ID is required"}), 400
+    if atc_level not in ATC_LEVELS:
+        return jsonify({"success": False, "message": "atc_level must be between 1 and 5"}), 400
+
+    try:
+        substitute_index.ensure_current(mysql.connection)
+        medicine = substitute_index.get(barcode)
+        # With in_stock_only the index result is filtered afterwards, so look further than `limit`
+        candidates = substitute_index.substitutes(barcode, atc_level=atc_level,
+                                                  limit=limit * 10 if in_stock_only else limit)
+        if medicine is None or candidates is None:
+            return jsonify({"success": False, "message": "Medicine not found"}), 404
+
+        # On-hand stock of every candidate from the summary table
+        on_hand = StockSummary.get_many(mysql.connection, user_id, [entry['id'] for entry, _ in candidates])
+
+        substitutes = []
+        for entry, reasons in candidates:
+            summary = on_hand.get(entry['id'])
+            quantity, earliest_expiry = (summary['total_quantity'], summary['earliest_expiry']) if summary else (0, None)
+            if in_stock_only and not quantity:
+                continue
+            entry.pop('ingredients')
+            entry.update({"reasons": reasons, "on_hand_quantity": quantity, "earliest_expiry": earliest_expiry})
+            substitutes.append(entry)
+
+        medicine.pop('ingredients')
+        return jsonify({"success": True, "medicine": medicine, "substitutes": substitutes[:limit]}), 200
+    except Exception as e:
+        return jsonify({"success": False, "message": "Failed to find substitutes", "error": str(e)}), 500
+
+
+def _sales_filters(args):
+    # FROM/WHERE clause and parameters of the sales listing filters, shared by view_sales and export_sales
+    medicine_name = args.get('medicine_name', '').strip()
+    customer_name = args.get('customer_name', '').strip()
+    start_date = args.get('start_date', '').strip()
+    end_date = args.get('end_date', '').strip()
+    min_quantity = args.get('min_quantity', '').strip()
+    max_quantity = args.get('max_quantity', '').strip()
+    user_id = args.get('user_id', '').strip()
+
+    # Base query over the sales tiers the date range needs (models/SalesPartitions.py)
+    source, params = SalesPartitions.source(mysql.connection, user_id, start_date, end_date)
+    from_clause = f"""
+        FROM {source} ms
+        JOIN medicine m ON ms.medicine_id = m.id
+        WHERE 1=1
+    """
+
+    # Add filters to the query
+    if user_id:
+        from_clause += " AND ms.user_id = %s"
+        params.append(user_id)
+
+    if medicine_name:
+        from_clause += " AND m.name LIKE %s"
+        params.append(f"%{medicine_name}%")
+
+    if customer_name:
+        from_clause += " AND ms.customer_name LIKE %s"
+        params.append(f"%{customer_name}%")
+
+    if start_date:
+        from_clause += " AND ms.sale_date >= %s"
+        params.append(start_date)
+
+    if end_date:
+        from_clause += " AND ms.sale_date <= %s"
+        params.append(end_date)
+
+    if min_quantity:
+        from_clause += " AND ms.quantity >= %s"
+        params.append(min_quantity)
 
-        if max_quantity:
-            query += " AND ms.quantity <= %s"
-            params.append(max_quantity)
+    if max_quantity:
+        from_clause += " AND ms.quantity <= %s"
+        params.append(max_quantity)
 
-        query += " LIMIT %s OFFSET %s"
-        params.append(per_page)
-        params.append(offset)
+    return from_clause, params
+
+
+@stock_bp.route('/view_sales', methods=['GET'])
+@replica_read
+def view_sales():
+    try:
+        # Get query parameters; `cursor` seeks on (sale_date, id) instead of skipping rows with OFFSET
+        page, per_page, page_cursor, total_mode = get_page_args(request.args, default_total='none', cursor_total='none')
+        after = decode_cursor(page_cursor, 2)
+        if after:
+            cursor_position(after[1])
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    try:
+        offset = (page - 1) * per_page
+        from_clause, params = _sales_filters(request.args)
+
+        query = "SELECT ms.id, m.name AS medicine_name, ms.customer_name, ms.sale_date, ms.quantity" + from_clause
+        query_params = list(params)
+        if after:
+            query += " AND (ms.sale_date > %s OR (ms.sale_date = %s AND ms.id > %s))"
+            query_params.extend([after[0], after[0], after[1]])
+        query += " ORDER BY ms.sale_date, ms.id LIMIT %s"
+        query_params.append(per_page)
+        if page_cursor is None:
+            query += " OFFSET %s"
+            query_params.append(offset)
 
         cursor = mysql.connection.cursor()
-        cursor.execute(query, tuple(params))
+        cursor.execute(query, tuple(query_params))
         sales = cursor.fetchall()
 
         sales_list = [
@@ -152,11 +430,72 @@ def view_sales():
 
         cursor.close()
 
-        return jsonify({"success": True, "sales": sales_list}), 200
+        def count_sales():
+            count_cursor = mysql.connection.cursor()
+            count_cursor.execute("SELECT COUNT(*)" + from_clause, tuple(params))
+            total = count_cursor.fetchone()[0]
+            count_cursor.close()
+            return total
+
+        response = {"success": True, "sales": sales_list}
+        if total_mode != 'none':
+            response["total"] = resolve_total(total_mode, ('medicine_sales', from_clause, tuple(params)), count_sales)
+        response["next_cursor"] = encode_cursor(sales[-1][3], sales[-1][0]) if len(sales) == per_page else None
+
+        return jsonify(response), 200
 
     except Exception as e:
         return jsonify({"success": False, "message": "Failed to fetch sales", "error": str(e)}), 500
 
+SALES_EXPORT_COLUMNS = ('id', 'sale_date', 'medicine_id', 'medicine_name', 'medicine_barcode', 'customer_name',
+                        'quantity', 'user_id')
+SALES_EXPORT_FORMATS = {
+    'csv': (stream_csv_rows, 'text/csv; charset=utf-8'),
+    'ndjson': (stream_ndjson_rows, 'application/x-ndjson')
+}
+
+
+@stock_bp.route('/export_sales', methods=['GET'])
+@replica_read
+def export_sales():
+    # Every sale matching the view_sales filters, in (sale_date, id) order, as a chunked CSV or NDJSON download.
+    # Rows come from an unbuffered cursor and are written as they arrive, so memory stays flat for any range.
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in SALES_EXPORT_FORMATS:
+        return jsonify({"success": False, "message": "format must be csv or ndjson"}), 400
+    stream_rows, mimetype = SALES_EXPORT_FORMATS[export_format]
+    # The range also names the file, so only real dates are accepted
+    try:
+        start_date, end_date = (datetime.datetime.strptime(value, '%Y-%m-%d').date() if value else None
+                                for value in (request.args.get('start_date', '').strip(),
+                                              request.args.get('end_date', '').strip()))
+    except ValueError:
+        return jsonify({"success": False, "message": "start_date and end_date must be YYYY-MM-DD"}), 400
+
+    try:
+        from_clause, params = _sales_filters(request.args)
+        query = ("SELECT ms.id, ms.sale_date, ms.medicine_id, m.name, m.barcode, ms.customer_name, ms.quantity, ms.user_id"
+                 + from_clause + " ORDER BY ms.sale_date, ms.id")
+        # The first row is fetched here so query errors still produce the JSON error response below
+        rows = Sale.iter_rows(mysql.connection, query, params)
+        first = next(rows, None)
+        body = stream_rows(SALES_EXPORT_COLUMNS, itertools.chain([first] if first else [], rows))
+
+        filename = f"sales_{start_date or 'start'}_{end_date or 'end'}.{export_format}"
+        return Response(stream_with_context(body), mimetype=mimetype,
+                        headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+    except Exception as e:
+        return jsonify({"success": False, "message": "Failed to export sales", "error": str(e)}), 500
+
+
+def _parse_sale_date(value):
+    # sale_date as a date ('YYYY-MM-DD', optionally with a time), or None when it is not one
+    try:
+        return datetime.datetime.fromisoformat(value).date()
+    except (TypeError, ValueError):
+        return None
+
+
 @stock_bp.route('/record_sale', methods=['POST'])
 def record_sale():
     data = request.get_json()
@@ -168,146 +507,328 @@ def record_sale():
 
     if not all([user_id, medicine_id, sale_date, quantity]):
         return jsonify({"success": False, "message": "User ID, medicine ID, sale date, and quantity are required"}), 400
+    try:
+        medicine_id, quantity = int(medicine_id), int(quantity)
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "Medicine ID and quantity must be integers"}), 400
+    if quantity <= 0:
+        return jsonify({"success": False, "message": "Quantity must be positive"}), 400
+    sale_date = _parse_sale_date(sale_date)
+    if sale_date is None:
+        return jsonify({"success": False, "message": "Sale date must be YYYY-MM-DD"}), 400
 
     try:
-        cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+        lines = Sale.record_basket(mysql.connection, user_id,
+                                   [{"medicine_id": medicine_id, "quantity": quantity}],
+                                   customer_name, sale_date, data.get('reservation_token'))
+        on_hand = StockSummary.get(mysql.connection, user_id, medicine_id)
+        return jsonify({"success": True, "message": "Sale successfully recorded", "lots": lines[0]["lots"],
+                        "on_hand": on_hand}), 201
+    except InsufficientStockError as e:
+        return jsonify({"success": False, "message": str(e), "shortages": e.shortages}), 400
+    except Exception as e:
+        return jsonify({"success": False, "message": "Failed to record sale", "error": str(e)}), 500
 
-        # Check stock
-        cursor.execute("""
-            SELECT id, quantity FROM medicine_stock
-            WHERE medicine_id = %s AND user_id = %s AND quantity > 0
-            ORDER BY expiry_date ASC
-        """, (medicine_id, user_id))
-        stock_records = cursor.fetchall()
 
-        total_available = sum(record['quantity'] for record in stock_records)
-        if total_available < quantity:
-            return jsonify({"success": False, "message": "Not enough stock to complete the sale"}), 400
+@stock_bp.route('/record_basket_sale', methods=['POST'])
+def record_basket_sale():
+    data = request.get_json()
+    user_id = data.get('user_id')
+    customer_name = data.get('customer_name')
+    sale_date = data.get('sale_date')
+    items = data.get('lines') or []
 
-        required_quantity = quantity
-        for record in stock_records:
-            if required_quantity <= 0:
-                break
+    if not all([user_id, sale_date, items]):
+        return jsonify({"success": False, "message": "User ID, sale date, and lines are required"}), 400
+    if not isinstance(items, list):
+        return jsonify({"success": False, "message": "lines must be a list"}), 400
+    sale_date = _parse_sale_date(sale_date)
+    if sale_date is None:
+        return jsonify({"success": False, "message": "Sale date must be YYYY-MM-DD"}), 400
 
-            current_stock_id = record['id']
-            current_stock_quantity = record['quantity']
+    try:
+        # Each line names a medicine by medicine_id or barcode; barcodes are resolved in one query
+        barcodes = [str(item['barcode']) for item in items
+                    if isinstance(item, dict) and not item.get('medicine_id') and item.get('barcode')]
+        barcode_ids = Medicine.get_ids_by_barcodes(mysql.connection, barcodes)
+        lines, invalid = [], []
+        for index, item in enumerate(items):
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("Each line must be an object")
+                medicine_id = item.get('medicine_id') or barcode_ids.get(str(item.get('barcode')))
+                if not medicine_id:
+                    raise ValueError("Unknown medicine")
+                medicine_id = int(medicine_id)
+                quantity = int(item.get('quantity'))
+                if quantity <= 0:
+                    raise ValueError("Quantity must be positive")
+                lines.append({"medicine_id": medicine_id, "quantity": quantity})
+            except (TypeError, ValueError) as e:
+                invalid.append({"line": index, "message": str(e)})
+        if invalid:
+            return jsonify({"success": False, "message": "Invalid basket lines", "invalid_lines": invalid}), 400
+
+        sold = Sale.record_basket(mysql.connection, user_id, lines, customer_name, sale_date,
+                                  data.get('reservation_token'))
+        on_hand = StockSummary.get_many(mysql.connection, user_id, sorted({line['medicine_id'] for line in lines}))
+        for line in sold:
+            line["on_hand"] = on_hand.get(line['medicine_id'], StockSummary.empty(user_id, line['medicine_id']))
+        return jsonify({"success": True, "message": "Sale successfully recorded", "lines": sold}), 201
+    except InsufficientStockError as e:
+        return jsonify({"success": False, "message": str(e), "shortages": e.shortages}), 400
+    except Exception as e:
+        return jsonify({"success": False, "message": "Failed to record sale", "error": str(e)}), 500
 
-            if current_stock_quantity >= required_quantity:
-                # Update the stock with the remaining quantity
-                new_quantity = current_stock_quantity - required_quantity
-                
-                required_quantity = 0
-            else:
-                # Reduce the stock to 0
 
-                required_quantity -= current_stock_quantity
+@stock_bp.route('/reserve', methods=['POST'])
+def reserve_stock():
+    # Holds quantities for a checkout cart until the sale is recorded with the same reservation_token, the cart
+    # is released, or ttl_seconds pass. Each line sets the cart's hold for that medicine (quantity 0 drops it);
+    # either every line is held or none is.
+    data = request.get_json()
+    user_id = data.get('user_id')
+    token = data.get('reservation_token') or uuid.uuid4().hex
+    items = data.get('lines') or []
 
-        # Record sale
-        cursor.execute("""
-            INSERT INTO medicine_sales (user_id, medicine_id, customer_name, sale_date, quantity)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (user_id, medicine_id, customer_name, sale_date, quantity))
+    if not all([user_id, items]):
+        return jsonify({"success": False, "message": "User ID and lines are required"}), 400
+    if not isinstance(items, list):
+        return jsonify({"success": False, "message": "lines must be a list"}), 400
+    try:
+        ttl_seconds = min(int(data.get('ttl_seconds', DEFAULT_TTL_SECONDS)), MAX_TTL_SECONDS)
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "ttl_seconds must be an integer"}), 400
+    if ttl_seconds <= 0:
+        return jsonify({"success": False, "message": "ttl_seconds must be positive"}), 400
 
-        mysql.connection.commit()
-        return jsonify({"success": True, "message": "Sale successfully recorded"}), 201
+    try:
+        barcodes = [str(item['barcode']) for item in items
+                    if isinstance(item, dict) and not item.get('medicine_id') and item.get('barcode')]
+        barcode_ids = Medicine.get_ids_by_barcodes(mysql.connection, barcodes)
+        holds, invalid = {}, []
+        for index, item in enumerate(items):
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("Each line must be an object")
+                medicine_id = item.get('medicine_id') or barcode_ids.get(str(item.get('barcode')))
+                if not medicine_id:
+                    raise ValueError("Unknown medicine")
+                medicine_id = int(medicine_id)
+                quantity = int(item.get('quantity'))
+                if quantity < 0:
+                    raise ValueError("Quantity must not be negative")
+                holds[medicine_id] = holds.get(medicine_id, 0) + quantity
+            except (TypeError, ValueError) as e:
+                invalid.append({"line": index, "message": str(e)})
+        if invalid:
+            return jsonify({"success": False, "message": "Invalid reservation lines", "invalid_lines": invalid}), 400
+
+        now = utc_now()
+        expires_at = now + datetime.timedelta(seconds=ttl_seconds)
+        availability, shortages = Reservation.reserve(mysql.connection, user_id, token, holds, expires_at, now)
+        if shortages:
+            return jsonify({"success": False, "message": "Not enough stock to reserve", "shortages": shortages,
+                            "availability": list(availability.values())}), 409
+        reservation_view.set_holds(user_id, token, holds, expires_at)
+        return jsonify({"success": True, "reservation_token": token, "expires_at": expires_at.isoformat() + 'Z',
+                        "holds": list(availability.values())}), 200
+    except Exception as e:
+        return jsonify({"success": False, "message": "Failed to reserve stock", "error": str(e)}), 500
+
+
+@stock_bp.route('/release_reservation', methods=['POST'])
+def release_reservation():
+    data = request.get_json()
+    user_id = data.get('user_id')
+    token = data.get('reservation_token')
 
+    if not all([user_id, token]):
+        return jsonify({"success": False, "message": "User ID and reservation token are required"}), 400
+    try:
+        released = Reservation.release(mysql.connection, user_id, token)
+        reservation_view.release(user_id, token)
+        return jsonify({"success": True, "message": f"{released} holds released"}), 200
     except Exception as e:
-        mysql.connection.rollback()
-        return jsonify({"success": False, "message": "Failed to record sale", "error": str(e)}), 500
+        return jsonify({"success": False, "message": "Failed to release reservation", "error": str(e)}), 500
 
-    finally:
-        cursor.close()
+
+@stock_bp.route('/availability', methods=['GET'])
+def get_availability():
+    # On-hand stock net of other carts' live reservations, for the sale screen (?medicine_id=..&medicine_id=..).
+    # Advisory: the sale itself re-checks under row locks.
+    user_id = request.args.get('user_id')
+    token = request.args.get('reservation_token')
+    if not user_id:
+        return jsonify({"success": False, "message": "User ID is required"}), 400
+    try:
+        medicine_ids = sorted({int(value) for value in request.args.getlist('medicine_id')})
+    except ValueError:
+        return jsonify({"success": False, "message": "medicine_id must be an integer"}), 400
+    if not medicine_ids:
+        return jsonify({"success": False, "message": "medicine_id is required"}), 400
+    if len(medicine_ids) > MAX_ON_HAND_IDS:
+        return jsonify({"success": False, "message": f"At most {MAX_ON_HAND_IDS} medicines per request"}), 400
+
+    try:
+        summaries = StockSummary.get_many(mysql.connection, user_id, medicine_ids)
+        reserved = reservation_view.reserved(mysql.connection, user_id, medicine_ids, exclude_token=token)
+        availability = []
+        for medicine_id in medicine_ids:
+            on_hand = summaries[medicine_id]['total_quantity'] if medicine_id in summaries else 0
+            availability.append({"medicine_id": medicine_id, "on_hand": on_hand,
+                                 "reserved_by_others": reserved[medicine_id],
+                                 "available": max(on_hand - reserved[medicine_id], 0)})
+        return jsonify({"success": True, "availability": availability}), 200
+    except Exception as e:
+        return jsonify({"success": False, "message": "Failed to retrieve availability", "error": str(e)}), 500
 
 
+# Longest id list a name filter is turned into before falling back to LIKE
+MAX_FILTER_IDS = 5000
+
+
+def _in_condition(column, ids, params):
+    if not ids:
+        return " AND 1 = 0"
+    params.extend(ids)
+    return f" AND {column} IN ({', '.join(['%s'] * len(ids))})"
 
 
 @stock_bp.route('/filter_stock', methods=['GET'])
+@replica_read
 def filter_stock():
     user_id = request.args.get('user_id')
     supplier_name = request.args.get('supplier_name')
     medicine_name = request.args.get('medicine_name')
     barcode = request.args.get('barcode')
     expiry_date = request.args.get('expiry_date')
-    page = int(request.args.get('page', 1))  # Default to page 1
-    per_page = int(request.args.get('per_page', 10))  # Default to 10 items per page
+    try:
+        # Default to page 1 and 10 items per page; `cursor` seeks on (medicine name, stock id) instead.
+        # Totals come from a short-TTL cache keyed by the filters unless total=exact is asked for.
+        page, per_page, page_cursor, total_mode = get_page_args(request.args, default_total='cached')
+        after = decode_cursor(page_cursor, 2)
+        if after:
+            cursor_position(after[1])
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
 
     offset = (page - 1) * per_page
 
-    query = """
-        SELECT ms.*, m.name AS medicine_name, m.barcode AS medicine_barcode, s.name AS supplier_name
-        FROM medicine_stock ms
-        JOIN medicine m ON ms.medicine_id = m.id
-        JOIN supplier s ON ms.supplier_id = s.id
-        WHERE ms.user_id = %s
-    """
-    query_params = [user_id]
-
-    if supplier_name:
-        query += " AND s.name LIKE %s"
-        query_params.append(f"%{supplier_name}%")
-
-    if medicine_name:
-        query += " AND m.name LIKE %s"
-        query_params.append(f"%{medicine_name}%")
-
-    if barcode:
-        query += " AND m.barcode = %s"
-        query_params.append(barcode)
-
-    if expiry_date:
-        query += " AND ms.expiry_date <= %s"
-        query_params.append(expiry_date)
-
-    query += " ORDER BY m.name ASC LIMIT %s OFFSET %s"
-    query_params.extend([per_page, offset])
-
     try:
-        cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-        cursor.execute(query, query_params)
-        filtered_stocks = cursor.fetchall()
-
-        # Count total items for pagination
-        count_query = """
-            SELECT COUNT(*) as total
+        from_clause = """
             FROM medicine_stock ms
             JOIN medicine m ON ms.medicine_id = m.id
             JOIN supplier s ON ms.supplier_id = s.id
             WHERE ms.user_id = %s
         """
-        count_query_params = [user_id]
+        filter_params = [user_id]
 
+        # Name filters are resolved to ids up front so MySQL filters on indexed id columns
+        # instead of running leading-wildcard LIKEs over the join. The search index and the barcode cache
+        # are shared by every request, so they are filled from the primary.
         if supplier_name:
-            count_query += " AND s.name LIKE %s"
-            count_query_params.append(f"%{supplier_name}%")
+            supplier_ids = Stock.get_supplier_ids_by_name(mysql.connection, supplier_name)
+            from_clause += _in_condition("ms.supplier_id", supplier_ids, filter_params)
 
         if medicine_name:
-            count_query += " AND m.name LIKE %s"
-            count_query_params.append(f"%{medicine_name}%")
+            medicine_ids = Medicine.ids_by_name(mysql.primary, medicine_name)
+            if len(medicine_ids) <= MAX_FILTER_IDS:
+                from_clause += _in_condition("ms.medicine_id", medicine_ids, filter_params)
+            else:
+                from_clause += " AND m.name LIKE %s"
+                filter_params.append(f"%{medicine_name}%")
 
         if barcode:
-            count_query += " AND m.barcode = %s"
-            count_query_params.append(barcode)
+            medicine = Medicine.get_by_barcode(mysql.primary, barcode)
+            from_clause += _in_condition("ms.medicine_id", [medicine.id] if medicine else [], filter_params)
 
         if expiry_date:
-            count_query += " AND ms.expiry_date <= %s"
-            count_query_params.append(expiry_date)
+            from_clause += " AND ms.expiry_date <= %s"
+            filter_params.append(expiry_date)
+
+        query = ("SELECT ms.*, m.name AS medicine_name, m.barcode AS medicine_barcode, s.name AS supplier_name"
+                 + from_clause)
+        query_params = list(filter_params)
+        if after:
+            query += " AND (m.name > %s OR (m.name = %s AND ms.id > %s))"
+            query_params.extend([after[0], after[0], after[1]])
+        query += " ORDER BY m.name ASC, ms.id ASC LIMIT %s"
+        query_params.append(per_page)
+        if page_cursor is None:
+            query += " OFFSET %s"
+            query_params.append(offset)
 
-        cursor.execute(count_query, count_query_params)
-        total_items = cursor.fetchone()['total']
+        cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+        cursor.execute(query, query_params)
+        filtered_stocks = cursor.fetchall()
         cursor.close()
 
-        total_pages = (total_items + per_page - 1) // per_page  # Calculate total pages
+        # Count total items for pagination
+        def count_stocks():
+            count_cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+            count_cursor.execute("SELECT COUNT(*) as total" + from_clause, filter_params)
+            total = count_cursor.fetchone()['total']
+            count_cursor.close()
+            return total
+
+        count_key = ('medicine_stock', user_id, supplier_name, medicine_name, barcode, expiry_date)
+        total_items = resolve_total(total_mode, count_key, count_stocks)
+        total_pages = (total_items + per_page - 1) // per_page if total_items is not None else None  # Calculate total pages
+
+        next_cursor = None
+        if len(filtered_stocks) == per_page:
+            last = filtered_stocks[-1]
+            next_cursor = encode_cursor(last['medicine_name'], last['id'])
 
         return jsonify({
             "success": True,
             "stocks": filtered_stocks,
             "pagination": {
-                "current_page": page,
+                "current_page": page if page_cursor is None else None,
                 "per_page": per_page,
                 "total_items": total_items,
-                "total_pages": total_pages
+                "total_pages": total_pages,
+                "next_cursor": next_cursor
             }
         }), 200
 
     except Exception as e:
         return jsonify({"success": False, "message": "Failed to filter stocks", "error": str(e)}), 500
+
+
+@stock_bp.cli.command('rebuild-summary')
+def rebuild_stock_summary():
+    """Recompute the on-hand stock summary table from medicine_stock."""
+    written = StockSummary.rebuild(mysql.connection)
+    click.echo(f"Stock summary rebuilt ({written} rows)")
+
+
+@stock_bp.cli.command('partition-sales')
+@click.option('--months-ahead', default=PARTITION_MONTHS_AHEAD, show_default=True)
+def partition_sales(months_ahead):
+    """Add the monthly medicine_sales partitions up to --months-ahead months from now."""
+    created = SalesPartitions.ensure_partitions(mysql.connection, months_ahead=months_ahead)
+    click.echo(f"Created partitions: {', '.join(created)}" if created else "Sales partitions are up to date")
+
+
+@stock_bp.cli.command('archive-sales')
+@click.option('--months', 'archive_after_months', default=ARCHIVE_AFTER_MONTHS, show_default=True)
+def archive_sales(archive_after_months):
+    """Move the sales months older than --months to the archive and add upcoming partitions."""
+    moved = SalesPartitions.archive(mysql.connection, archive_after_months=archive_after_months)
+    for name, rows in moved:
+        click.echo(f"{name}: {rows} sales archived")
+    SalesPartitions.ensure_partitions(mysql.connection)
+    click.echo(f"{len(moved)} partitions archived")
+
+
+@stock_bp.cli.command('verify-summary')
+def verify_stock_summary():
+    """Compare the on-hand stock summary table with medicine_stock."""
+    mismatches = StockSummary.verify(mysql.connection)
+    for user_id, medicine_id, stored, expected in mismatches:
+        click.echo(f"user {user_id}, medicine {medicine_id}: stored {stored}, expected {expected}")
+    if mismatches:
+        raise click.ClickException(f"{len(mismatches)} stock summary rows are out of date; run `flask stock rebuild-summary`")
+    click.echo("Stock summary is up to date")
@@ -0,0 +1,113 @@
+import datetime
+import threading
+import time
+
+from models.Reservation import Reservation
+
+# In-memory view of the live stock reservations of each user, for availability checks on the sale screen.
+# MySQL stays the authority: reservations and sales re-check holds under row locks in their own transactions.
+# The view is updated by this process's writes and reloaded after a few seconds to pick up other processes'.
+
+DEFAULT_TTL_SECONDS = 300
+MAX_TTL_SECONDS = 1800
+VIEW_TTL_SECONDS = 5
+RECLAIM_INTERVAL_SECONDS = 60
+
+
+def utc_now():
+    # Naive UTC, the form expires_at is stored in
+    return datetime.datetime.utcnow().replace(microsecond=0)
+
+
+class ReservationView:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {user_id: (loaded_at, {medicine_id: {token: (quantity, expires_at)}})}
+        self._users = {}
+        self._thread = None
+        self.reclaimed = 0
+
+    def _holds(self, connection, user_id, now):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry and time.monotonic() - entry[0] < VIEW_TTL_SECONDS:
+                return entry[1]
+        holds = {}
+        for medicine_id, token, quantity, expires_at in Reservation.get_live(connection, user_id, now):
+            holds.setdefault(medicine_id, {})[token] = (quantity, expires_at)
+        with self._lock:
+            self._users[user_id] = (time.monotonic(), holds)
+        return holds
+
+    def reserved(self, connection, user_id, medicine_ids, exclude_token=None, now=None):
+        # {medicine_id: quantity held by live reservations other than exclude_token}
+        now = now or utc_now()
+        holds = self._holds(connection, int(user_id), now)
+        with self._lock:
+            return {medicine_id: sum(quantity for token, (quantity, expires_at) in holds.get(medicine_id, {}).items()
+                                     if token != exclude_token and expires_at > now)
+                    for medicine_id in medicine_ids}
+
+    def set_holds(self, user_id, token, holds, expires_at):
+        # Applies a committed reservation: holds is {medicine_id: quantity}, the cart's other holds move to
+        # the new expiry
+        with self._lock:
+            entry = self._users.get(int(user_id))
+            if entry is None:
+                return
+            for medicine_id, tokens in entry[1].items():
+                if token in tokens:
+                    tokens[token] = (tokens[token][0], expires_at)
+            for medicine_id, quantity in holds.items():
+                tokens = entry[1].setdefault(medicine_id, {})
+                if quantity > 0:
+                    tokens[token] = (quantity, expires_at)
+                else:
+                    tokens.pop(token, None)
+
+    def release(self, user_id, token):
+        with self._lock:
+            entry = self._users.get(int(user_id))
+            if entry is not None:
+                for tokens in entry[1].values():
+                    tokens.pop(token, None)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(int(user_id), None)
+
+    def purge(self, now):
+        # Drops expired holds from the view
+        with self._lock:
+            for _, holds in self._users.values():
+                for medicine_id in list(holds):
+                    tokens = holds[medicine_id]
+                    for token in [token for token, (_, expires_at) in tokens.items() if expires_at <= now]:
+                        del tokens[token]
+                    if not tokens:
+                        del holds[medicine_id]
+
+    def start_reclaimer(self, app, mysql, interval=RECLAIM_INTERVAL_SECONDS):
+        # Deletes expired reservations from MySQL in the background
+        if self._thread is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    now = utc_now()
+                    with app.app_context():
+                        self.reclaimed += Reservation.purge_expired(mysql.connection, now)
+                    self.purge(now)
+                except Exception as e:
+                    app.logger.warning(f"Reservation reclaim failed: {str(e)}")
+
+        self._thread = threading.Thread(target=run, name='reservation-reclaimer', daemon=True)
+        self._thread.start()
+
+
+reservation_view = ReservationView()
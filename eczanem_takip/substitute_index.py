@@ -0,0 +1,198 @@
+import heapq
+import threading
+import time
+
+# In-memory therapeutic-substitute index.
+# Medicines are grouped by ATC prefix, equivalent medicine group and exact active-ingredient set.
+# Writes only mark a medicine as stale; the next lookup reloads those medicines from MySQL. Writes made by
+# other processes are not marked here, so the whole index is also reloaded every REFRESH_SECONDS. A full
+# reload builds the new maps without the lock and swaps them in, so lookups keep using the old ones
+# meanwhile; medicines marked stale during the reload are re-read after the swap.
+
+# Prefix length of each ATC level (anatomical group .. chemical substance)
+ATC_LEVELS = {1: 1, 2: 3, 3: 4, 4: 5, 5: 7}
+DEFAULT_ATC_LEVEL = 4
+DEFAULT_LIMIT = 50
+REFRESH_SECONDS = 300
+
+SAME_INGREDIENTS = 'same_active_ingredients'
+SAME_GROUP = 'same_equivalent_group'
+
+
+class SubstituteIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loading = False
+        # Bumped by clear(), so a reload that started before it is not swapped in
+        self._clears = 0
+        self._reset()
+
+    def _reset(self):
+        self._loaded = False
+        self._loaded_at = None
+        self._stale = set()
+        self._medicines = {}
+        self._by_barcode = {}
+        self._by_atc = {level: {} for level in ATC_LEVELS}
+        self._by_group = {}
+        self._by_ingredients = {}
+
+    def load(self, connection):
+        with self._lock:
+            self._loading = True
+            clears = self._clears
+            # The catalog read below covers the medicines marked so far; later marks are kept for the next lookup
+            self._stale = set()
+        try:
+            cursor = connection.cursor()
+            cursor.execute("""
+                SELECT id, barcode, name, brand, form, atc_code, equivalent_medicine_group FROM medicine
+            """)
+            medicines = cursor.fetchall()
+            cursor.execute("SELECT medicine_id, active_ingredient_id FROM medicine_active_ingredient")
+            links = cursor.fetchall()
+            cursor.close()
+
+            ingredients = {}
+            for medicine_id, ingredient_id in links:
+                ingredients.setdefault(medicine_id, set()).add(ingredient_id)
+            fresh = SubstituteIndex()
+            for row in medicines:
+                fresh._add(row, ingredients.get(row[0], ()))
+        finally:
+            with self._lock:
+                self._loading = False
+        with self._lock:
+            if clears != self._clears:
+                return
+            self._medicines, self._by_barcode = fresh._medicines, fresh._by_barcode
+            self._by_atc, self._by_group, self._by_ingredients = fresh._by_atc, fresh._by_group, fresh._by_ingredients
+            self._loaded = True
+            self._loaded_at = time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._clears += 1
+            self._reset()
+
+    def mark_stale(self, medicine_id):
+        with self._lock:
+            if self._loaded or self._loading:
+                self._stale.add(medicine_id)
+
+    def ensure_current(self, connection):
+        # Only one caller reloads a stale index; the others keep using it until the new one is swapped in
+        with self._lock:
+            reload = not self._loaded or (not self._loading
+                                          and time.monotonic() - self._loaded_at > REFRESH_SECONDS)
+        if reload:
+            self.load(connection)
+        with self._lock:
+            # During a reload the marks wait for the swap, which would otherwise drop their re-read rows
+            if not self._stale or self._loading:
+                return
+            stale = sorted(self._stale)
+            self._stale.clear()
+
+        placeholders = ', '.join(['%s'] * len(stale))
+        cursor = connection.cursor()
+        cursor.execute(f"""
+            SELECT id, barcode, name, brand, form, atc_code, equivalent_medicine_group
+            FROM medicine WHERE id IN ({placeholders})
+        """, tuple(stale))
+        medicines = cursor.fetchall()
+        cursor.execute(f"""
+            SELECT medicine_id, active_ingredient_id FROM medicine_active_ingredient
+            WHERE medicine_id IN ({placeholders})
+        """, tuple(stale))
+        links = cursor.fetchall()
+        cursor.close()
+
+        ingredients = {}
+        for medicine_id, ingredient_id in links:
+            ingredients.setdefault(medicine_id, set()).add(ingredient_id)
+        with self._lock:
+            for medicine_id in stale:
+                self._remove(medicine_id)
+            for row in medicines:
+                self._add(row, ingredients.get(row[0], ()))
+
+    def _keys(self, entry):
+        atc_code = (entry['atc_code'] or '').strip().upper()
+        for level, length in ATC_LEVELS.items():
+            if len(atc_code) >= length:
+                yield self._by_atc[level], atc_code[:length]
+        if entry['equivalent_medicine_group']:
+            yield self._by_group, entry['equivalent_medicine_group']
+        if entry['ingredients']:
+            yield self._by_ingredients, entry['ingredients']
+
+    def _add(self, row, ingredient_ids):
+        medicine_id, barcode, name, brand, form, atc_code, equivalent_medicine_group = row
+        entry = {
+            'id': medicine_id,
+            'barcode': barcode,
+            'name': name,
+            'brand': brand,
+            'form': form,
+            'atc_code': atc_code,
+            'equivalent_medicine_group': (equivalent_medicine_group or '').strip() or None,
+            'ingredients': frozenset(ingredient_ids)
+        }
+        self._medicines[medicine_id] = entry
+        self._by_barcode[barcode] = medicine_id
+        for groups, key in self._keys(entry):
+            groups.setdefault(key, set()).add(medicine_id)
+
+    def _remove(self, medicine_id):
+        entry = self._medicines.pop(medicine_id, None)
+        if entry is None:
+            return
+        if self._by_barcode.get(entry['barcode']) == medicine_id:
+            del self._by_barcode[entry['barcode']]
+        for groups, key in self._keys(entry):
+            members = groups.get(key)
+            if members is not None:
+                members.discard(medicine_id)
+                if not members:
+                    del groups[key]
+
+    def get(self, barcode):
+        with self._lock:
+            medicine_id = self._by_barcode.get(barcode)
+            return dict(self._medicines[medicine_id]) if medicine_id is not None else None
+
+    def substitutes(self, barcode, atc_level=DEFAULT_ATC_LEVEL, limit=DEFAULT_LIMIT):
+        # Returns [(entry, reasons), ...] best match first; None if the barcode is unknown.
+        # ATC matches are only considered down to `atc_level` (5 = same substance, 1 = same anatomical group).
+        with self._lock:
+            medicine_id = self._by_barcode.get(barcode)
+            if medicine_id is None:
+                return None
+            entry = self._medicines[medicine_id]
+
+            reasons = {}
+            groups = []
+            if entry['ingredients']:
+                groups.append((SAME_INGREDIENTS, self._by_ingredients.get(entry['ingredients'], ())))
+            if entry['equivalent_medicine_group']:
+                groups.append((SAME_GROUP, self._by_group.get(entry['equivalent_medicine_group'], ())))
+            atc_code = (entry['atc_code'] or '').strip().upper()
+            for level in sorted(ATC_LEVELS, reverse=True):
+                length = ATC_LEVELS[level]
+                if level >= atc_level and len(atc_code) >= length:
+                    groups.append((f"atc_level_{level}", self._by_atc[level].get(atc_code[:length], ())))
+
+            for rank, (reason, members) in enumerate(groups):
+                for member_id in members:
+                    if member_id != medicine_id:
+                        reasons.setdefault(member_id, (rank, []))[1].append(reason)
+
+            medicines = self._medicines
+            best = heapq.nsmallest(limit, reasons, key=lambda member_id: (reasons[member_id][0],
+                                                                          medicines[member_id]['name'] or '',
+                                                                          member_id))
+            return [(dict(medicines[member_id]), reasons[member_id][1]) for member_id in best]
+
+
+substitute_index = SubstituteIndex()
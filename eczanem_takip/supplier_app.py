@@ -1,8 +1,8 @@
 import MySQLdb
 from flask import Blueprint, request, jsonify
-from flask_mysqldb import MySQL
+from db_router import RoutedMySQL, replica_read
 
-mysql = MySQL()
+mysql = RoutedMySQL()
 supplier_bp = Blueprint('supplier', __name__)
 
 
@@ -33,6 +33,7 @@ def add_supplier():
 
 # Get All Suppliers (Read)
 @supplier_bp.route('/get_all_suppliers', methods=['GET'])
+@replica_read
 def get_all_suppliers():
     try:
         cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
@@ -0,0 +1,232 @@
+import calendar
+import datetime
+import heapq
+import threading
+import time
+
+from models.SalesRollup import SalesRollup
+
+# Streaming top sellers for the 1, 6 and 12 month top_medicines windows.
+# Every day of the last year has a Space-Saving sketch fed by recorded sales. Each window keeps a sketch merged
+# from its days, rebuilt when the date moves and updated in place by new sales, plus its counters in sales
+# order, so a top-x answer is a slice. Counts carry the Space-Saving error bound: the true total lies in
+# [count - error, count]. The sketches are rebuilt from the daily rollup at start-up and every REBUILD_SECONDS,
+# which also brings in sales recorded by other processes.
+
+WINDOW_MONTHS = (1, 6, 12)
+DAY_CAPACITY = 1024
+WINDOW_CAPACITY = 2048
+REBUILD_SECONDS = 900
+# Larger top_medicines requests go to SQL; the tail of a sketch is its least accurate part
+MAX_SKETCH_X = 200
+
+
+def months_before(day, months):
+    # `day - INTERVAL months MONTH` with MySQL's clamping to the end of shorter months
+    month_index = day.year * 12 + day.month - 1 - months
+    year, month = divmod(month_index, 12)
+    return datetime.date(year, month + 1, min(day.day, calendar.monthrange(year, month + 1)[1]))
+
+
+def as_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+class SpaceSaving:
+    __slots__ = ('capacity', 'counts', 'errors', '_heap')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # Lazy min-heap of (count, item); entries whose count is out of date are skipped when popped
+        self._heap = []
+
+    def add(self, item, quantity):
+        counts = self.counts
+        if item in counts:
+            counts[item] += quantity
+        elif len(counts) < self.capacity:
+            counts[item] = quantity
+            self.errors[item] = 0
+        else:
+            while True:
+                count, evicted = heapq.heappop(self._heap)
+                if counts.get(evicted) == count:
+                    break
+            del counts[evicted]
+            del self.errors[evicted]
+            counts[item] = count + quantity
+            self.errors[item] = count
+        heapq.heappush(self._heap, (counts[item], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, key) for key, count in counts.items()]
+            heapq.heapify(self._heap)
+
+    def minimum(self):
+        # What an item the sketch does not track may have sold: the smallest counter once the sketch is full
+        return min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+
+    @classmethod
+    def merge(cls, sketches, capacity):
+        # Mergeable Space-Saving: an item missing from a full sketch may have sold up to that sketch's minimum
+        # counter there, so the minimum is added to both its count and its error. The `capacity` largest
+        # counters are kept, and [count - error, count] still bounds every true total.
+        counts, errors = {}, {}
+        minimums = 0
+        for sketch in sketches:
+            minimum = sketch.minimum()
+            minimums += minimum
+            # Stored relative to the minimum, which every item gets unless the sketch tracks it
+            for item, count in sketch.counts.items():
+                counts[item] = counts.get(item, 0) + count - minimum
+                errors[item] = errors.get(item, 0) + sketch.errors[item] - minimum
+        merged = cls(capacity)
+        for item in heapq.nlargest(capacity, counts, key=counts.get):
+            merged.counts[item] = counts[item] + minimums
+            merged.errors[item] = errors[item] + minimums
+        merged._heap = [(count, item) for item, count in merged.counts.items()]
+        heapq.heapify(merged._heap)
+        return merged
+
+    def ordered(self):
+        return sorted(self.counts.items(), key=lambda entry: (-entry[1], entry[0]))
+
+
+class TopSellers:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._days = {}
+        self._windows = {}
+        self._windows_date = None
+        self._loaded_at = None
+        # Sales recorded while a rebuild reads the rollup, replayed on the new sketches; None while no rebuild
+        # runs. A None entry is a sale that could not be recorded, which leaves the new sketches stale.
+        self._pending = None
+        self._rebuilt = threading.Condition(self._lock)
+
+    def rebuild(self, connection, today=None):
+        # Only one caller scans the rollup; the others wait for its result. A sale committed just before the
+        # scan and recorded after it started is counted twice until the next rebuild rather than dropped.
+        today = today or datetime.date.today()
+        with self._lock:
+            waited = False
+            while self._pending is not None:
+                self._rebuilt.wait()
+                waited = True
+            if waited and self._loaded_at is not None:
+                return
+            self._pending = []
+        try:
+            source, params = SalesRollup.source(months=max(WINDOW_MONTHS))
+            cursor = connection.cursor()
+            cursor.execute(f"""
+                SELECT sale_date, medicine_id, SUM(quantity)
+                FROM {source} ms
+                GROUP BY sale_date, medicine_id
+            """, params)
+            rows = cursor.fetchall()
+            cursor.close()
+        except Exception:
+            with self._lock:
+                self._pending = None
+                self._rebuilt.notify_all()
+            raise
+
+        days = {}
+        for sale_date, medicine_id, quantity in rows:
+            day = days.get(sale_date)
+            if day is None:
+                day = days[sale_date] = SpaceSaving(DAY_CAPACITY)
+            day.add(medicine_id, int(quantity))
+        with self._lock:
+            stale = False
+            for entry in self._pending:
+                if entry is None:
+                    stale = True
+                    continue
+                sale_day, lines = entry
+                day = days.get(sale_day)
+                if day is None:
+                    day = days[sale_day] = SpaceSaving(DAY_CAPACITY)
+                for medicine_id, quantity in lines:
+                    day.add(medicine_id, quantity)
+            self._pending = None
+            self._days = days
+            self._windows = {}
+            self._windows_date = None
+            self._loaded_at = None if stale else time.monotonic()
+            self._merge_windows(today)
+            self._rebuilt.notify_all()
+
+    def ensure_loaded(self, connection):
+        # Stale sketches keep answering while another request rebuilds them
+        with self._lock:
+            loaded_at = self._loaded_at
+            rebuilding = self._pending is not None
+        if loaded_at is None or (not rebuilding and time.monotonic() - loaded_at > REBUILD_SECONDS):
+            self.rebuild(connection)
+
+    def _merge_windows(self, today):
+        oldest = months_before(today, max(WINDOW_MONTHS))
+        for day in [day for day in self._days if day < oldest]:
+            del self._days[day]
+        self._windows = {}
+        for months in WINDOW_MONTHS:
+            cutoff = months_before(today, months)
+            sketch = SpaceSaving.merge([sketch for day, sketch in self._days.items() if day >= cutoff],
+                                       WINDOW_CAPACITY)
+            self._windows[months] = [cutoff, sketch, None]
+        self._windows_date = today
+
+    def record(self, sale_date, lines):
+        # lines: [(medicine_id, quantity)] of one committed sale; never raises, the sale is already committed
+        with self._lock:
+            if self._loaded_at is None and self._pending is None:
+                return
+            try:
+                day = as_date(sale_date)
+            except (TypeError, ValueError):
+                # Left to the next rebuild, which reads the sale back from the rollup
+                self._loaded_at = None
+                if self._pending is not None:
+                    self._pending.append(None)
+                return
+            if self._pending is not None:
+                self._pending.append((day, lines))
+            if self._loaded_at is None:
+                return
+            sketch = self._days.get(day)
+            if sketch is None:
+                sketch = self._days[day] = SpaceSaving(DAY_CAPACITY)
+            for medicine_id, quantity in lines:
+                sketch.add(medicine_id, quantity)
+            for window in self._windows.values():
+                if day >= window[0]:
+                    for medicine_id, quantity in lines:
+                        window[1].add(medicine_id, quantity)
+                    window[2] = None
+
+    def top(self, months, x, today=None):
+        # [(medicine_id, count, error)] of the x best sellers of the last `months` months
+        today = today or datetime.date.today()
+        with self._lock:
+            if self._windows_date != today:
+                self._merge_windows(today)
+            window = self._windows[months]
+            if window[2] is None:
+                window[2] = window[1].ordered()
+            errors = window[1].errors
+            return [(medicine_id, count, errors[medicine_id]) for medicine_id, count in window[2][:x]]
+
+    def stats(self):
+        with self._lock:
+            return {"days": len(self._days),
+                    "windows": {months: len(window[1].counts) for months, window in self._windows.items()}}
+
+
+top_sellers = TopSellers()